@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Check the installation of the model weights in the cache
+directory (ref. deepskin.checkpoints), replacing the google-drive
+download with a local zip stand-in: checksum verification and
+mismatch, download failure, re-installation of a corrupted file,
+concurrent installation by multiple processes, stale lock
+take-over and lock refresh during a long download.
+
+Usage
+-----
+  $ python benchmarks/checkpoints_check.py
+  $ python benchmarks/checkpoints_check.py --workers 8
+'''
+
+import os
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from zipfile import ZipFile
+from functools import partial
+
+import deepskin.checkpoints as checkpoints
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+
+def parse_args ():
+
+  description = 'Deepskin model weights installation check'
+
+  parser = argparse.ArgumentParser(
+    prog='checkpoints_check',
+    argument_default=None,
+    add_help=True,
+    prefix_chars='-',
+    allow_abbrev=True,
+    description=description,
+  )
+  parser.add_argument(
+    '--workers', '-w',
+    dest='workers',
+    required=False,
+    type=int,
+    default=4,
+    help='Number of processes which install the weights concurrently',
+  )
+  parser.add_argument(
+    '--delay', '-d',
+    dest='delay',
+    required=False,
+    type=float,
+    default=1.,
+    help='Duration (sec) of the simulated download',
+  )
+
+  args = parser.parse_args()
+
+  return args
+
+def stand_in (payload : str, counter : str, delay : float, Id : str, output : str) -> None :
+  '''
+  Local replacement of the google-drive download: store the
+  payload file in the zip archive and count the downloads
+  '''
+  with open(counter, 'a') as fp:
+    fp.write(f'{os.getpid()}\n')
+  time.sleep(delay)
+  with ZipFile(output, 'w') as zipper:
+    zipper.write(payload, arcname=f'{Id}.h5')
+
+def failure (Id : str, output : str) -> None :
+  '''
+  Download which fails without writing the archive
+  '''
+  raise ConnectionError('simulated network failure')
+
+def downloads (counter : str) -> int :
+  '''
+  Number of downloads recorded in the counter file
+  '''
+  if not os.path.exists(counter):
+    return 0
+  with open(counter, 'r') as fp:
+    return len(fp.read().split())
+
+def leftovers (outdir : str, model_name : str) -> list :
+  '''
+  Temporary directories and lock files left in the cache
+  '''
+  return sorted(f for f in os.listdir(outdir)
+    if f.startswith(f'.{model_name}-') or f.endswith(('.lock', '.stale'))
+  )
+
+def install (outdir : str, model_name : str, sha256 : str, downloader) -> str :
+  '''
+  Install the weights from a worker process
+  '''
+  return checkpoints.download_model_weights(
+    Id=model_name,
+    model_name=model_name,
+    outdir=outdir,
+    sha256=sha256,
+    downloader=downloader,
+  )
+
+def main ():
+
+  args = parse_args()
+
+  model_name = 'deepskin_check'
+  workdir = tempfile.mkdtemp(prefix='deepskin-checkpoints-')
+  results = {}
+
+  try:
+    payload = os.path.join(workdir, 'payload.h5')
+    with open(payload, 'wb') as fp:
+      fp.write(os.urandom(1 << 20))
+    with open(payload, 'rb') as fp:
+      sha256 = hashlib.sha256(fp.read()).hexdigest()
+
+    def case (name : str) -> tuple :
+      outdir = os.path.join(workdir, name)
+      os.makedirs(outdir)
+      counter = os.path.join(workdir, f'{name}.count')
+      return outdir, counter, os.path.join(outdir, f'{model_name}.h5')
+
+    # installation with the expected digest and re-use of the file
+    outdir, counter, filename = case('install')
+    downloader = partial(stand_in, payload, counter, 0.)
+    installed = install(outdir, model_name, sha256, downloader)
+    again = install(outdir, model_name, sha256, downloader)
+    results['install'] = all((
+      installed == again == filename,
+      checkpoints.sha256sum(filename) == sha256,
+      os.path.isfile(f'{filename}.sha256'),
+      downloads(counter) == 1,
+      not leftovers(outdir, model_name),
+    ))
+
+    # corrupted cached file: re-installed by get_model_weights
+    with open(filename, 'ab') as fp:
+      fp.write(b'corrupted')
+    os.environ[checkpoints.CACHE_DIR_ENV] = outdir
+    restored = checkpoints.get_model_weights(model_name=model_name, Id=model_name, downloader=downloader)
+    results['re-install of a corrupted file'] = all((
+      restored == filename,
+      checkpoints.sha256sum(filename) == sha256,
+      downloads(counter) == 2,
+    ))
+
+    # checksum mismatch: nothing is installed
+    outdir, counter, filename = case('mismatch')
+    try:
+      install(outdir, model_name, '0' * 64, partial(stand_in, payload, counter, 0.))
+      results['checksum mismatch'] = False
+    except ValueError:
+      results['checksum mismatch'] = not os.path.exists(filename) and not leftovers(outdir, model_name)
+
+    # download failure: RuntimeError and nothing is installed
+    outdir, counter, filename = case('failure')
+    try:
+      install(outdir, model_name, sha256, failure)
+      results['download failure'] = False
+    except RuntimeError:
+      results['download failure'] = not os.path.exists(filename) and not leftovers(outdir, model_name)
+
+    # concurrent installation: the weights are downloaded once
+    outdir, counter, filename = case('concurrent')
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(args.workers) as pool:
+      paths = pool.starmap(install, [
+        (outdir, model_name, sha256, partial(stand_in, payload, counter, args.delay))
+      ] * args.workers)
+    results['concurrent install'] = all((
+      set(paths) == {filename},
+      downloads(counter) == 1,
+      checkpoints.sha256sum(filename) == sha256,
+      not leftovers(outdir, model_name),
+    ))
+
+    # stale lock of a killed worker: taken over
+    outdir, counter, filename = case('stale')
+    lock = f'{filename}.lock'
+    open(lock, 'w').close()
+    past = time.time() - 2 * checkpoints.LOCK_TIMEOUT
+    os.utime(lock, (past, past))
+    tic = time.time()
+    install(outdir, model_name, sha256, partial(stand_in, payload, counter, 0.))
+    results['stale lock take-over'] = time.time() - tic < checkpoints.LOCK_TIMEOUT and not leftovers(outdir, model_name)
+
+    # the stale lock is replaced by the fresh lock of another
+    # waiter before it is removed: the fresh lock is preserved
+    open(lock, 'w').close()
+    os.utime(lock, (past, past))
+    stale = os.stat(lock)
+    os.remove(lock)
+    with open(lock, 'w') as fp:
+      fp.write('fresh')
+    fresh = os.stat(lock)
+    checkpoints._FileLock(lock)._remove_stale(stale)
+    results['stale lock race'] = os.path.exists(lock) and os.stat(lock).st_ino == fresh.st_ino
+    os.remove(lock)
+
+    # long download: the lock is refreshed and not considered stale
+    outdir, counter, filename = case('heartbeat')
+    timeout, heartbeat = checkpoints.LOCK_TIMEOUT, checkpoints.LOCK_HEARTBEAT
+    checkpoints.LOCK_TIMEOUT, checkpoints.LOCK_HEARTBEAT = 4 * args.delay / 10, args.delay / 10
+    try:
+      downloader = partial(stand_in, payload, counter, args.delay)
+      worker = threading.Thread(target=install, args=(outdir, model_name, sha256, downloader))
+      worker.start()
+      time.sleep(args.delay / 10)
+      install(outdir, model_name, sha256, downloader)
+      worker.join()
+    finally:
+      checkpoints.LOCK_TIMEOUT, checkpoints.LOCK_HEARTBEAT = timeout, heartbeat
+    results['lock refresh'] = downloads(counter) == 1 and not leftovers(outdir, model_name)
+
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+
+  print(' | '.join(['check', 'result']))
+  for name, passed in results.items():
+    print(' | '.join([name, 'OK' if passed else 'FAILED']))
+
+  if not all(results.values()):
+    exit(1)
+
+
+if __name__ == '__main__':
+
+  main ()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compare the fused feature extraction (FeatureEngine) against
+a frozen copy of the previous implementation (mahotas Haralick
+features, float32 cv2.meanStdDev on the normalized image and
+NaN-masked redness scores), in which each feature function
+converts and normalizes the whole image, in terms of time
+and of agreement of the feature values.
+
+The color statistics are now computed exactly from the uint8
+histograms, while the previous float32 cv2.meanStdDev rounds the
+normalized values (relative error ~6e-8 for each value): the two
+agree within 1e-6, and the new statistics are also compared with
+an exact float64 reference (tolerance 1e-12).
+
+The wound is simulated as an ellipse on a synthetic image,
+unless real image/mask files are given.
+
+Usage
+-----
+  $ python benchmarks/features_time.py --size 4000 3000
+  $ python benchmarks/features_time.py --image wound.png --mask wound_mask.png
+'''
+
+import cv2
+import argparse
+import numpy as np
+from time import perf_counter as now
+
+from deepskin.imgproc import get_perilesion_mask
+from deepskin.features import FeatureEngine
+from deepskin.features import evaluate_features
+
+# NOTE: mahotas is not a requirement of the package anymore, but
+# it is the reference of the previous Haralick implementation
+# (ref. benchmarks/requirements.txt)
+try:
+  import mahotas as mh
+except ImportError:
+  mh = None
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+
+def parse_args ():
+
+  description = 'Deepskin feature extraction benchmark'
+
+  parser = argparse.ArgumentParser(
+    prog='features_time',
+    argument_default=None,
+    add_help=True,
+    prefix_chars='-',
+    allow_abbrev=True,
+    description=description,
+  )
+  parser.add_argument(
+    '--image', '-i',
+    dest='image',
+    required=False,
+    type=str,
+    default=None,
+    help='Image file; default: a synthetic image',
+  )
+  parser.add_argument(
+    '--mask', '-m',
+    dest='mask',
+    required=False,
+    type=str,
+    default=None,
+    help='Wound mask file (gray-scale); default: a synthetic ellipse',
+  )
+  parser.add_argument(
+    '--size', '-s',
+    dest='size',
+    required=False,
+    nargs=2,
+    type=int,
+    default=[4000, 3000],
+    help='Width and height of the synthetic image',
+  )
+  parser.add_argument(
+    '--repeat', '-r',
+    dest='repeat',
+    required=False,
+    type=int,
+    default=3,
+    help='Number of repetitions of each measure',
+  )
+
+  args = parser.parse_args()
+
+  return args
+
+def legacy_haralick (masked : np.ndarray) -> np.ndarray :
+  '''
+  Previous implementation of get_haralick (mahotas)
+  '''
+  if cv2.countNonZero(masked[..., 0]) < 10:
+    return np.zeros(shape=(13, ), dtype=np.float32)
+  return mh.features.haralick(
+    masked,
+    ignore_zeros=True,
+    return_mean=True,
+    distance=1
+  )
+
+def legacy_channel_stats (img : np.ndarray, mask : np.ndarray, code : int = None) -> tuple :
+  '''
+  Previous implementation of get_rgb/hsv/lab_channel_stats
+  (float32 cv2.meanStdDev on the normalized image)
+  '''
+  if code is not None:
+    img = cv2.cvtColor(img, code)
+  img = np.float32(img)
+  img *= 1. / 255
+  return cv2.meanStdDev(src=img, mask=mask)
+
+def exact_channel_stats (img : np.ndarray, mask : np.ndarray, code : int = None) -> tuple :
+  '''
+  Exact average and standard deviation of the normalized
+  channels, computed in float64 on the masked pixels
+  '''
+  if code is not None:
+    img = cv2.cvtColor(img, code)
+  pixels = img[mask != 0].astype(np.float64) / 255
+  return pixels.mean(axis=0), pixels.std(axis=0)
+
+def legacy_redness (img : np.ndarray, mask : np.ndarray) -> tuple :
+  '''
+  Previous implementation of get_park_redness and
+  get_amparo_redness (NaN-masked full-image arrays)
+  '''
+  image = cv2.bitwise_and(img, img, mask=mask)
+  N = np.sum(mask != 0)
+  if N == 0:
+    return -0.5, 0.0
+
+  r, g, b = cv2.split(np.float32(image))
+  f2 = (2*r - g - b) / (2 * (r + g + b + 1e-5))
+  f2 = f2 * np.where(mask != 0, 1, np.nan)
+  park = np.nansum(f2) / N
+
+  h, s, v = cv2.split(cv2.cvtColor(image, cv2.COLOR_RGB2HSV))
+  f1 = (np.float32(h) * np.float32(s)) / (255 * 255)
+  f1 = f1 * np.where(mask != 0, 1, np.nan)
+  amparo = np.nansum(f1) / N
+
+  return park, amparo
+
+def legacy_features (img : np.ndarray, mask : np.ndarray, prefix : str) -> dict :
+  '''
+  Frozen copy of the previous implementation of evaluate_features
+  '''
+  masked = cv2.bitwise_and(img, img, mask=mask)
+  features = {f'{prefix}haralick{i:d}' : v
+    for i, v in enumerate(legacy_haralick(masked).ravel())
+  }
+  for code, channels in ((None, 'RGB'),
+                         (cv2.COLOR_RGB2HSV, 'HSV'),
+                         (cv2.COLOR_RGB2LAB, 'Lab')):
+    avg, std = legacy_channel_stats(img=img, mask=mask, code=code)
+    features.update({f'{prefix}avg{c}' : v for c, v in zip(channels, avg.ravel())})
+    features.update({f'{prefix}std{c}' : v for c, v in zip(channels, std.ravel())})
+  park, amparo = legacy_redness(img=img, mask=mask)
+  features[f'{prefix}park'] = park
+  features[f'{prefix}amparo'] = amparo
+  return features
+
+def feature_group (name : str) -> str :
+  '''
+  Get the group of a feature name for the parity check
+  '''
+  if 'haralick' in name:
+    return 'haralick'
+  if name.endswith(('park', 'amparo')):
+    return 'redness'
+  return 'color stats'
+
+def synthetic_data (width : int, height : int) -> tuple :
+  '''
+  Build a textured image with an elliptic wound
+  '''
+  rng = np.random.default_rng(42)
+  img = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+  img = cv2.resize(img, dsize=(width, height), interpolation=cv2.INTER_CUBIC)
+  mask = np.zeros(shape=(height, width), dtype=np.uint8)
+  cv2.ellipse(
+    mask,
+    center=(width // 2, height // 2),
+    axes=(width // 8, height // 10),
+    angle=30, startAngle=0, endAngle=360,
+    color=255, thickness=-1,
+  )
+  return img, mask
+
+def timeit (func, repeat : int) -> float :
+  '''
+  Get the median execution time of a function
+  '''
+  times = []
+  for _ in range(repeat):
+    tic = now()
+    func()
+    times.append(now() - tic)
+  return sorted(times)[len(times) // 2]
+
+def main ():
+
+  args = parse_args()
+
+  if mh is None:
+    raise SystemExit((
+      'The benchmark requires mahotas as reference implementation. '
+      'Install it with: pip install -r benchmarks/requirements.txt'
+    ))
+
+  if args.image is not None:
+    img = cv2.imread(args.image, cv2.IMREAD_COLOR)[..., ::-1].copy()
+    mask = cv2.imread(args.mask, cv2.IMREAD_GRAYSCALE)
+  else:
+    img, mask = synthetic_data(*args.size)
+
+  periwound = get_perilesion_mask(mask=mask, ksize=(20, 20))
+
+  def legacy ():
+    return {
+      **legacy_features(img, mask, 'w_'),
+      **legacy_features(img, periwound, 'p_'),
+    }
+
+  def fused ():
+    engine = FeatureEngine(img, masks=[mask, periwound])
+    return {
+      **engine.evaluate(mask, 'w_'),
+      **engine.evaluate(periwound, 'p_'),
+    }
+
+  def regions ():
+    labels = np.uint8(mask != 0) + 2 * np.uint8(periwound != 0)
+    engine = FeatureEngine(img, masks=[labels])
+    return engine.evaluate_regions(labels, regions={'w_' : (1, 3), 'p_' : (2, 3)})
+
+  # tolerance of the relative differences of each feature group
+  tolerances = {
+    # NumPy GLCM engine against mahotas (ref. haralick_parity.py)
+    'haralick' : 1e-9,
+    # exact histogram statistics against the float32 values rounded
+    # by cv2.meanStdDev (differences of ~1e-7 are expected)
+    'color stats' : 1e-6,
+    # float32 pixel-wise scores summed in float64 (ref. redness_parity.py)
+    'redness' : 1e-9,
+  }
+
+  failed = 0
+  reference = legacy()
+  for name, res in (('fused', fused()),
+                    ('regions', regions()),
+                    ('evaluate_features', {**evaluate_features(img, mask, 'w_'), **evaluate_features(img, periwound, 'p_')})):
+    assert list(res) == list(reference)
+    for group, tol in tolerances.items():
+      keys = [k for k in reference if feature_group(k) == group]
+      diff = max(abs(float(res[k]) - float(reference[k])) / max(abs(float(reference[k])), 1.) for k in keys)
+      exact = sum(res[k] == reference[k] for k in keys)
+      failed += diff > tol
+      print(f'{name} ({group}): max relative difference {diff:.3e} '
+            f'(tolerance {tol:.0e}, {exact}/{len(keys)} identical values)')
+
+  # the histogram statistics are exact up to the float64 rounding
+  exact = {}
+  for region, m in (('w_', mask), ('p_', periwound)):
+    for code, channels in ((None, 'RGB'),
+                           (cv2.COLOR_RGB2HSV, 'HSV'),
+                           (cv2.COLOR_RGB2LAB, 'Lab')):
+      avg, std = exact_channel_stats(img=img, mask=m, code=code)
+      exact.update({f'{region}avg{c}' : v for c, v in zip(channels, avg)})
+      exact.update({f'{region}std{c}' : v for c, v in zip(channels, std)})
+  for name, values, tol in (('previous meanStdDev', reference, None), ('histograms', fused(), 1e-12)):
+    diff = max(abs(float(values[k]) - exact[k]) / max(abs(exact[k]), 1.) for k in exact)
+    print(f'{name} vs exact float64 (color stats): max relative difference {diff:.3e}')
+    if tol is not None:
+      failed += diff > tol
+
+  t_legacy = timeit(legacy, args.repeat)
+  t_fused = timeit(fused, args.repeat)
+  t_regions = timeit(regions, args.repeat)
+
+  print(' | '.join(['image', 'wound pixels', 'legacy (s)', 'fused (s)', 'regions (s)', 'speedup']))
+  print(' | '.join([
+    f'{img.shape[1]}x{img.shape[0]}',
+    f'{cv2.countNonZero(mask)}',
+    f'{t_legacy:.3f}',
+    f'{t_fused:.3f}',
+    f'{t_regions:.3f}',
+    f'{t_legacy / min(t_fused, t_regions):.2f}x',
+  ]))
+
+  if failed:
+    exit(1)
+
+
+if __name__ == '__main__':
+
+  main ()
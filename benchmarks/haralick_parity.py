@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Check the parity of the NumPy co-occurrence/Haralick engine
+(ref. deepskin.features.get_haralick) against the mahotas
+implementation used by the previous versions of the package,
+i.e. mahotas.features.haralick(masked, ignore_zeros=True,
+return_mean=True, distance=1), and measure the speedup.
+
+The inputs are masked RGB images as in evaluate_features:
+random textures and synthetic wounds of different sizes,
+shapes, dynamic ranges and sparsity.
+
+Usage
+-----
+  $ python benchmarks/haralick_parity.py --cases 200
+'''
+
+import cv2
+import argparse
+import numpy as np
+from time import perf_counter as now
+
+from deepskin.features import get_haralick
+
+# NOTE: mahotas is not a requirement of the package anymore, but
+# it is the reference of the previous Haralick implementation
+# (ref. benchmarks/requirements.txt)
+try:
+  import mahotas as mh
+except ImportError:
+  mh = None
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+
+def parse_args ():
+
+  description = 'Deepskin Haralick features parity check'
+
+  parser = argparse.ArgumentParser(
+    prog='haralick_parity',
+    argument_default=None,
+    add_help=True,
+    prefix_chars='-',
+    allow_abbrev=True,
+    description=description,
+  )
+  parser.add_argument(
+    '--cases', '-c',
+    dest='cases',
+    required=False,
+    type=int,
+    default=200,
+    help='Number of random test cases',
+  )
+  parser.add_argument(
+    '--rtol',
+    dest='rtol',
+    required=False,
+    type=float,
+    default=1e-9,
+    help='Relative tolerance of the parity check',
+  )
+  parser.add_argument(
+    '--atol',
+    dest='atol',
+    required=False,
+    type=float,
+    default=1e-12,
+    help='Absolute tolerance of the parity check',
+  )
+  parser.add_argument(
+    '--size', '-s',
+    dest='size',
+    required=False,
+    nargs=2,
+    type=int,
+    default=[4000, 3000],
+    help='Width and height of the synthetic image used for the benchmark',
+  )
+  parser.add_argument(
+    '--repeat', '-r',
+    dest='repeat',
+    required=False,
+    type=int,
+    default=3,
+    help='Number of repetitions of each measure',
+  )
+
+  args = parser.parse_args()
+
+  return args
+
+def reference (masked : np.ndarray) -> np.ndarray :
+  '''
+  Previous implementation of get_haralick
+  '''
+  if cv2.countNonZero(masked[..., 0]) < 10:
+    return np.zeros(shape=(13, ), dtype=np.float32)
+  return mh.features.haralick(
+    masked,
+    ignore_zeros=True,
+    return_mean=True,
+    distance=1
+  )
+
+def random_case (rng : np.random.Generator) -> np.ndarray :
+  '''
+  Build a random masked RGB image
+  '''
+  h, w = rng.integers(8, 300, size=2)
+  # random dynamic range (low values lead to small matrices)
+  levels = int(rng.choice([2, 8, 64, 256]))
+  img = rng.integers(0, levels, size=(h, w, 3), dtype=np.uint8)
+
+  if rng.random() < 0.5:
+    # smooth texture
+    img = cv2.GaussianBlur(img, ksize=(0, 0), sigmaX=float(rng.uniform(0.5, 3)))
+
+  mask = np.zeros(shape=(h, w), dtype=np.uint8)
+  kind = rng.integers(3)
+  if kind == 0:
+    # elliptic wound
+    cv2.ellipse(
+      mask,
+      center=(int(rng.integers(w)), int(rng.integers(h))),
+      axes=(int(rng.integers(1, w)), int(rng.integers(1, h))),
+      angle=float(rng.uniform(0, 180)), startAngle=0, endAngle=360,
+      color=255, thickness=-1,
+    )
+  elif kind == 1:
+    # sparse mask
+    mask[rng.random((h, w)) < rng.uniform(0.05, 0.9)] = 255
+  else:
+    # full mask
+    mask[:] = 255
+
+  return cv2.bitwise_and(img, img, mask=mask)
+
+def synthetic_wound (width : int, height : int) -> np.ndarray :
+  '''
+  Build a textured masked image with an elliptic wound
+  '''
+  rng = np.random.default_rng(42)
+  img = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+  img = cv2.resize(img, dsize=(width, height), interpolation=cv2.INTER_CUBIC)
+  mask = np.zeros(shape=(height, width), dtype=np.uint8)
+  cv2.ellipse(
+    mask,
+    center=(width // 2, height // 2),
+    axes=(width // 8, height // 10),
+    angle=30, startAngle=0, endAngle=360,
+    color=255, thickness=-1,
+  )
+  x, y, w, h = cv2.boundingRect(mask)
+  # crop on the wound as the FeatureEngine
+  return cv2.bitwise_and(img, img, mask=mask)[y : y + h, x : x + w]
+
+def timeit (func, repeat : int) -> float :
+  '''
+  Get the median execution time of a function
+  '''
+  times = []
+  for _ in range(repeat):
+    tic = now()
+    func()
+    times.append(now() - tic)
+  return sorted(times)[len(times) // 2]
+
+def main ():
+
+  args = parse_args()
+
+  if mh is None:
+    raise SystemExit((
+      'The benchmark requires mahotas as reference implementation. '
+      'Install it with: pip install -r benchmarks/requirements.txt'
+    ))
+
+  rng = np.random.default_rng(0)
+
+  checked, skipped, failed = 0, 0, 0
+  max_diff = 0.
+
+  for _ in range(args.cases):
+    masked = random_case(rng)
+
+    try:
+      ref = reference(masked)
+    except ValueError:
+      # mahotas fails if there are no pairs along a direction
+      try:
+        get_haralick(masked)
+      except ValueError:
+        skipped += 1
+        continue
+      failed += 1
+      continue
+
+    res = get_haralick(masked)
+    checked += 1
+
+    diff = np.abs(res - ref) / np.maximum(np.abs(ref), 1.)
+    max_diff = max(max_diff, float(diff.max()))
+    if not np.allclose(res, ref, rtol=args.rtol, atol=args.atol):
+      failed += 1
+
+  print(f'parity: {checked} cases checked, {skipped} empty inputs rejected by both, '
+        f'{failed} failures, max relative difference {max_diff:.3e}')
+
+  masked = synthetic_wound(*args.size)
+
+  t_ref = timeit(lambda: reference(masked), args.repeat)
+  t_new = timeit(lambda: get_haralick(masked), args.repeat)
+
+  print(' | '.join(['input', 'mahotas (s)', 'numpy (s)', 'speedup']))
+  print(' | '.join([
+    f'{masked.shape[1]}x{masked.shape[0]}x{masked.shape[2]}',
+    f'{t_ref:.3f}',
+    f'{t_new:.3f}',
+    f'{t_ref / t_new:.2f}x',
+  ]))
+
+  if failed:
+    exit(1)
+
+
+if __name__ == '__main__':
+
+  main ()
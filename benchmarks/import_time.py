@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Measure the start-up cost (wall time and peak memory) of the
+deepskin entry points, checking that the APIs which do not
+require the segmentation model do not load tensorflow.
+
+Usage
+-----
+  $ python benchmarks/import_time.py --repeat 5
+'''
+
+import sys
+import json
+import argparse
+import subprocess
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+# statements executed in a fresh interpreter, with a flag
+# which states if they are allowed to load tensorflow
+TARGETS = {
+  'import deepskin.features' : ('import deepskin.features', False),
+  'import deepskin.pwat' : ('import deepskin.pwat', False),
+  'import deepskin.geometry' : ('import deepskin.geometry', False),
+  'import deepskin' : ('import deepskin', False),
+  'deepskin --version' : (
+    'import sys, runpy\n'
+    'sys.argv = ["deepskin", "--version"]\n'
+    'runpy.run_module("deepskin", run_name="__main__")',
+    False
+  ),
+  'import deepskin.model' : ('import deepskin.model', True),
+}
+
+# wrapper which executes the statement and dumps the statistics
+# at exit (the CLI terminates with an explicit exit call)
+WRAPPER = '''
+import os, sys, json, atexit, resource
+from time import perf_counter as now
+
+def dump ():
+  stats = {{
+    'time' : now() - tic,
+    'rss' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'tensorflow' : 'tensorflow' in sys.modules,
+    'gdown' : 'gdown' in sys.modules,
+  }}
+  os.write(2, ('@@' + json.dumps(stats) + '\\n').encode())
+
+tic = now()
+atexit.register(dump)
+{statement}
+'''
+
+
+def parse_args ():
+
+  description = 'Deepskin start-up time benchmark'
+
+  parser = argparse.ArgumentParser(
+    prog='import_time',
+    argument_default=None,
+    add_help=True,
+    prefix_chars='-',
+    allow_abbrev=True,
+    description=description,
+  )
+  parser.add_argument(
+    '--repeat', '-r',
+    dest='repeat',
+    required=False,
+    type=int,
+    default=5,
+    help='Number of repetitions of each measure',
+  )
+
+  args = parser.parse_args()
+
+  return args
+
+def measure (statement : str) -> dict :
+  '''
+  Run the statement in a fresh interpreter and collect its statistics
+  '''
+  proc = subprocess.run(
+    [sys.executable, '-c', WRAPPER.format(statement=statement)],
+    stdout=subprocess.DEVNULL,
+    stderr=subprocess.PIPE,
+    text=True,
+  )
+  for line in proc.stderr.splitlines():
+    if line.startswith('@@'):
+      return json.loads(line[2:])
+  raise RuntimeError(f'Impossible to run the statement:\n{proc.stderr}')
+
+def main ():
+
+  args = parse_args()
+
+  print(' | '.join(['target', 'time (s)', 'peak RSS (MB)', 'tensorflow', 'gdown']))
+
+  failed = []
+  for name, (statement, allow_tf) in TARGETS.items():
+    runs = [measure(statement) for _ in range(args.repeat)]
+    times = sorted(r['time'] for r in runs)
+    res = runs[0]
+
+    print(' | '.join([
+      name,
+      f'{times[len(times) // 2]:.3f}',
+      f'{max(r["rss"] for r in runs):.1f}',
+      str(res['tensorflow']),
+      str(res['gdown']),
+    ]))
+
+    if not allow_tf and (res['tensorflow'] or res['gdown']):
+      failed.append(name)
+
+  if failed:
+    print(f'The following targets load heavy dependencies: {failed}')
+    exit(1)
+
+
+if __name__ == '__main__':
+
+  main ()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compare the reduced-precision variants of the Deepskin model
+(TFLite float16/int8 and Keras bfloat16 mixed precision)
+against the float32 Keras model in terms of latency, memory
+and segmentation agreement (IoU of the binary masks).
+
+Usage
+-----
+  $ python benchmarks/precision_report.py --images /path/to/images/*.png
+'''
+
+import os
+import cv2
+import glob
+import argparse
+import tempfile
+import numpy as np
+from time import perf_counter as now
+
+from deepskin.backends import export_model
+from deepskin.segmentation import DeepskinSegmenter
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+# semantic meaning of the mask channels
+CHANNELS = ('background', 'body', 'marker', 'wound')
+
+
+def parse_args ():
+
+  description = 'Deepskin reduced-precision models report'
+
+  parser = argparse.ArgumentParser(
+    prog='precision_report',
+    argument_default=None,
+    add_help=True,
+    prefix_chars='-',
+    allow_abbrev=True,
+    description=description,
+  )
+  parser.add_argument(
+    '--images', '-i',
+    dest='images',
+    required=True,
+    nargs='+',
+    type=str,
+    help='List of image files (or glob patterns) used for the evaluation',
+  )
+  parser.add_argument(
+    '--calibration', '-c',
+    dest='calibration',
+    required=False,
+    nargs='+',
+    type=str,
+    default=None,
+    help='List of image files (or glob patterns) used for the int8 calibration; default: the evaluation images',
+  )
+  parser.add_argument(
+    '--precisions', '-p',
+    dest='precisions',
+    required=False,
+    nargs='+',
+    type=str,
+    default=['float32', 'float16', 'int8', 'bfloat16'],
+    help='List of precisions to evaluate; bfloat16 is evaluated with the keras backend, the others with the tflite one',
+  )
+  parser.add_argument(
+    '--threads', '-t',
+    dest='threads',
+    required=False,
+    type=int,
+    default=None,
+    help='Number of threads used by the tflite interpreter',
+  )
+  parser.add_argument(
+    '--repeat', '-r',
+    dest='repeat',
+    required=False,
+    type=int,
+    default=3,
+    help='Number of repetitions for the latency estimation',
+  )
+  parser.add_argument(
+    '--outdir', '-o',
+    dest='outdir',
+    required=False,
+    type=str,
+    default=None,
+    help='Output directory of the exported models; default: a temporary directory',
+  )
+
+  args = parser.parse_args()
+
+  return args
+
+def load_images (patterns : list) -> list :
+  '''
+  Load the RGB images matching the given patterns
+  '''
+  files = sorted(f for p in patterns for f in glob.glob(p))
+  images = [cv2.imread(f, cv2.IMREAD_COLOR) for f in files]
+  return [bgr[..., ::-1] for bgr in images if bgr is not None]
+
+def rss_mb () -> float :
+  '''
+  Get the resident memory of the current process in MB
+  (NaN if psutil is not available)
+  '''
+  try:
+    import psutil
+  except ImportError:
+    return float('nan')
+  return psutil.Process().memory_info().rss / 1024**2
+
+def iou (masks : list, references : list) -> np.ndarray :
+  '''
+  Compute the IoU score of each mask channel over the whole set of images
+  '''
+  inter = np.zeros(len(CHANNELS), dtype=np.float64)
+  union = np.zeros(len(CHANNELS), dtype=np.float64)
+  for m, r in zip(masks, references):
+    m = m.reshape(-1, len(CHANNELS)) != 0
+    r = r.reshape(-1, len(CHANNELS)) != 0
+    inter += np.sum(m & r, axis=0)
+    union += np.sum(m | r, axis=0)
+  return np.divide(inter, union, out=np.ones_like(inter), where=union > 0)
+
+def evaluate (segmenter : DeepskinSegmenter, images : list, repeat : int) -> dict :
+  '''
+  Measure load time, memory and latency of a segmenter
+  '''
+  before = rss_mb()
+  tic = now()
+  segmenter.load()
+  load_time = now() - tic
+  memory = rss_mb() - before
+
+  # warm-up run, used also as output masks
+  masks = [segmenter.segment(img) for img in images]
+
+  tic = now()
+  for _ in range(repeat):
+    for img in images:
+      segmenter.segment(img)
+  latency = (now() - tic) / (repeat * len(images))
+
+  return {
+    'load' : load_time,
+    'memory' : memory,
+    'latency' : latency,
+    'masks' : masks,
+  }
+
+def main ():
+
+  args = parse_args()
+
+  images = load_images(args.images)
+  if not images:
+    raise ValueError('No valid images found')
+
+  calibration = images
+  if args.calibration is not None:
+    calibration = load_images(args.calibration)
+
+  outdir = args.outdir or tempfile.mkdtemp(prefix='deepskin_')
+
+  # reference float32 Keras model
+  reference = evaluate(
+    DeepskinSegmenter(backend='keras'),
+    images=images,
+    repeat=args.repeat,
+  )
+
+  results = {'keras/float32' : reference}
+
+  for precision in args.precisions:
+
+    if precision == 'bfloat16':
+      # mixed precision keras model
+      results['keras/bfloat16'] = evaluate(
+        DeepskinSegmenter(backend='keras', precision=precision),
+        images=images,
+        repeat=args.repeat,
+      )
+      continue
+
+    model_path = export_model(
+      output=os.path.join(outdir, f'deepskin_{precision}.tflite'),
+      fmt='tflite',
+      precision=precision,
+      calibration_images=calibration if precision == 'int8' else None,
+    )
+    res = evaluate(
+      DeepskinSegmenter(
+        weights=model_path,
+        backend='tflite',
+        num_threads=args.threads,
+        precision=precision,
+      ),
+      images=images,
+      repeat=args.repeat,
+    )
+    res['size'] = os.path.getsize(model_path) / 1024**2
+    results[f'tflite/{precision}'] = res
+
+  header = ['model', 'size (MB)', 'load (s)', 'memory (MB)', 'latency (ms)', 'speedup']
+  header += [f'IoU {c}' for c in CHANNELS]
+  print(' | '.join(header))
+
+  for name, res in results.items():
+    scores = iou(res['masks'], reference['masks'])
+    row = [
+      name,
+      f'{res.get("size", float("nan")):.1f}',
+      f'{res["load"]:.2f}',
+      f'{res["memory"]:.1f}',
+      f'{res["latency"] * 1e3:.1f}',
+      f'{reference["latency"] / res["latency"]:.2f}x',
+    ]
+    row += [f'{s:.4f}' for s in scores]
+    print(' | '.join(row))
+
+
+if __name__ == '__main__':
+
+  main ()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Measure the saving of the PWAT scoring obtained by computing
+only the features used by the regression (and their
+dependencies), against the evaluation of all the features
+of the wound and peri-wound areas.
+
+The wound is simulated as an ellipse on a synthetic image,
+unless real image/mask files are given.
+
+Usage
+-----
+  $ python benchmarks/pwat_features_time.py --size 4000 3000
+  $ python benchmarks/pwat_features_time.py --image wound.png --mask wound_mask.png
+'''
+
+import cv2
+import argparse
+import numpy as np
+
+from deepskin.imgproc import get_perilesion_mask
+from deepskin.features import FeatureEngine
+from deepskin.features import FEATURE_REGISTRY
+from deepskin.features import feature_dependencies
+from deepskin.pwat import score_features
+from deepskin.pwat import PWAT_FEATURES
+
+from features_time import synthetic_data
+from features_time import timeit
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+
+def parse_args ():
+
+  description = 'Deepskin PWAT feature subset benchmark'
+
+  parser = argparse.ArgumentParser(
+    prog='pwat_features_time',
+    argument_default=None,
+    add_help=True,
+    prefix_chars='-',
+    allow_abbrev=True,
+    description=description,
+  )
+  parser.add_argument(
+    '--image', '-i',
+    dest='image',
+    required=False,
+    type=str,
+    default=None,
+    help='Image file; default: a synthetic image',
+  )
+  parser.add_argument(
+    '--mask', '-m',
+    dest='mask',
+    required=False,
+    type=str,
+    default=None,
+    help='Wound mask file (gray-scale); default: a synthetic ellipse',
+  )
+  parser.add_argument(
+    '--size', '-s',
+    dest='size',
+    required=False,
+    nargs=2,
+    type=int,
+    default=[4000, 3000],
+    help='Width and height of the synthetic image',
+  )
+  parser.add_argument(
+    '--repeat', '-r',
+    dest='repeat',
+    required=False,
+    type=int,
+    default=3,
+    help='Number of repetitions of each measure',
+  )
+
+  args = parser.parse_args()
+
+  return args
+
+def main ():
+
+  args = parse_args()
+
+  if args.image is not None:
+    img = cv2.imread(args.image, cv2.IMREAD_COLOR)[..., ::-1].copy()
+    mask = cv2.imread(args.mask, cv2.IMREAD_GRAYSCALE)
+  else:
+    img, mask = synthetic_data(*args.size)
+
+  periwound = get_perilesion_mask(mask=mask, ksize=(20, 20))
+
+  wound_names = tuple(k[2:] for k in PWAT_FEATURES if k.startswith('w_'))
+  periwound_names = tuple(k[2:] for k in PWAT_FEATURES if k.startswith('p_'))
+
+  for prefix, names in (('w_', wound_names), ('p_', periwound_names)):
+    names, dependencies = feature_dependencies(names)
+    print(f'{prefix}: {len(names)}/{len(FEATURE_REGISTRY)} features, dependencies: {sorted(dependencies)}')
+
+  def evaluate (wound_names, periwound_names):
+    engine = FeatureEngine(img, masks=[mask, periwound])
+    return {
+      **engine.evaluate(mask, 'w_', names=wound_names),
+      **engine.evaluate(periwound, 'p_', names=periwound_names),
+    }
+
+  def full ():
+    return evaluate(None, None)
+
+  def subset ():
+    return evaluate(wound_names, periwound_names)
+
+  reference = full()
+  res = subset()
+  identical = sum(res[k] == reference[k] for k in res)
+  print(f'subset: {identical}/{len(res)} values identical to the full evaluation')
+
+  pwat_full = score_features([reference[k] for k in PWAT_FEATURES])[0]
+  pwat_subset = score_features([res[k] for k in PWAT_FEATURES])[0]
+  print(f'PWAT: full {pwat_full:.6f}, subset {pwat_subset:.6f}, identical {pwat_full == pwat_subset}')
+
+  t_full = timeit(full, args.repeat)
+  t_subset = timeit(subset, args.repeat)
+
+  print(' | '.join(['image', 'wound pixels', 'all features (s)', 'PWAT features (s)', 'speedup']))
+  print(' | '.join([
+    f'{img.shape[1]}x{img.shape[0]}',
+    f'{cv2.countNonZero(mask)}',
+    f'{t_full:.3f}',
+    f'{t_subset:.3f}',
+    f'{t_full / t_subset:.2f}x',
+  ]))
+
+
+if __name__ == '__main__':
+
+  main ()
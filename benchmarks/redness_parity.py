@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Check the parity of the mask-indexed redness scores
+(ref. deepskin.features.get_redness_scores), with the NumPy
+and the numba kernels, against the previous implementation
+which evaluates the scores on the whole image and masks them
+with NaN values, and measure their time and peak memory.
+
+The benchmark uses a synthetic 12 MP photo with a small wound.
+
+Usage
+-----
+  $ python benchmarks/redness_parity.py --cases 200
+  $ python benchmarks/redness_parity.py --wound 0.02
+'''
+
+import cv2
+import argparse
+import tracemalloc
+import numpy as np
+from time import perf_counter as now
+
+from deepskin.features import get_redness_scores
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+
+def parse_args ():
+
+  description = 'Deepskin redness scores parity check'
+
+  parser = argparse.ArgumentParser(
+    prog='redness_parity',
+    argument_default=None,
+    add_help=True,
+    prefix_chars='-',
+    allow_abbrev=True,
+    description=description,
+  )
+  parser.add_argument(
+    '--cases', '-c',
+    dest='cases',
+    required=False,
+    type=int,
+    default=200,
+    help='Number of random test cases',
+  )
+  parser.add_argument(
+    '--rtol',
+    dest='rtol',
+    required=False,
+    type=float,
+    default=1e-5,
+    help='Relative tolerance of the parity check against the previous implementation',
+  )
+  parser.add_argument(
+    '--size', '-s',
+    dest='size',
+    required=False,
+    nargs=2,
+    type=int,
+    default=[4000, 3000],
+    help='Width and height of the synthetic image used for the benchmark',
+  )
+  parser.add_argument(
+    '--wound', '-w',
+    dest='wound',
+    required=False,
+    type=float,
+    default=0.02,
+    help='Fraction of the image covered by the wound in the benchmark',
+  )
+  parser.add_argument(
+    '--repeat', '-r',
+    dest='repeat',
+    required=False,
+    type=int,
+    default=3,
+    help='Number of repetitions of each measure',
+  )
+
+  args = parser.parse_args()
+
+  return args
+
+def reference (img : np.ndarray, mask : np.ndarray) -> tuple :
+  '''
+  Previous implementation of get_park_redness and
+  get_amparo_redness
+  '''
+  image = cv2.bitwise_and(img, img, mask=mask)
+  N = np.sum(mask != 0)
+  if N == 0:
+    return -0.5, 0.0
+
+  r, g, b = cv2.split(np.float32(image))
+  f2 = (2*r - g - b) / (2 * (r + g + b + 1e-5))
+  f2 = f2 * np.where(mask != 0, 1, np.nan)
+  park = np.nansum(f2) / N
+
+  h, s, v = cv2.split(cv2.cvtColor(image, cv2.COLOR_RGB2HSV))
+  f1 = (np.float32(h) * np.float32(s)) / (255 * 255)
+  f1 = f1 * np.where(mask != 0, 1, np.nan)
+  amparo = np.nansum(f1) / N
+
+  return park, amparo
+
+def random_case (rng : np.random.Generator) -> tuple :
+  '''
+  Build a random RGB image and mask
+  '''
+  h, w = rng.integers(1, 400, size=2)
+  img = rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8)
+  mask = np.zeros(shape=(h, w), dtype=np.uint8)
+  mask[rng.random((h, w)) < rng.choice([0., 0.01, 0.3, 1.])] = int(rng.integers(1, 256))
+  return img, mask
+
+def synthetic_wound (width : int, height : int, fraction : float) -> tuple :
+  '''
+  Build a textured image with an elliptic wound which
+  covers the given fraction of the image
+  '''
+  rng = np.random.default_rng(42)
+  img = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+  img = cv2.resize(img, dsize=(width, height), interpolation=cv2.INTER_CUBIC)
+  mask = np.zeros(shape=(height, width), dtype=np.uint8)
+  scale = np.sqrt(fraction / np.pi)
+  cv2.ellipse(
+    mask,
+    center=(width // 2, height // 2),
+    axes=(int(width * scale), int(height * scale)),
+    angle=0, startAngle=0, endAngle=360,
+    color=255, thickness=-1,
+  )
+  return img, mask
+
+def measure (func, repeat : int) -> tuple :
+  '''
+  Get the median execution time and the peak of the
+  temporary memory (in MB) of a function
+  '''
+  times = []
+  for _ in range(repeat):
+    tic = now()
+    func()
+    times.append(now() - tic)
+
+  tracemalloc.start()
+  func()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return sorted(times)[len(times) // 2], peak / 1024**2
+
+def main ():
+
+  args = parse_args()
+
+  try:
+    import numba # noqa: F401
+    kernels = (False, True)
+  except ImportError:
+    print('numba is not available: only the NumPy kernels are checked')
+    kernels = (False, )
+
+  rng = np.random.default_rng(0)
+
+  failed = 0
+  max_diff = {use_numba : 0. for use_numba in kernels}
+
+  for _ in range(args.cases):
+    img, mask = random_case(rng)
+    ref = reference(img, mask)
+
+    for use_numba in kernels:
+      res = get_redness_scores(img, mask, use_numba=use_numba)
+      diff = max(abs(r - f) / max(abs(f), 1e-3) for r, f in zip(res, ref))
+      max_diff[use_numba] = max(max_diff[use_numba], diff)
+      if not np.allclose(res, ref, rtol=args.rtol, atol=1e-8):
+        failed += 1
+
+  for use_numba in kernels:
+    print(f'parity ({"numba" if use_numba else "numpy"}): {args.cases} cases, '
+          f'max relative difference {max_diff[use_numba]:.3e}')
+  print(f'parity: {failed} failures')
+
+  img, mask = synthetic_wound(*args.size, fraction=args.wound)
+
+  if True in kernels:
+    # compile the kernels before the measure
+    get_redness_scores(img[:1, :1], mask[:1, :1] + 1, use_numba=True)
+    ref = get_redness_scores(img, mask, use_numba=False)
+    res = get_redness_scores(img, mask, use_numba=True)
+    print(f'numpy vs numba: max relative difference '
+          f'{max(abs(r - f) / abs(f) for r, f in zip(res, ref)):.3e}')
+
+  results = {
+    'previous (NaN masks)' : measure(lambda: reference(img, mask), args.repeat),
+  }
+  for use_numba in kernels:
+    results[f'mask-indexed ({"numba" if use_numba else "numpy"})'] = measure(
+      lambda: get_redness_scores(img, mask, use_numba=use_numba),
+      args.repeat
+    )
+
+  t_ref = results['previous (NaN masks)'][0]
+
+  print(' | '.join(['implementation', 'image', 'wound pixels', 'time (s)', 'peak memory (MB)', 'speedup']))
+  for name, (t, peak) in results.items():
+    print(' | '.join([
+      name,
+      f'{img.shape[1]}x{img.shape[0]}',
+      f'{cv2.countNonZero(mask)}',
+      f'{t:.4f}',
+      f'{peak:.1f}',
+      f'{t_ref / t:.1f}x',
+    ]))
+
+  if failed:
+    exit(1)
+
+
+if __name__ == '__main__':
+
+  main ()
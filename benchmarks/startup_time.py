@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Measure the cold-start cost (load time, first inference time
+and peak memory) of the Deepskin model obtained by re-building
+the graph from code and loading the weights, against the
+serialized artifacts (.keras file, SavedModel directory and
+TFLite file) produced by `export_model`.
+
+Each measure is performed in a fresh interpreter.
+
+Usage
+-----
+  $ python benchmarks/startup_time.py --repeat 3
+'''
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+# statement executed in a fresh interpreter: load the
+# given model and run a single-image inference
+WRAPPER = '''
+import os, json
+import numpy as np
+from time import perf_counter as now
+
+tic = now()
+from deepskin.backends import get_backend
+backend = get_backend({backend!r}, model_path={path!r}).load()
+load = now() - tic
+
+batch = np.zeros((1, 256, 256, 3), dtype=np.float32)
+tic = now()
+backend.predict(batch)
+first = now() - tic
+
+# NOTE: ru_maxrss is inherited from the parent process,
+# while the VmHWM counter is reset by the exec call
+with open('/proc/self/status') as fp:
+  hwm = [l for l in fp if l.startswith('VmHWM')][0]
+
+stats = {{
+  'load' : load,
+  'first' : first,
+  'rss' : int(hwm.split()[1]) / 1024,
+}}
+os.write(2, ('@@' + json.dumps(stats) + '\\n').encode())
+'''
+
+
+def parse_args ():
+
+  description = 'Deepskin model cold-start benchmark'
+
+  parser = argparse.ArgumentParser(
+    prog='startup_time',
+    argument_default=None,
+    add_help=True,
+    prefix_chars='-',
+    allow_abbrev=True,
+    description=description,
+  )
+  parser.add_argument(
+    '--weights', '-w',
+    dest='weights',
+    required=False,
+    type=str,
+    default=None,
+    help='Model weights file; default: the Deepskin checkpoint',
+  )
+  parser.add_argument(
+    '--outdir', '-o',
+    dest='outdir',
+    required=False,
+    type=str,
+    default=None,
+    help='Output directory of the exported models; default: a temporary directory',
+  )
+  parser.add_argument(
+    '--repeat', '-r',
+    dest='repeat',
+    required=False,
+    type=int,
+    default=3,
+    help='Number of repetitions of each measure',
+  )
+
+  args = parser.parse_args()
+
+  return args
+
+def measure (backend : str, path : str) -> dict :
+  '''
+  Load the model in a fresh interpreter and collect its statistics
+  '''
+  proc = subprocess.run(
+    [sys.executable, '-c', WRAPPER.format(backend=backend, path=path)],
+    stdout=subprocess.DEVNULL,
+    stderr=subprocess.PIPE,
+    text=True,
+  )
+  for line in proc.stderr.splitlines():
+    if line.startswith('@@'):
+      return json.loads(line[2:])
+  raise RuntimeError(f'Impossible to load the model:\n{proc.stderr}')
+
+def main ():
+
+  args = parse_args()
+
+  from deepskin.backends import export_model
+  from deepskin.checkpoints import get_model_weights
+
+  weights = args.weights or get_model_weights()
+  outdir = args.outdir or tempfile.mkdtemp(prefix='deepskin_')
+
+  # the artifacts are exported once
+  targets = {
+    'weights (rebuild from code)' : ('keras', weights),
+    'keras artifact' : ('keras', export_model(
+      output=os.path.join(outdir, 'deepskin.keras'),
+      fmt='keras',
+      weights=weights,
+    )),
+    'savedmodel artifact' : ('keras', export_model(
+      output=os.path.join(outdir, 'deepskin_savedmodel'),
+      fmt='savedmodel',
+      weights=weights,
+    )),
+    'tflite artifact' : ('tflite', export_model(
+      output=os.path.join(outdir, 'deepskin.tflite'),
+      fmt='tflite',
+      weights=weights,
+    )),
+  }
+
+  print(' | '.join(['model', 'load (s)', 'first inference (s)', 'total (s)', 'peak RSS (MB)']))
+
+  for name, (backend, path) in targets.items():
+    runs = [measure(backend, path) for _ in range(args.repeat)]
+    runs = sorted(runs, key=lambda r: r['load'] + r['first'])
+    res = runs[len(runs) // 2]
+
+    print(' | '.join([
+      name,
+      f'{res["load"]:.3f}',
+      f'{res["first"]:.3f}',
+      f'{res["load"] + res["first"]:.3f}',
+      f'{max(r["rss"] for r in runs):.1f}',
+    ]))
+
+
+if __name__ == '__main__':
+
+  main ()
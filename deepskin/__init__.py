@@ -1,19 +1,56 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import importlib
+
 from .__version__ import __version__
-# import the segmentation model
-from .model import deepskin_model
 # import useful constant values
-from .model import MODEL_CHECKPOINT
+from .constants import MODEL_CHECKPOINT
 # import model checkpoint getter
 from .checkpoints import download_model_weights
+from .checkpoints import get_model_weights
 # import the wound segmentation algorithm
 from .segmentation import wound_segmentation
+# import the persistent segmentation engine
+from .segmentation import DeepskinSegmenter
+from .segmentation import wound_segmentation_batch
+# import the on-disk cache of the segmentation results
+from .cache import SegmentationCache
+# import the model exporter for the lighter inference backends
+from .backends import export_model
+# import the streaming segmentation pipeline
+from .pipeline import segmentation_pipeline
+# import the multi-process segmentation runner
+from .parallel import parallel_segmentation
+# import the video segmentation
+from .video import video_segmentation
 # import the features for the wound monitoring
 from .features import evaluate_features
+from .features import evaluate_region_features
 # import the PWAT evaluator for the wound scoring
 from .pwat import evaluate_PWAT_score
+from .pwat import score_features
+# import the batch extraction of the feature tables
+from .feature_table import extract_feature_table
+from .feature_table import FeatureTable
 
 __author__  = ['Nico Curti']
 __email__ = ['nico.curti2@unibo.it']
+
+# objects whose import requires tensorflow: they are
+# imported at their first usage (PEP 562), so that the
+# package could be used on pre-computed masks without
+# loading tensorflow
+_LAZY_IMPORTS = {
+  # the segmentation model
+  'deepskin_model' : '.model',
+}
+
+def __getattr__ (name : str):
+  if name in _LAZY_IMPORTS:
+    module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+    return getattr(module, name)
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def __dir__ ():
+  return sorted(list(globals()) + list(_LAZY_IMPORTS))
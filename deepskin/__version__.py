@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__  = 'Nico Curti'
+__email__ = 'nico.curti2@unibo.it'
+
+__version__ = '0.0.2'
@@ -0,0 +1,818 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+# disable tensorflow warnings
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import shutil
+import threading
+import numpy as np
+
+# constant values
+from .constants import IMG_SIZE
+from .constants import MODEL_CHECKPOINT
+# model weights cache
+from .checkpoints import MODEL_NAME
+from .checkpoints import get_cache_dir
+from .checkpoints import get_model_weights
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+__all__ = [
+  'KerasBackend',
+  'TFLiteBackend',
+  'ONNXBackend',
+  'get_backend',
+  'export_model',
+  'check_backend_parity',
+]
+
+# numerical precisions supported by the exported models
+PRECISIONS = ('float32', 'float16', 'int8')
+# numerical precisions supported by the keras model
+KERAS_PRECISIONS = ('float32', 'bfloat16')
+# available export formats
+EXPORT_FORMATS = ('tflite', 'onnx', 'keras', 'savedmodel')
+# extensions of the model files loaded by the runtime backends
+MODEL_EXTENSIONS = {
+  'tflite' : ('.tflite', ),
+  'onnx' : ('.onnx', ),
+}
+
+
+def _get_weights_path () -> str :
+  '''
+  Get the filepath of the default model weights,
+  downloading the checkpoint if it is not available
+  (ref. `deepskin.checkpoints.get_model_weights`).
+
+  Returns
+  -------
+    weightspath : str
+      Path of the .h5 file with the model weights
+  '''
+  return get_model_weights(
+    model_name=MODEL_NAME,
+    Id=MODEL_CHECKPOINT,
+  )
+
+def _get_exported_path (fmt : str, precision : str = 'float32') -> str :
+  '''
+  Get the default filepath of an exported model, stored
+  in the cache directory alongside the default model weights.
+
+  Parameters
+  ----------
+    fmt : str
+      Format of the exported model ('tflite' or 'onnx')
+
+    precision : str (default := 'float32')
+      Numerical precision of the exported model
+
+  Returns
+  -------
+    filepath : str
+      Path of the exported model file
+  '''
+  return os.path.join(
+    get_cache_dir(),
+    f'{MODEL_NAME}_{precision}.{fmt}'
+  )
+
+def _build_keras_model (weights : str = None, precision : str = 'float32'):
+  '''
+  Build the Deepskin Keras model and load its weights.
+
+  Parameters
+  ----------
+    weights : str (default := None)
+      Path of the model weights; if None the default
+      Deepskin checkpoint is used
+
+    precision : str (default := 'float32')
+      Numerical precision of the model computation
+      (ref. `deepskin.model.deepskin_model`)
+
+  Returns
+  -------
+    model : tf.keras.Model
+      Deepskin model ready for the inference
+  '''
+  # NOTE: the model module imports tensorflow, so it
+  # is loaded only when the model is required
+  from .model import deepskin_model
+
+  # build the model for the semantic segmentation
+  model = deepskin_model(
+    verbose=False,
+    precision=precision,
+  )
+  # get the path of the weights
+  if weights is None:
+    weights = _get_weights_path()
+  # load the weights
+  model.load_weights(weights)
+
+  return model
+
+
+class KerasBackend (object):
+  '''
+  Inference backend based on the TensorFlow/Keras
+  implementation of the Deepskin model.
+
+  Parameters
+  ----------
+    weights : str (default := None)
+      Path of the model weights; if None the default
+      Deepskin checkpoint is used (and downloaded if
+      it is not available).
+      It could be also the path of a serialized model, i.e.
+      a .keras file or a SavedModel directory obtained by
+      `export_model`, which is loaded without re-building
+      the model from code
+
+    jit_compile : bool (default := False)
+      Enable/Disable the XLA compilation of the inference
+      graph (ignored for the SavedModel artifacts)
+
+    precision : str (default := 'float32')
+      Numerical precision of the model computation; available
+      options are 'float32' and 'bfloat16' (mixed precision,
+      effective on the CPUs with AVX512-BF16/AMX support).
+      The serialized artifacts keep the precision used
+      at their export
+
+  Notes
+  -----
+  The model is wrapped in a graph function with a fixed
+  [None, IMG_SIZE, IMG_SIZE, 3] float32 input signature,
+  which avoids the per-call overhead of `model.predict`
+  (data adapter, callbacks, progress bar) and any retracing
+  for different batch sizes.
+  '''
+
+  name = 'keras'
+
+  def __init__ (self, weights : str = None,
+                jit_compile : bool = False,
+                precision : str = 'float32'
+               ):
+
+    if precision not in KERAS_PRECISIONS:
+      raise ValueError((
+        f'Invalid precision. Available options are {KERAS_PRECISIONS}. '
+        f'Given: {precision}'
+      ))
+
+    self.weights = weights
+    self.jit_compile = jit_compile
+    self.precision = precision
+    self.model = None
+    self._infer = None
+
+  def load (self) -> 'KerasBackend' :
+    '''
+    Build the model, load its weights and compile the
+    inference function
+    '''
+    if self.model is None:
+      import tensorflow as tf
+
+      if self.weights is not None and os.path.isdir(self.weights):
+        # restore the serialized inference graph
+        self.model = tf.saved_model.load(self.weights)
+        signature = self.model.signatures['serving_default']
+
+        def infer (batch):
+          return signature(input=tf.convert_to_tensor(batch))['output']
+
+        self._infer = infer
+
+        return self
+
+      if self.weights is not None and self.weights.endswith('.keras'):
+        # load the serialized model
+        self.model = tf.keras.models.load_model(
+          self.weights,
+          compile=False
+        )
+      else:
+        # build the model from code and load its weights
+        self.model = _build_keras_model(
+          weights=self.weights,
+          precision=self.precision,
+        )
+
+      model = self.model
+
+      @tf.function(
+        input_signature=[
+          tf.TensorSpec(shape=(None, IMG_SIZE, IMG_SIZE, 3), dtype=tf.float32)
+        ],
+        jit_compile=self.jit_compile,
+        reduce_retracing=True,
+      )
+      def infer (batch):
+        return model(batch, training=False)
+
+      self._infer = infer
+
+    return self
+
+  def release (self) -> None :
+    '''
+    Release the model memory
+    '''
+    self.model = None
+    self._infer = None
+
+  def predict (self, batch : np.ndarray) -> np.ndarray :
+    '''
+    Apply the model on a batch of pre-processed images.
+
+    Parameters
+    ----------
+      batch : np.ndarray
+        Input tensor in float32 fmt with shape (N, IMG_SIZE, IMG_SIZE, 3)
+
+    Returns
+    -------
+      pred : np.ndarray
+        Softmax output with shape (N, IMG_SIZE, IMG_SIZE, 4)
+    '''
+    return self._infer(batch).numpy()
+
+
+class TFLiteBackend (object):
+  '''
+  Inference backend based on the TFLite interpreter.
+  The XNNPACK delegate is used by default by the interpreter
+  on CPU, with the given number of threads.
+
+  Parameters
+  ----------
+    model_path : str (default := None)
+      Path of the .tflite file obtained by `export_model`;
+      if None the default exported file is used, and it is
+      created at the first usage if it is not available
+
+    num_threads : int (default := None)
+      Number of threads used by the interpreter; if None
+      all the available cores are used
+
+    precision : str (default := 'float32')
+      Numerical precision of the default exported model;
+      available options are 'float32', 'float16' and 'int8'.
+      The 'int8' model requires a calibration set of images,
+      so it must be created in advance by `export_model`
+  '''
+
+  name = 'tflite'
+
+  def __init__ (self, model_path : str = None,
+                num_threads : int = None,
+                precision : str = 'float32'
+               ):
+
+    if precision not in PRECISIONS:
+      raise ValueError((
+        f'Invalid precision. Available options are {PRECISIONS}. '
+        f'Given: {precision}'
+      ))
+
+    self.precision = precision
+    self.model_path = model_path
+    self.num_threads = num_threads if num_threads is not None else os.cpu_count()
+    self.interpreter = None
+    # the interpreter is not thread-safe
+    self._lock = threading.Lock()
+    self._batch_size = None
+
+  def load (self) -> 'TFLiteBackend' :
+    '''
+    Create the TFLite interpreter
+    '''
+    if self.interpreter is not None:
+      return self
+
+    if self.model_path is None:
+      self.model_path = _get_exported_path('tflite', self.precision)
+
+      # export the default model at the first usage
+      if not os.path.exists(self.model_path):
+
+        if self.precision == 'int8':
+          raise FileNotFoundError((
+            'The int8 model requires a calibration set of images; '
+            'please use the export_model function to create it. '
+            f'Expected file: {self.model_path}'
+          ))
+
+        export_model(
+          output=self.model_path,
+          fmt='tflite',
+          precision=self.precision,
+        )
+
+    try:
+      # prefer the light-weight runtime if available
+      from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+      import tensorflow as tf
+      Interpreter = tf.lite.Interpreter
+
+    self.interpreter = Interpreter(
+      model_path=self.model_path,
+      num_threads=self.num_threads,
+    )
+    self._input = self.interpreter.get_input_details()[0]['index']
+    self._output = self.interpreter.get_output_details()[0]['index']
+    self._batch_size = None
+
+    return self
+
+  def release (self) -> None :
+    '''
+    Release the interpreter memory
+    '''
+    self.interpreter = None
+
+  def predict (self, batch : np.ndarray) -> np.ndarray :
+    '''
+    Apply the model on a batch of pre-processed images.
+
+    Parameters
+    ----------
+      batch : np.ndarray
+        Input tensor in float32 fmt with shape (N, IMG_SIZE, IMG_SIZE, 3)
+
+    Returns
+    -------
+      pred : np.ndarray
+        Softmax output with shape (N, IMG_SIZE, IMG_SIZE, 4)
+    '''
+    with self._lock:
+      # resize the input tensor only if the batch size changes
+      if batch.shape[0] != self._batch_size:
+        self.interpreter.resize_tensor_input(
+          self._input,
+          batch.shape,
+          strict=False,
+        )
+        self.interpreter.allocate_tensors()
+        self._batch_size = batch.shape[0]
+
+      self.interpreter.set_tensor(self._input, np.ascontiguousarray(batch))
+      self.interpreter.invoke()
+      # NOTE: the output buffer is owned by the interpreter
+      pred = self.interpreter.get_tensor(self._output).copy()
+
+    return pred
+
+
+class ONNXBackend (object):
+  '''
+  Inference backend based on ONNX Runtime.
+
+  Parameters
+  ----------
+    model_path : str (default := None)
+      Path of the .onnx file obtained by `export_model`;
+      if None the default exported file is used, and it is
+      created at the first usage if it is not available
+
+    num_threads : int (default := None)
+      Number of intra-op threads used by the session; if None
+      all the available cores are used
+
+    inter_op_threads : int (default := 1)
+      Number of inter-op threads used by the session
+  '''
+
+  name = 'onnx'
+
+  def __init__ (self, model_path : str = None,
+                num_threads : int = None,
+                inter_op_threads : int = 1
+               ):
+
+    self.model_path = model_path
+    self.num_threads = num_threads if num_threads is not None else os.cpu_count()
+    self.inter_op_threads = inter_op_threads
+    self.session = None
+
+  def load (self) -> 'ONNXBackend' :
+    '''
+    Create the ONNX Runtime inference session
+    '''
+    if self.session is not None:
+      return self
+
+    if self.model_path is None:
+      self.model_path = _get_exported_path('onnx')
+
+      # export the default model at the first usage
+      if not os.path.exists(self.model_path):
+        export_model(
+          output=self.model_path,
+          fmt='onnx',
+        )
+
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = self.num_threads
+    options.inter_op_num_threads = self.inter_op_threads
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    self.session = ort.InferenceSession(
+      self.model_path,
+      sess_options=options,
+      providers=['CPUExecutionProvider'],
+    )
+    self._input = self.session.get_inputs()[0].name
+
+    return self
+
+  def release (self) -> None :
+    '''
+    Release the session memory
+    '''
+    self.session = None
+
+  def predict (self, batch : np.ndarray) -> np.ndarray :
+    '''
+    Apply the model on a batch of pre-processed images.
+
+    Parameters
+    ----------
+      batch : np.ndarray
+        Input tensor in float32 fmt with shape (N, IMG_SIZE, IMG_SIZE, 3)
+
+    Returns
+    -------
+      pred : np.ndarray
+        Softmax output with shape (N, IMG_SIZE, IMG_SIZE, 4)
+    '''
+    pred, = self.session.run(None, {self._input : batch})
+    return pred
+
+
+BACKENDS = {
+  'keras' : KerasBackend,
+  'tflite' : TFLiteBackend,
+  'onnx' : ONNXBackend,
+}
+
+def get_backend (backend : str = 'keras',
+                 model_path : str = None,
+                 num_threads : int = None,
+                 precision : str = 'float32',
+                 jit_compile : bool = False,
+                ) :
+  '''
+  Get the inference backend for the Deepskin model.
+
+  Parameters
+  ----------
+    backend : str (default := 'keras')
+      Name of the backend to use; available options are
+      'keras', 'tflite' and 'onnx'
+
+    model_path : str (default := None)
+      Path of the model file; for the 'keras' backend it is
+      the path of the .h5 weights or of a serialized .keras/SavedModel
+      artifact, while for the other backends it is the file
+      obtained by `export_model` (a ValueError is raised for
+      the other files, e.g. the .h5 weights given with the
+      'float16' or 'int8' precisions).
+      If None the default files are used.
+
+    num_threads : int (default := None)
+      Number of threads used by the 'tflite' and 'onnx'
+      runtimes; if None all the available cores are used
+
+    precision : str (default := 'float32')
+      Numerical precision of the model; the reduced precisions
+      'float16' and 'int8' are supported only by the 'tflite'
+      backend, which is automatically selected instead of the
+      default 'keras' one, while the 'bfloat16' mixed precision
+      is supported only by the 'keras' backend
+
+    jit_compile : bool (default := False)
+      Enable/Disable the XLA compilation of the 'keras' backend
+
+  Returns
+  -------
+    backend : object
+      Inference backend (not loaded yet)
+  '''
+  if backend not in BACKENDS:
+    raise ValueError((
+      f'Invalid backend. Available options are {tuple(BACKENDS)}. '
+      f'Given: {backend}'
+    ))
+
+  if precision not in PRECISIONS + KERAS_PRECISIONS:
+    raise ValueError((
+      f'Invalid precision. Available options are {PRECISIONS + KERAS_PRECISIONS[1:]}. '
+      f'Given: {precision}'
+    ))
+
+  if precision == 'bfloat16':
+    # the mixed precision is run by the keras model
+    if backend != 'keras':
+      raise ValueError((
+        f'The {precision} precision is supported only by the keras backend. '
+        f'Given: {backend}'
+      ))
+
+  elif precision != 'float32':
+    # the quantized models are run by the tflite interpreter
+    if backend == 'keras':
+      backend = 'tflite'
+    elif backend != 'tflite':
+      raise ValueError((
+        f'The {precision} precision is supported only by the tflite backend. '
+        f'Given: {backend}'
+      ))
+
+  if backend in MODEL_EXTENSIONS and model_path is not None:
+    # NOTE: the keras weights must be converted by export_model
+    # before they could be run by the other runtimes
+    extension = os.path.splitext(model_path)[1].lower()
+    if extension not in MODEL_EXTENSIONS[backend]:
+      raise ValueError((
+        f'Invalid model file for the {backend} backend ({precision} precision). '
+        f'Available options are {MODEL_EXTENSIONS[backend]} files obtained by export_model. '
+        f'Given: {model_path}'
+      ))
+
+  if backend == 'keras':
+    return KerasBackend(
+      weights=model_path,
+      jit_compile=jit_compile,
+      precision=precision,
+    )
+
+  if backend == 'tflite':
+    return TFLiteBackend(
+      model_path=model_path,
+      num_threads=num_threads,
+      precision=precision,
+    )
+
+  return ONNXBackend(
+    model_path=model_path,
+    num_threads=num_threads,
+  )
+
+def export_model (output : str,
+                  fmt : str = 'tflite',
+                  weights : str = None,
+                  precision : str = 'float32',
+                  calibration_images : list = None,
+                  verbose : bool = False
+                 ) -> str :
+  '''
+  Convert the Deepskin Keras model into a TFLite or ONNX
+  file for a lighter CPU inference, or serialize it as a
+  self-contained artifact (.keras file or SavedModel
+  directory) which is loaded faster than re-building the
+  model from code.
+  The export must be performed only once, since the
+  obtained file could be loaded by the corresponding
+  backend (the 'keras' backend for the serialized artifacts)
+  without re-building the model.
+
+  Parameters
+  ----------
+    output : str
+      Output filename of the converted model; for the
+      'keras' format it must have the .keras extension
+
+    fmt : str (default := 'tflite')
+      Output format; available options are 'tflite', 'onnx',
+      'keras' and 'savedmodel'
+
+    weights : str (default := None)
+      Path of the model weights; if None the default
+      Deepskin checkpoint is used
+
+    precision : str (default := 'float32')
+      Numerical precision of the exported weights; available
+      options are 'float32', 'float16' and 'int8'.
+      The reduced precisions are supported only by the
+      'tflite' format
+
+    calibration_images : list (default := None)
+      List of RGB images used to calibrate the activation
+      ranges of the 'int8' post-training quantization
+
+    verbose : bool (default := False)
+      Enable/Disable the logging of the steps
+
+  Returns
+  -------
+    output : str
+      Filename of the converted model
+
+  Notes
+  -----
+  The ONNX conversion requires the tf2onnx package.
+  The 'int8' quantization keeps float32 input and output
+  tensors, so the quantized model could be used as a
+  drop-in replacement of the float32 one; the operators
+  without an integer implementation fall back to float32.
+  '''
+  if fmt not in EXPORT_FORMATS:
+    raise ValueError((
+      f'Invalid export format. Available options are {EXPORT_FORMATS}. '
+      f'Given: {fmt}'
+    ))
+
+  if fmt == 'keras' and not output.endswith('.keras'):
+    raise ValueError(f'The keras format requires the .keras extension. Given: {output}')
+
+  if precision not in PRECISIONS:
+    raise ValueError((
+      f'Invalid precision. Available options are {PRECISIONS}. '
+      f'Given: {precision}'
+    ))
+
+  if precision != 'float32' and fmt != 'tflite':
+    raise ValueError((
+      f'The {precision} precision is supported only by the tflite format. '
+      f'Given: {fmt}'
+    ))
+
+  if precision == 'int8' and not calibration_images:
+    raise ValueError('The int8 quantization requires a non-empty set of calibration images')
+
+  import tensorflow as tf
+
+  if verbose:
+    print(f'Convert the deepskin model to {fmt} fmt ({precision})... ',
+      end='',
+      flush=True,
+    )
+
+  model = _build_keras_model(weights=weights)
+
+  # create the output directory if necessary
+  outdir = os.path.dirname(os.path.abspath(output))
+  os.makedirs(outdir, exist_ok=True)
+  # temporary file in the same directory of the output
+  root, ext = os.path.splitext(output)
+  tmpfile = f'{root}.{os.getpid()}.tmp{ext}'
+
+  if fmt == 'tflite':
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if precision == 'float16':
+      # store the weights in half precision
+      converter.optimizations = [tf.lite.Optimize.DEFAULT]
+      converter.target_spec.supported_types = [tf.float16]
+
+    elif precision == 'int8':
+      # NOTE: avoid a circular import
+      from .segmentation import _preprocess
+
+      def representative_dataset ():
+        buffer = np.empty(
+          shape=(1, IMG_SIZE, IMG_SIZE, 3),
+          dtype=np.float32
+        )
+        for img in calibration_images:
+          _preprocess(img, out=buffer[0])
+          yield [buffer]
+
+      # post-training integer quantization of weights and activations
+      converter.optimizations = [tf.lite.Optimize.DEFAULT]
+      converter.representative_dataset = representative_dataset
+
+    content = converter.convert()
+
+    with open(tmpfile, 'wb') as fp:
+      fp.write(content)
+
+  elif fmt == 'keras':
+    model.save(tmpfile)
+
+  elif fmt == 'savedmodel':
+
+    @tf.function(
+      input_signature=[
+        tf.TensorSpec(shape=(None, IMG_SIZE, IMG_SIZE, 3), dtype=tf.float32, name='input')
+      ]
+    )
+    def serve (input):
+      return {'output' : model(input, training=False)}
+
+    module = tf.Module()
+    module.model = model
+    module.serve = serve
+    tf.saved_model.save(
+      module,
+      tmpfile,
+      signatures={'serving_default' : serve},
+    )
+
+    # the directory could not be replaced atomically
+    if os.path.isdir(output):
+      shutil.rmtree(output)
+
+  else:
+    import tf2onnx
+
+    signature = (
+      tf.TensorSpec((None, IMG_SIZE, IMG_SIZE, 3), tf.float32, name='input'),
+    )
+    tf2onnx.convert.from_keras(
+      model,
+      input_signature=signature,
+      opset=13,
+      output_path=tmpfile,
+    )
+
+  # atomic install of the exported model, so concurrent
+  # workers never read a partially written file
+  os.replace(tmpfile, output)
+
+  if verbose:
+    print('[DONE]',
+      end='\n',
+      flush=True,
+    )
+
+  return output
+
+def check_backend_parity (backend,
+                          images : list,
+                          reference = None,
+                          tol : float = 0.5,
+                          atol : float = 1e-2,
+                         ) -> dict :
+  '''
+  Compare the predictions of an inference backend with
+  the reference ones (by default the Keras backend).
+
+  Parameters
+  ----------
+    backend : object
+      Inference backend to check (ref. `get_backend`)
+
+    images : list
+      List of RGB images used for the comparison
+
+    reference : object (default := None)
+      Reference backend; if None the Keras backend with
+      the default weights is used
+
+    tol : float (default := 0.5)
+      Threshold used for the mask binarization
+
+    atol : float (default := 1e-2)
+      Maximum absolute difference allowed between the
+      softmax outputs of the two backends
+
+  Returns
+  -------
+    report : dict
+      Dictionary with the maximum absolute difference of
+      the softmax outputs ('max_abs_diff'), the fraction of
+      equal mask pixels ('mask_agreement') and the result
+      of the check ('passed')
+  '''
+  # NOTE: avoid a circular import
+  from .segmentation import _preprocess
+
+  if reference is None:
+    reference = KerasBackend()
+
+  backend.load()
+  reference.load()
+
+  # pre-process the images into a single batch
+  batch = np.empty(
+    shape=(len(images), IMG_SIZE, IMG_SIZE, 3),
+    dtype=np.float32
+  )
+  for i, img in enumerate(images):
+    _preprocess(img, out=batch[i])
+
+  pred = backend.predict(batch)
+  true = reference.predict(batch)
+
+  max_abs_diff = float(np.max(np.abs(pred - true)))
+  mask_agreement = float(np.mean((pred > tol) == (true > tol)))
+
+  return {
+    'max_abs_diff' : max_abs_diff,
+    'mask_agreement' : mask_agreement,
+    'passed' : max_abs_diff <= atol,
+  }
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import threading
+import numpy as np
+
+# weights utilities
+from .checkpoints import get_cache_dir
+from .checkpoints import sha256sum
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+__all__ = [
+  'SegmentationCache',
+  'model_digest',
+]
+
+# default maximum size of the cache (512 MB)
+DEFAULT_MAX_BYTES = 512 * 1024**2
+# extension of the cached results
+_EXT = '.npz'
+
+# cache of the model digests as {path : (mtime, digest)}
+_digests = {}
+
+
+def model_digest (path : str) -> str :
+  '''
+  Compute the SHA-256 digest which identifies a model file
+  (or a SavedModel directory).
+  The result is cached until the file is modified.
+
+  Parameters
+  ----------
+    path : str
+      Path of the model file or directory
+
+  Returns
+  -------
+    digest : str
+      Hexadecimal SHA-256 digest
+  '''
+  path = os.path.abspath(path)
+  mtime = os.stat(path).st_mtime_ns
+
+  cached = _digests.get(path)
+  if cached is not None and cached[0] == mtime:
+    return cached[1]
+
+  if os.path.isdir(path):
+    digest = hashlib.sha256()
+    for root, _, files in sorted(os.walk(path)):
+      for f in sorted(files):
+        filename = os.path.join(root, f)
+        digest.update(os.path.relpath(filename, path).encode())
+        digest.update(sha256sum(filename).encode())
+    digest = digest.hexdigest()
+  else:
+    digest = sha256sum(path)
+
+  _digests[path] = (mtime, digest)
+  return digest
+
+
+class SegmentationCache (object):
+  '''
+  On-disk cache of the segmentation results, keyed by the
+  content of the image, the identity of the model and the
+  segmentation parameters.
+
+  The binary masks are stored bit-packed (1 bit per channel)
+  in compressed npz files, and the least recently used
+  entries are removed when the total size of the cache
+  exceeds the given limit.
+  The entries are written with an atomic rename, so the same
+  directory could be shared by multiple processes.
+
+  Parameters
+  ----------
+    cache_dir : str (default := None)
+      Directory of the cached results; if None the 'masks'
+      sub-directory of the Deepskin cache is used
+      (ref. `deepskin.checkpoints.get_cache_dir`)
+
+    max_bytes : int (default := 512 MB)
+      Maximum size of the cache on disk
+
+  Examples
+  --------
+  >>> cache = SegmentationCache(max_bytes=1024**3)
+  >>> mask = wound_segmentation(img=rgb, cache=cache)
+  >>> cache.stats
+  '''
+
+  def __init__ (self, cache_dir : str = None, max_bytes : int = DEFAULT_MAX_BYTES):
+
+    if max_bytes < 0:
+      raise ValueError(f'max_bytes must be non-negative. Given: {max_bytes}')
+
+    if cache_dir is None:
+      cache_dir = os.path.join(get_cache_dir(), 'masks')
+
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    # estimated size of the cache (None until the first scan)
+    self._size = None
+    self._lock = threading.Lock()
+
+  @property
+  def stats (self) -> dict :
+    '''
+    Get the usage statistics of the cache
+    '''
+    lookups = self.hits + self.misses
+    return {
+      'hits' : self.hits,
+      'misses' : self.misses,
+      'hit_rate' : self.hits / lookups if lookups else 0.,
+      'evictions' : self.evictions,
+      'size' : self._scan()[0],
+    }
+
+  @staticmethod
+  def key (img : np.ndarray, model : str, tol : float, **params) -> str :
+    '''
+    Compute the key of a segmentation result.
+
+    Parameters
+    ----------
+      img : np.ndarray
+        Input image
+
+      model : str
+        Identity of the model (e.g. backend, precision and
+        weights digest)
+
+      tol : float
+        Threshold applied for the output binarization
+
+      **params : dict
+        Other parameters which affect the result
+        (e.g. segmentation mode and output format)
+
+    Returns
+    -------
+      key : str
+        Hexadecimal SHA-256 digest
+    '''
+    digest = hashlib.sha256()
+    digest.update(repr((img.shape, img.dtype.str, model, float(tol), sorted(params.items()))).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.hexdigest()
+
+  def _path (self, key : str) -> str :
+    '''
+    Get the filename of a cache entry
+    '''
+    return os.path.join(self.cache_dir, f'{key}{_EXT}')
+
+  def get (self, key : str) -> np.ndarray :
+    '''
+    Load a cached result, marking it as recently used.
+
+    Parameters
+    ----------
+      key : str
+        Key of the result (ref. `key`)
+
+    Returns
+    -------
+      mask : np.ndarray
+        Cached result or None if it is not available
+    '''
+    filename = self._path(key)
+    try:
+      with np.load(filename, allow_pickle=False) as data:
+        mask = data['mask']
+        packed = bool(data['packed'])
+        channels = int(data['channels'])
+      # update the access time for the LRU policy
+      os.utime(filename)
+    except (OSError, KeyError, ValueError):
+      # missing or corrupted entry
+      with self._lock:
+        self.misses += 1
+      return None
+
+    if packed:
+      mask = np.unpackbits(mask[..., np.newaxis], axis=-1, count=channels, bitorder='little')
+      mask *= np.uint8(255)
+
+    with self._lock:
+      self.hits += 1
+
+    return mask
+
+  def put (self, key : str, mask : np.ndarray) -> None :
+    '''
+    Store a result in the cache, evicting the least recently
+    used entries if the size limit is exceeded.
+
+    Parameters
+    ----------
+      key : str
+        Key of the result (ref. `key`)
+
+      mask : np.ndarray
+        Segmentation result; the binary masks in {0, 255}
+        with shape (H, W, C) are stored bit-packed
+    '''
+    packed = (
+      mask.ndim == 3 and mask.dtype == np.uint8 and mask.shape[-1] <= 8 and
+      not np.any((mask != 0) & (mask != 255))
+    )
+    data = np.packbits(mask != 0, axis=-1, bitorder='little')[..., 0] if packed else mask
+
+    os.makedirs(self.cache_dir, exist_ok=True)
+    filename = self._path(key)
+    tmpfile = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+    with open(tmpfile, 'wb') as fp:
+      np.savez_compressed(
+        fp,
+        mask=data,
+        packed=packed,
+        channels=mask.shape[-1] if packed else 0,
+      )
+    size = os.path.getsize(tmpfile)
+
+    with self._lock:
+      # an existing entry with the same key is replaced,
+      # so its size is not counted anymore
+      try:
+        size -= os.path.getsize(filename)
+      except FileNotFoundError:
+        pass
+      os.replace(tmpfile, filename)
+
+      if self._size is not None:
+        self._size += size
+      if self._size is None or self._size > self.max_bytes:
+        self._evict()
+
+  def _scan (self) -> tuple :
+    '''
+    List the cache entries
+
+    Returns
+    -------
+      (size, entries) : tuple
+        Total size of the cache and list of entries
+        as (mtime, size, filename)
+    '''
+    entries = []
+    try:
+      with os.scandir(self.cache_dir) as it:
+        for entry in it:
+          if not entry.name.endswith(_EXT):
+            continue
+          try:
+            stat = entry.stat()
+          except FileNotFoundError:
+            continue
+          entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    except FileNotFoundError:
+      pass
+
+    return sum(e[1] for e in entries), entries
+
+  def _evict (self) -> None :
+    '''
+    Remove the least recently used entries until the
+    size of the cache is lower than the limit
+    '''
+    size, entries = self._scan()
+
+    for _, nbytes, filename in sorted(entries):
+      if size <= self.max_bytes:
+        break
+      try:
+        os.remove(filename)
+      except FileNotFoundError:
+        pass
+      size -= nbytes
+      self.evictions += 1
+
+    self._size = size
+
+  def clear (self) -> None :
+    '''
+    Remove all the cached results
+    '''
+    with self._lock:
+      for _, _, filename in self._scan()[1]:
+        try:
+          os.remove(filename)
+        except FileNotFoundError:
+          pass
+      self._size = 0
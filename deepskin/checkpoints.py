@@ -2,27 +2,246 @@
 # -*- coding: utf-8 -*-
 
 import os
-# download model weights
-import gdown
+import time
 import shutil
+import hashlib
+import tempfile
+import threading
 from zipfile import ZipFile
 
 # constant values
 from .constants import RESET_COLOR_CODE
 from .constants import GREEN_COLOR_CODE
 from .constants import RED_COLOR_CODE
+from .constants import MODEL_CHECKPOINT
+from .constants import MODEL_CHECKPOINT_SHA256
 
 __author__  = ['Nico Curti']
 __email__ = ['nico.curti2@unibo.it']
 
 __all__ = [
   'download_model_weights',
+  'get_cache_dir',
+  'get_model_weights',
+  'sha256sum',
 ]
 
-def download_model_weights (Id : str, model_name : str):
+# name of the default model checkpoint
+MODEL_NAME = 'efficientnetb3_deepskin_semantic_gray'
+
+# environment variable with the cache directory
+CACHE_DIR_ENV = 'DEEPSKIN_CACHE_DIR'
+# environment variable with a user-provided weights file
+WEIGHTS_ENV = 'DEEPSKIN_WEIGHTS'
+# environment variable with the expected SHA-256 of the weights
+WEIGHTS_SHA256_ENV = 'DEEPSKIN_WEIGHTS_SHA256'
+# environment variable which disables any download
+OFFLINE_ENV = 'DEEPSKIN_OFFLINE'
+
+# maximum age (sec) of a lock file before it is considered stale
+LOCK_TIMEOUT = 600
+# interval (sec) of the refresh of the lock file while it is held
+LOCK_HEARTBEAT = 30
+# polling interval (sec) while waiting for a lock
+LOCK_POLLING = 0.5
+
+# cache of the already verified files as {path : (size, mtime)}
+_verified = {}
+
+
+def sha256sum (filename : str, chunk_size : int = 1 << 20) -> str :
+  '''
+  Compute the SHA-256 digest of a file.
+
+  Parameters
+  ----------
+    filename : str
+      Path of the file
+
+    chunk_size : int (default := 1 MB)
+      Size of the chunks read from the file
+
+  Returns
+  -------
+    digest : str
+      Hexadecimal SHA-256 digest
+  '''
+  digest = hashlib.sha256()
+  with open(filename, 'rb') as fp:
+    for chunk in iter(lambda: fp.read(chunk_size), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+def get_cache_dir () -> str :
+  '''
+  Get the directory in which the model files are stored.
+
+  The directory is given by the DEEPSKIN_CACHE_DIR environment
+  variable, if set, otherwise it follows the XDG specification,
+  i.e. $XDG_CACHE_HOME/deepskin (default ~/.cache/deepskin).
+
+  Returns
+  -------
+    cache_dir : str
+      Path of the cache directory (not created)
+  '''
+  cache_dir = os.environ.get(CACHE_DIR_ENV)
+  if cache_dir:
+    return os.path.abspath(os.path.expanduser(cache_dir))
+
+  xdg_cache = os.environ.get('XDG_CACHE_HOME') or os.path.join('~', '.cache')
+  return os.path.abspath(os.path.join(os.path.expanduser(xdg_cache), 'deepskin'))
+
+def _legacy_path (model_name : str) -> str :
+  '''
+  Get the path used by the previous versions of the package
+  to store the model weights (i.e. <package>/../checkpoints)
+  '''
+  local = os.path.dirname(os.path.abspath(__file__))
+  return os.path.join(local, '..', 'checkpoints', f'{model_name}.h5')
+
+def _is_valid (filename : str, sha256 : str = None) -> bool :
+  '''
+  Check the integrity of a weights file against the expected
+  digest or, if not given, against the digest recorded at its
+  installation (if any).
+  The result is cached until the file is modified.
+  '''
+  if not os.path.isfile(filename):
+    return False
+
+  stat = os.stat(filename)
+  key = (filename, sha256)
+  if _verified.get(key) == (stat.st_size, stat.st_mtime_ns):
+    return True
+
+  if sha256 is None:
+    # use the digest recorded at the installation
+    sidecar = f'{filename}.sha256'
+    if not os.path.isfile(sidecar):
+      # nothing to check against
+      return True
+    with open(sidecar, 'r') as fp:
+      sha256 = fp.read().split()[0]
+
+  valid = sha256sum(filename) == sha256.lower()
+  if valid:
+    _verified[key] = (stat.st_size, stat.st_mtime_ns)
+  return valid
+
+def _gdown_download (Id : str, output : str) -> None :
+  '''
+  Download a file from google-drive
+  '''
+  # NOTE: gdown is imported only when the download is required
+  import gdown
+  gdown.download(id=Id, output=output, quiet=True)
+
+class _FileLock (object):
+  '''
+  Inter-process lock based on the exclusive creation of a
+  file, used to serialize the installation of the weights.
+  While the lock is held, the modification time of the file
+  is refreshed every LOCK_HEARTBEAT seconds, so a lock file
+  which is not updated for LOCK_TIMEOUT seconds is considered
+  stale (e.g. a killed worker) and removed, while the lock of
+  a long-running download is preserved.
+  '''
+
+  def __init__ (self, filename : str):
+    self.filename = filename
+    self._released = threading.Event()
+    self._heartbeat = None
+
+  def _refresh (self) -> None :
+    '''
+    Update the modification time of the lock file until
+    the lock is released
+    '''
+    while not self._released.wait(LOCK_HEARTBEAT):
+      try:
+        os.utime(self.filename)
+      except FileNotFoundError:
+        # the file could be moved for a while by a waiter
+        # which checks its staleness (ref. `_remove_stale`)
+        pass
+
+  def _remove_stale (self, stale : os.stat_result) -> None :
+    '''
+    Remove the stale lock file, given its status.
+
+    The file is atomically renamed to a unique name, so only
+    one of the waiters which found the same stale lock takes
+    it over; the renamed file is removed only if it is still
+    the stale one, otherwise it is the fresh lock created by
+    another waiter in the meantime and it is restored.
+    '''
+    taken = f'{self.filename}.{os.getpid()}.{threading.get_ident()}.stale'
+    try:
+      os.rename(self.filename, taken)
+    except FileNotFoundError:
+      # removed by another waiter
+      return
+
+    try:
+      status = os.stat(taken)
+      if (status.st_ino, status.st_mtime_ns) != (stale.st_ino, stale.st_mtime_ns):
+        # restore the lock, unless a new one was created
+        try:
+          os.link(taken, self.filename)
+        except FileExistsError:
+          pass
+    finally:
+      os.remove(taken)
+
+  def __enter__ (self):
+    while True:
+      try:
+        fd = os.open(self.filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+      except FileExistsError:
+        try:
+          status = os.stat(self.filename)
+        except FileNotFoundError:
+          # released in the meantime
+          continue
+        if time.time() - status.st_mtime > LOCK_TIMEOUT:
+          self._remove_stale(status)
+          continue
+        time.sleep(LOCK_POLLING)
+      else:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        break
+
+    self._released.clear()
+    self._heartbeat = threading.Thread(target=self._refresh, daemon=True)
+    self._heartbeat.start()
+    return self
+
+  def __exit__ (self, *args):
+    self._released.set()
+    self._heartbeat.join()
+    self._heartbeat = None
+    try:
+      os.remove(self.filename)
+    except FileNotFoundError:
+      pass
+
+def download_model_weights (Id : str,
+                            model_name : str,
+                            outdir : str = None,
+                            sha256 : str = None,
+                            downloader = None,
+                           ) -> str :
   '''
   Download the model files from google-drive repository
-  and unpack the files in the 'data' directory.
+  and install the weights in the cache directory.
+
+  The archive is downloaded and extracted in a temporary
+  directory and the weights are moved to their final location
+  with an atomic rename, holding a lock file: multiple workers
+  could call this function concurrently and the weights are
+  installed only once.
 
   Parameters
   ----------
@@ -31,39 +250,197 @@ def download_model_weights (Id : str, model_name : str):
 
   model_name : str
     Output filename without extension of the model weights
+
+  outdir : str (default := None)
+    Directory in which the weights are installed; if None
+    the cache directory is used (ref. `get_cache_dir`)
+
+  sha256 : str (default := None)
+    Expected SHA-256 digest of the weights file; if given,
+    a file with a different digest is rejected
+
+  downloader : callable (default := None)
+    Function with signature (Id, output) which stores the zip
+    archive in the output filename; if None the archive is
+    downloaded from google-drive (e.g. set a local stand-in
+    for testing purposes, ref. benchmarks/checkpoints_check.py)
+
+  Returns
+  -------
+  filename : str
+    Path of the installed weights file
+
+  Raises
+  ------
+  RuntimeError
+    If the download of the archive fails
+
+  ValueError
+    If the digest of the weights does not match the expected one
   '''
+  if outdir is None:
+    outdir = get_cache_dir()
+  if downloader is None:
+    downloader = _gdown_download
+
+  os.makedirs(outdir, exist_ok=True)
+  filename = os.path.join(outdir, f'{model_name}.h5')
+
+  with _FileLock(f'{filename}.lock'):
+
+    # the weights could be installed by another worker
+    # while this one was waiting for the lock
+    if _is_valid(filename, sha256=sha256):
+      return filename
+
+    # NOTE: the temporary directory is in the same file-system
+    # of the output one, so the final rename is atomic
+    tmpdir = tempfile.mkdtemp(prefix=f'.{model_name}-', dir=outdir)
+
+    try:
+      print (f'Downloading Deepskin model ... ', end='', flush=True)
+
+      archive = os.path.join(tmpdir, f'{model_name}.zip')
+      try:
+        downloader(Id, archive)
+        if not os.path.exists(archive):
+          raise FileNotFoundError(archive)
+      except Exception as e:
+        print(f'{RED_COLOR_CODE}[FAILED]{RESET_COLOR_CODE}',
+          end='\n',
+          flush=True,
+        )
+        raise RuntimeError(f'Impossible to download the Deepskin model weights ({model_name})') from e
 
-  print (f'Downloading Deepskin model ... ', end='', flush=True)
-  try:
-    gdown.download(id=Id, output=f'{model_name}.zip', quiet=True)
-    if os.path.exists(f'{model_name}.zip'):
       print(f'{GREEN_COLOR_CODE}[DONE]{RESET_COLOR_CODE}',
         end='\n',
         flush=True,
       )
-    else:
-      raise ValueError
-  except Exception as e:
-    print(f'{RED_COLOR_CODE}[FAILED]{RESET_COLOR_CODE}',
-      end='\n',
-      flush=True,
-    )
-    return
 
-  print ('Extracting files ... ', end='', flush=True)
+      print ('Extracting files ... ', end='', flush=True)
 
-  with ZipFile(f'{model_name}.zip') as zipper:
-    zipper.extractall('.')
+      with ZipFile(archive) as zipper:
+        zipper.extractall(tmpdir)
 
-  print (f'{GREEN_COLOR_CODE}[DONE]{RESET_COLOR_CODE}')
+      extracted = os.path.join(tmpdir, f'{model_name}.h5')
+      if not os.path.isfile(extracted):
+        raise FileNotFoundError(f'The archive does not contain the {model_name}.h5 file')
 
-  local = os.path.dirname(os.path.abspath(__file__))
-  outdir = os.path.join(local, '..', 'checkpoints')
-  os.makedirs(outdir, exist_ok=True)
-  # I use move to ensure the correct cross-link
-  # between putative different file-systems
-  # (e.g from WSL to Windows paths)
-  shutil.move(f'{model_name}.h5', os.path.join(outdir, f'{model_name}.h5'))
-  os.remove(f'{model_name}.zip')
+      digest = sha256sum(extracted)
+      if sha256 is not None and digest != sha256.lower():
+        raise ValueError((
+          f'Checksum mismatch of the {model_name} weights. '
+          f'Expected: {sha256}, Given: {digest}'
+        ))
+
+      # record the digest of the installed file
+      sidecar = os.path.join(tmpdir, f'{model_name}.h5.sha256')
+      with open(sidecar, 'w') as fp:
+        fp.write(f'{digest}  {model_name}.h5\n')
+
+      # atomic install: the sidecar is renamed first, so a
+      # stale sidecar could never validate the new weights
+      os.replace(sidecar, f'{filename}.sha256')
+      os.replace(extracted, filename)
+
+      print (f'{GREEN_COLOR_CODE}[DONE]{RESET_COLOR_CODE}')
+
+    finally:
+      shutil.rmtree(tmpdir, ignore_errors=True)
+
+  return filename
+
+def get_model_weights (model_name : str = MODEL_NAME,
+                       Id : str = MODEL_CHECKPOINT,
+                       sha256 : str = None,
+                       offline : bool = None,
+                       downloader = None,
+                      ) -> str :
+  '''
+  Get the path of the model weights, downloading them
+  into the cache directory if they are not available.
+
+  The weights are searched in the following order:
+    1. the file given by the DEEPSKIN_WEIGHTS environment
+       variable ("bring your own file"), used as it is;
+    2. the cache directory (ref. `get_cache_dir`);
+    3. the checkpoints directory used by the previous
+       versions of the package.
+  If none of them is found, the weights are downloaded,
+  unless the offline mode is enabled.
+
+  Parameters
+  ----------
+    model_name : str (default := 'efficientnetb3_deepskin_semantic_gray')
+      Filename without extension of the model weights
+
+    Id : str (default := MODEL_CHECKPOINT)
+      Google Drive Id of the weights file to download
+
+    sha256 : str (default := None)
+      Expected SHA-256 digest of the weights file; if None
+      the DEEPSKIN_WEIGHTS_SHA256 environment variable is
+      used (if set), otherwise the default model is checked
+      against MODEL_CHECKPOINT_SHA256 (if pinned) and the
+      other models against the digest recorded at their
+      installation.
+      NOTE: the digest of the default weights is currently not
+      pinned, so the downloaded file is trusted at its first
+      installation (trust-on-first-install) and then verified
+      against the recorded digest; set the expected digest to
+      verify also the first download
+
+    offline : bool (default := None)
+      If True, the download is disabled and an error is
+      raised if the weights are not available; if None the
+      DEEPSKIN_OFFLINE environment variable is used
+
+    downloader : callable (default := None)
+      Function with signature (Id, output) used to get
+      the zip archive (ref. `download_model_weights`)
+
+  Returns
+  -------
+    filename : str
+      Path of the weights file
+  '''
+  if sha256 is None:
+    sha256 = os.environ.get(WEIGHTS_SHA256_ENV) or None
+  if offline is None:
+    offline = os.environ.get(OFFLINE_ENV, '').lower() in ('1', 'true', 'yes', 'on')
+
+  # user-provided weights file
+  filename = os.environ.get(WEIGHTS_ENV)
+  if filename:
+    if not os.path.isfile(filename):
+      raise FileNotFoundError(f'The {WEIGHTS_ENV} weights file does not exist. Given: {filename}')
+    if sha256 is not None and not _is_valid(filename, sha256=sha256):
+      raise ValueError(f'Checksum mismatch of the {WEIGHTS_ENV} weights file. Given: {filename}')
+    return filename
+
+  if sha256 is None and model_name == MODEL_NAME and Id == MODEL_CHECKPOINT:
+    # known-good digest of the default model weights
+    sha256 = MODEL_CHECKPOINT_SHA256
+
+  cache_dir = get_cache_dir()
+  filename = os.path.join(cache_dir, f'{model_name}.h5')
+  if _is_valid(filename, sha256=sha256):
+    return filename
+
+  legacy = os.path.abspath(_legacy_path(model_name))
+  if _is_valid(legacy, sha256=sha256):
+    return legacy
+
+  if offline:
+    raise FileNotFoundError((
+      f'The {model_name} weights are not available and the offline mode is enabled; '
+      f'please set the {WEIGHTS_ENV} environment variable or copy the file into {cache_dir}'
+    ))
 
-  return
+  return download_model_weights(
+    Id=Id,
+    model_name=model_name,
+    outdir=cache_dir,
+    sha256=sha256,
+    downloader=downloader,
+  )
@@ -9,6 +9,8 @@ __email__ = ['nico.curti2@unibo.it']
 __all__ = [
   'CRLF',
   'IMG_SIZE',
+  'MODEL_CHECKPOINT',
+  'MODEL_CHECKPOINT_SHA256',
   'GREEN_COLOR_CODE',
   'ORANGE_COLOR_CODE',
   'VIOLET_COLOR_CODE',
@@ -21,6 +23,12 @@ __all__ = [
 ]
 
 IMG_SIZE = 256
+MODEL_CHECKPOINT = '1it-fXhSTFp49kS6I0_ceykZ8jqtYLPkL'
+# SHA-256 digest of the weights file of the MODEL_CHECKPOINT archive;
+# it is not pinned (None), so the weights are trusted at their first
+# installation and then verified against the digest recorded in the
+# cache (ref. deepskin.checkpoints.get_model_weights)
+MODEL_CHECKPOINT_SHA256 = None
 GREEN_COLOR_CODE = '\033[38;5;40m'
 ORANGE_COLOR_CODE = '\033[38;5;208m'
 VIOLET_COLOR_CODE = '\033[38;5;141m'
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+
+# image feature functions
+from .features import FeatureEngine
+from .features import feature_dependencies
+# PWAT evaluator
+from .pwat import get_wound_regions
+from .pwat import score_features
+from .pwat import PWAT_FEATURES
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+__all__ = [
+  'extract_feature_table',
+  'feature_schema',
+  'FeatureTable',
+  'TABLE_FORMATS',
+]
+
+# available output formats of the feature tables
+TABLE_FORMATS = ('npy', 'parquet', 'csv')
+# prefixes of the wound and peri-wound features
+_PREFIXES = ('w_', 'p_')
+
+
+def feature_schema (names : tuple = None, pwat : bool = True) -> np.dtype :
+  '''
+  Get the (stable) schema of the feature tables, i.e. the
+  wound and peri-wound features in the registry order,
+  followed by the PWAT score.
+
+  Parameters
+  ----------
+    names : tuple (default := None)
+      Subset of features to store, without the region prefix
+      (ref. `deepskin.features.FEATURE_REGISTRY`); if None all
+      the features are stored
+
+    pwat : bool (default := True)
+      Enable/Disable the PWAT score column; it requires all
+      the features used by the PWAT regression
+
+  Returns
+  -------
+    dtype : np.dtype
+      Structured dtype of the table rows (float64 fields)
+  '''
+  names, _ = feature_dependencies(names)
+  fields = [f'{prefix}{name}' for prefix in _PREFIXES for name in names]
+
+  if pwat:
+    missing = [k for k in PWAT_FEATURES if k not in fields]
+    if missing:
+      raise ValueError(f'Invalid feature names. The PWAT score requires the features {missing}')
+    fields.append('pwat')
+
+  return np.dtype([(field, np.float64) for field in fields])
+
+
+class _NpyWriter (object):
+  '''
+  Stream the rows of a structured array into a .npy file,
+  updating the shape in its header at the end
+  '''
+
+  def __init__ (self, output : str, dtype : np.dtype):
+    self.fp = open(output, 'wb')
+    self.header = {
+      'descr' : np.lib.format.dtype_to_descr(dtype),
+      'fortran_order' : False,
+      'shape' : (0, ),
+    }
+    # NOTE: the header is padded so that it could be
+    # re-written in-place with the final number of rows
+    np.lib.format.write_array_header_1_0(self.fp, self.header)
+    self.offset = self.fp.tell()
+    self.rows = 0
+
+  def write (self, chunk : np.ndarray) -> None :
+    self.fp.write(np.ascontiguousarray(chunk).data)
+    self.rows += len(chunk)
+
+  def close (self) -> None :
+    self.fp.seek(0)
+    np.lib.format.write_array_header_1_0(self.fp, {**self.header, 'shape' : (self.rows, )})
+    if self.fp.tell() != self.offset:
+      raise RuntimeError('Impossible to update the header of the .npy file')
+    self.fp.close()
+
+
+class _CsvWriter (object):
+  '''
+  Stream the rows of a structured array into a .csv file
+  '''
+
+  def __init__ (self, output : str, dtype : np.dtype):
+    self.fp = open(output, 'w')
+    self.fp.write(','.join(dtype.names) + '\n')
+    self.columns = len(dtype.names)
+
+  def write (self, chunk : np.ndarray) -> None :
+    # NOTE: all the fields are float64 values
+    values = np.ascontiguousarray(chunk).view(np.float64).reshape(-1, self.columns)
+    # the 17 significant digits preserve the float64 values
+    np.savetxt(self.fp, values, fmt='%.17g', delimiter=',')
+
+  def close (self) -> None :
+    self.fp.close()
+
+
+class _ParquetWriter (object):
+  '''
+  Stream the rows of a structured array into a .parquet
+  file, one row group for each chunk (it requires pyarrow)
+  '''
+
+  def __init__ (self, output : str, dtype : np.dtype):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    self.pa = pa
+    self.schema = pa.schema([(name, pa.float64()) for name in dtype.names])
+    self.writer = pq.ParquetWriter(output, self.schema)
+
+  def write (self, chunk : np.ndarray) -> None :
+    table = self.pa.Table.from_arrays(
+      [np.ascontiguousarray(chunk[name]) for name in self.schema.names],
+      schema=self.schema,
+    )
+    self.writer.write_table(table)
+
+  def close (self) -> None :
+    self.writer.close()
+
+
+# writers of the available output formats
+_WRITERS = {
+  'npy' : _NpyWriter,
+  'parquet' : _ParquetWriter,
+  'csv' : _CsvWriter,
+}
+
+
+class FeatureTable (object):
+  '''
+  Columnar table of the wound and peri-wound features of
+  a stream of images.
+
+  The features are stored into a pre-allocated buffer of
+  float64 columns with a stable schema (ref. `feature_schema`)
+  and the buffer is written to file each time it is full,
+  so the memory usage does not depend on the number of rows.
+  The PWAT score of the buffered rows is evaluated at once,
+  vectorized over the rows (ref. `deepskin.pwat.score_features`).
+  The file is written with a temporary name and renamed
+  when the table is closed.
+
+  Parameters
+  ----------
+    output : str
+      Output filename
+
+    fmt : str (default := None)
+      Output format; available options are 'npy' (structured
+      array), 'parquet' (it requires pyarrow) and 'csv'. If None
+      it is given by the extension of the output filename
+
+    names : tuple (default := None)
+      Subset of features to store (ref. `feature_schema`)
+
+    pwat : bool (default := True)
+      Enable/Disable the PWAT score column
+
+    chunk_size : int (default := 4096)
+      Number of rows of the buffer
+
+  Examples
+  --------
+  >>> with FeatureTable('features.parquet') as table:
+  ...   for img, mask in zip(images, masks):
+  ...     table.add(img, mask)
+  >>> table.rows
+  '''
+
+  def __init__ (self,
+                output : str,
+                fmt : str = None,
+                names : tuple = None,
+                pwat : bool = True,
+                chunk_size : int = 4096,
+               ):
+
+    if fmt is None:
+      fmt = os.path.splitext(output)[1].lstrip('.').lower()
+
+    if fmt not in TABLE_FORMATS:
+      raise ValueError((
+        f'Invalid table format. Available options are {TABLE_FORMATS}. '
+        f'Given: {fmt}'
+      ))
+
+    if chunk_size < 1:
+      raise ValueError(f'chunk_size must be positive. Given: {chunk_size}')
+
+    self.output = output
+    self.fmt = fmt
+    self.names, _ = feature_dependencies(names)
+    self.pwat = pwat
+    self.dtype = feature_schema(names=self.names, pwat=pwat)
+
+    # columns of the features (the PWAT score is the last one)
+    self.columns = self.dtype.names[:-1] if pwat else self.dtype.names
+    self.buffer = np.empty(shape=(chunk_size, ), dtype=self.dtype)
+    # float64 view of the buffer with shape (rows, columns)
+    self._values = self.buffer.view(np.float64).reshape(chunk_size, len(self.dtype.names))
+    # number of buffered rows and of written rows
+    self._size = 0
+    self.rows = 0
+
+    self._tmpfile = f'{output}.{os.getpid()}.tmp'
+    self._writer = _WRITERS[fmt](self._tmpfile, self.dtype)
+
+  def append (self, features : dict) -> None :
+    '''
+    Append a row of features to the table
+
+    Parameters
+    ----------
+      features : dict
+        Features of the image with the wound ('w_') and
+        peri-wound ('p_') prefixes; the features which are
+        not in the schema are ignored
+    '''
+    self._values[self._size, :len(self.columns)] = [features[k] for k in self.columns]
+    self._size += 1
+
+    if self._size == len(self.buffer):
+      self.flush()
+
+  def add (self, img : np.ndarray, mask : np.ndarray, ksize : tuple = (20, 20)) -> None :
+    '''
+    Evaluate the features of an image and append them to
+    the table
+
+    Parameters
+    ----------
+      img : np.ndarray
+        Input image to analyze in RGB fmt
+
+      mask : np.ndarray
+        Semantic mask of the image
+
+      ksize : tuple (default := (20, 20))
+        Kernel dimension for the mask processing
+        (ref. `deepskin.pwat.get_wound_regions`)
+    '''
+    wound_mask, periwound_mask = get_wound_regions(
+      mask=mask,
+      ksize=ksize,
+    )
+    # share the color conversions of the image between
+    # the wound and the peri-wound features
+    engine = FeatureEngine(
+      img=img,
+      masks=[wound_mask, periwound_mask]
+    )
+    self.append({
+      **engine.evaluate(wound_mask, prefix='w_', names=self.names),
+      **engine.evaluate(periwound_mask, prefix='p_', names=self.names),
+    })
+
+  def flush (self) -> None :
+    '''
+    Write the buffered rows to file
+    '''
+    if not self._size:
+      return
+
+    rows = self._values[:self._size]
+    if self.pwat:
+      rows[:, -1] = score_features(rows[:, :-1], names=self.columns)
+
+    self._writer.write(self.buffer[:self._size])
+    self.rows += self._size
+    self._size = 0
+
+  def close (self) -> None :
+    '''
+    Write the remaining rows and finalize the output file
+    '''
+    if self._writer is None:
+      return
+
+    self.flush()
+    self._writer.close()
+    self._writer = None
+    os.replace(self._tmpfile, self.output)
+
+  def abort (self) -> None :
+    '''
+    Stop the writing and remove the partial output
+    '''
+    if self._writer is None:
+      return
+
+    try:
+      self._writer.close()
+    finally:
+      self._writer = None
+      if os.path.exists(self._tmpfile):
+        os.remove(self._tmpfile)
+
+  def __enter__ (self):
+    return self
+
+  def __exit__ (self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self.abort()
+
+
+def extract_feature_table (inputs,
+                           output : str,
+                           fmt : str = None,
+                           names : tuple = None,
+                           pwat : bool = True,
+                           ksize : tuple = (20, 20),
+                           chunk_size : int = 4096,
+                          ) -> int :
+  '''
+  Evaluate the wound and peri-wound features of a stream of
+  images and write them into a columnar table, with constant
+  memory usage (ref. `FeatureTable`).
+
+  Parameters
+  ----------
+    inputs : iterable
+      Stream of (image, semantic mask) pairs, where the
+      images are in RGB fmt
+
+    output : str
+      Output filename
+
+    fmt : str (default := None)
+      Output format; available options are 'npy', 'parquet'
+      and 'csv'. If None it is given by the output extension
+
+    names : tuple (default := None)
+      Subset of features to store (ref. `feature_schema`)
+
+    pwat : bool (default := True)
+      Enable/Disable the PWAT score column
+
+    ksize : tuple (default := (20, 20))
+      Kernel dimension for the mask processing
+
+    chunk_size : int (default := 4096)
+      Number of rows written to file at once
+
+  Returns
+  -------
+    rows : int
+      Number of rows of the table, in the same order of
+      the inputs
+
+  Examples
+  --------
+  >>> pairs = ((img, wound_segmentation(img)) for img in images)
+  >>> extract_feature_table(pairs, 'features.npy')
+  >>> table = np.load('features.npy')
+  >>> table['pwat']
+  '''
+  with FeatureTable(output, fmt=fmt, names=names, pwat=pwat, chunk_size=chunk_size) as table:
+    for img, mask in inputs:
+      table.add(img, mask, ksize=ksize)
+
+  return table.rows
@@ -3,17 +3,338 @@
 
 import cv2
 import numpy as np
-import mahotas as mh
 
 __author__  = ['Nico Curti']
 __email__ = ['nico.curti2@unibo.it']
 
 __all__ = [
-  'evaluate_features'
+  'evaluate_features',
+  'evaluate_region_features',
+  'feature_dependencies',
+  'FeatureEngine',
+  'FEATURE_REGISTRY',
 ]
 
+# name of the channels of the color spaces
+_COLOR_CHANNELS = {
+  'rgb' : ('R', 'G', 'B'),
+  'hsv' : ('H', 'S', 'V'),
+  'lab' : ('L', 'a', 'b'),
+}
+# opencv conversion codes of the color spaces
+_COLOR_CODES = {
+  'hsv' : cv2.COLOR_RGB2HSV,
+  'lab' : cv2.COLOR_RGB2LAB,
+}
+# directions of the 3D co-occurrence matrices (as in mahotas)
+_3D_DELTAS = (
+  (1, 0, 0),
+  (1, 1, 0),
+  (0, 1, 0),
+  (1,-1, 0),
+  (0, 0, 1),
+  (1, 0, 1),
+  (0, 1, 1),
+  (1, 1, 1),
+  (1,-1, 1),
+  (1, 0,-1),
+  (0, 1,-1),
+  (1, 1,-1),
+  (1,-1,-1),
+)
 
-def get_haralick (masked : np.ndarray) -> np.ndarray :
+# registry of the features (without the region prefix) as
+# {name : dependencies}, in the output order of the features
+FEATURE_REGISTRY = {
+  **{f'haralick{i:d}' : ('glcm', ) for i in range(13)},
+  **{f'{stat}{ch}' : (f'hist_{space}', )
+    for space, channels in _COLOR_CHANNELS.items()
+    for stat in ('avg', 'std')
+    for ch in channels
+  },
+  'park' : ('pixels', 'rgb'),
+  'amparo' : ('pixels', 'hsv'),
+}
+# dependencies of the intermediate results
+_DEPENDENCIES = {
+  # co-occurrence matrices of the masked image
+  'glcm' : ('rgb', ),
+  # histograms of the channels of the color spaces
+  **{f'hist_{space}' : (space, ) for space in _COLOR_CHANNELS},
+  # color space conversions of the crop
+  **{space : () for space in _COLOR_CHANNELS},
+  # pixels inside the mask
+  'pixels' : (),
+}
+
+
+def feature_dependencies (names : tuple = None) -> tuple :
+  '''
+  Resolve the intermediate results (color conversions,
+  co-occurrence matrices, histograms and masked pixels)
+  required by a subset of features.
+
+  Parameters
+  ----------
+    names : tuple (default := None)
+      Feature names without the region prefix
+      (ref. `FEATURE_REGISTRY`); if None all the
+      features are used
+
+  Returns
+  -------
+    (names, dependencies) : tuple
+      Feature names in the output order and set of the
+      required intermediate results
+  '''
+  if names is None:
+    names = tuple(FEATURE_REGISTRY)
+
+  unknown = [n for n in names if n not in FEATURE_REGISTRY]
+  if unknown:
+    raise ValueError((
+      f'Invalid feature names. Available options are {tuple(FEATURE_REGISTRY)}. '
+      f'Given: {unknown}'
+    ))
+
+  # sort the features according to the registry
+  names = set(names)
+  names = tuple(n for n in FEATURE_REGISTRY if n in names)
+
+  # visit the dependency graph
+  dependencies = set()
+  stack = [d for n in names for d in FEATURE_REGISTRY[n]]
+  while stack:
+    node = stack.pop()
+    if node not in dependencies:
+      dependencies.add(node)
+      stack.extend(_DEPENDENCIES[node])
+
+  return names, dependencies
+
+
+def _entropy (p : np.ndarray) -> np.ndarray :
+  '''
+  Compute the entropy (in bits) of the distributions
+  along the last axis of the input
+  '''
+  return -np.sum(np.log2(p + (p == 0)) * p, axis=-1)
+
+def cooccurrence_matrices (f : np.ndarray, distance : int = 1) -> np.ndarray :
+  '''
+  Compute the symmetric grey-level co-occurrence matrices
+  of a 3D image along the 13 directions, ignoring the pairs
+  which involve a zero-valued voxel (background).
+
+  Parameters
+  ----------
+    f : np.ndarray
+      Input 3D image of integer type with values in [0, 256),
+      e.g. the masked RGB image
+
+    distance : int (default := 1)
+      Distance between the voxels of each pair
+
+  Returns
+  -------
+    cmats : np.ndarray
+      Co-occurrence matrices in int64 fmt with shape (13, M, M),
+      where M = f.max() + 1
+
+  Notes
+  -----
+  The pairs of each direction are given by two shifted views
+  of the image, and they are counted by the 2D histogram of
+  OpenCV (or by `np.bincount` of the pair indexes, if the
+  counts could exceed the exact integer range of float32);
+  the pairs with a background voxel fall in the first
+  row/column of the matrix, which is reset.
+  '''
+  M = int(f.max()) + 1
+  if M > 256:
+    raise ValueError(f'The co-occurrence matrices support values lower than 256. Given: {M - 1}')
+
+  # split the channels into contiguous planes, so that
+  # the pairs are given by shifted views of the planes
+  planes = [np.ascontiguousarray(f[..., c], dtype=np.uint8) for c in range(f.shape[-1])]
+
+  cmats = np.zeros(shape=(len(_3D_DELTAS), M, M), dtype=np.int64)
+
+  for d, delta in enumerate(_3D_DELTAS):
+    dy, dx, dz = (step * distance for step in delta)
+    h, w = planes[0].shape
+
+    # spatial views of the first and second voxels of the pairs
+    src = (slice(max(-dy, 0), h - max(dy, 0)), slice(max(-dx, 0), w - max(dx, 0)))
+    dst = (slice(max(dy, 0), h - max(-dy, 0)), slice(max(dx, 0), w - max(-dx, 0)))
+
+    for c in range(max(-dz, 0), len(planes) - max(dz, 0)):
+      a = planes[c][src]
+      b = planes[c + dz][dst]
+
+      if a.size == 0:
+        continue
+
+      if a.size < 2**24:
+        counts = cv2.calcHist(
+          images=[a, b],
+          channels=[0, 1],
+          mask=None,
+          histSize=[M, M],
+          ranges=[0, M, 0, M],
+        )
+      else:
+        # encode each pair as a single index
+        codes = np.multiply(a, np.uint16(M), dtype=np.uint16)
+        codes += b
+        counts = np.bincount(codes.ravel(), minlength=M * M).reshape(M, M)
+
+      cmats[d] += counts.astype(np.int64)
+
+  # make the matrices symmetric
+  cmats += cmats.transpose(0, 2, 1).copy()
+
+  # ignore the background pairs
+  cmats[:, 0, :] = 0
+  cmats[:, :, 0] = 0
+
+  return cmats
+
+def haralick_features (cmats : np.ndarray, features : tuple = None) -> np.ndarray :
+  '''
+  Compute the 13 Haralick features of a set of
+  co-occurrence matrices, averaged over the directions
+  (as mahotas.features.haralick with return_mean=True).
+
+  Parameters
+  ----------
+    cmats : np.ndarray
+      Co-occurrence matrices with shape (n_directions, M, M)
+
+    features : tuple (default := None)
+      Indexes of the features to compute; the intermediate
+      distributions required only by the other features
+      are skipped. If None all the features are computed
+
+  Returns
+  -------
+    h_feature : np.ndarray
+      Haralick array of features with shape (13, ); the
+      features which are not computed are set to NaN
+  '''
+  D, M, _ = cmats.shape
+
+  need = set(range(13)) if features is None else set(features)
+  if not need <= set(range(13)):
+    raise ValueError(f'Invalid Haralick features. Available options are 0-12. Given: {sorted(need)}')
+
+  T = cmats.sum(axis=(1, 2))
+  if not np.all(T):
+    raise ValueError(('Impossible to compute the Haralick features: the input is empty. '
+      'This can happen if there are no pairs of non-zero pixels along a direction'
+    ))
+
+  p = cmats / T[:, np.newaxis, np.newaxis].astype(np.float64)
+  pravel = p.reshape(D, M * M)
+
+  k = np.arange(M)
+  k2 = k**2
+  tk = np.arange(2 * M)
+  tk2 = tk**2
+  i, j = np.mgrid[:M, :M]
+  offsets = np.arange(D)[:, np.newaxis]
+
+  feats = np.full(shape=(D, 13), fill_value=np.nan, dtype=np.float64)
+
+  if need & {2, 3, 11, 12}:
+    # marginal distributions
+    px = p.sum(axis=1)
+    py = p.sum(axis=2)
+    ux = px @ k
+    uy = py @ k
+    vx = px @ k2 - ux**2
+    vy = py @ k2 - uy**2
+    sx = np.sqrt(vx)
+    sy = np.sqrt(vy)
+
+  if need & {5, 6, 7}:
+    # distribution of the sum of the levels
+    px_plus_y = np.bincount(
+      (offsets * 2 * M + (i + j).ravel()).ravel(),
+      weights=pravel.ravel(),
+      minlength=D * 2 * M
+    ).reshape(D, 2 * M)
+
+  if need & {1, 9, 10}:
+    # distribution of the difference of the levels
+    px_minus_y = np.bincount(
+      (offsets * M + np.abs(i - j).ravel()).ravel(),
+      weights=pravel.ravel(),
+      minlength=D * M
+    ).reshape(D, M)
+
+  # angular second moment
+  if 0 in need:
+    feats[:, 0] = np.sum(pravel * pravel, axis=1)
+  # contrast
+  if 1 in need:
+    feats[:, 1] = px_minus_y @ k2
+  # correlation
+  if 2 in need:
+    with np.errstate(divide='ignore', invalid='ignore'):
+      corr = (1. / sx / sy) * (pravel @ (i * j).ravel() - ux * uy)
+    feats[:, 2] = np.where((sx == 0.) | (sy == 0.), 1., corr)
+  # sum of squares: variance
+  if 3 in need:
+    feats[:, 3] = vx
+  # inverse difference moment
+  if 4 in need:
+    feats[:, 4] = pravel @ (1. / ((i - j)**2 + 1)).ravel()
+  # sum average
+  if need & {5, 6}:
+    feats[:, 5] = px_plus_y @ tk
+  # sum entropy
+  if 7 in need:
+    feats[:, 7] = _entropy(px_plus_y)
+  # sum variance
+  if 6 in need:
+    feats[:, 6] = px_plus_y @ tk2 - feats[:, 5]**2
+  # entropy
+  if need & {8, 11, 12}:
+    feats[:, 8] = _entropy(pravel)
+  # difference variance
+  if 9 in need:
+    feats[:, 9] = px_minus_y.var(axis=1)
+  # difference entropy
+  if 10 in need:
+    feats[:, 10] = _entropy(px_minus_y)
+
+  # information measures of correlation
+  if need & {11, 12}:
+    crosspxpy = px[:, :, np.newaxis] * py[:, np.newaxis, :]
+    # log(0) becomes log(1), i.e. it does not contribute
+    crosspxpy += (crosspxpy == 0)
+    crosspxpy = crosspxpy.reshape(D, M * M)
+
+  if 11 in need:
+    HX = _entropy(px)
+    HY = _entropy(py)
+    HXY1 = -np.sum(pravel * np.log2(crosspxpy), axis=1)
+    HXY = np.maximum(HX, HY)
+    feats[:, 11] = (feats[:, 8] - HXY1) / np.where(HXY == 0., 1., HXY)
+
+  if 12 in need:
+    HXY2 = _entropy(crosspxpy)
+    feats[:, 12] = np.sqrt(np.maximum(0, 1 - np.exp(-2. * (HXY2 - feats[:, 8]))))
+
+  # remove the intermediate features which were not requested
+  h_feature = feats.mean(axis=0)
+  h_feature[[f for f in range(13) if f not in need]] = np.nan
+
+  return h_feature
+
+
+def get_haralick (masked : np.ndarray, features : tuple = None) -> np.ndarray :
   '''
   Extract the Haralick features from the masked image
 
@@ -22,6 +343,9 @@ def get_haralick (masked : np.ndarray) -> np.ndarray :
   masked : np.ndarray
     Masked image in RGB, i.e cv2.bitwise_and(img, img, mask=mask)
 
+  features : tuple (default := None)
+    Indexes of the features to compute (ref. `haralick_features`)
+
   Returns
   -------
   h_feature : np.ndarray
@@ -34,18 +358,157 @@ def get_haralick (masked : np.ndarray) -> np.ndarray :
       shape=(13, ),
       dtype=np.float32
     )
-  # convert the image to grayscale
-  masked_gray = cv2.cvtColor(masked, cv2.COLOR_RGB2GRAY)
-  # compute the Haralick features
-  h_feature = mh.features.haralick(
+  # compute the co-occurrence matrices (ignoring the
+  # background pixels) along the 13 3D directions
+  cmats = cooccurrence_matrices(
     masked,
-    ignore_zeros=True,
-    return_mean=True,
     distance=1
   )
+  # compute the Haralick features
+  h_feature = haralick_features(cmats, features=features)
 
   return h_feature
 
+def channel_histograms (img : np.ndarray, mask : np.ndarray = None) -> np.ndarray :
+  '''
+  Compute the 256-bin histogram of each channel of an
+  uint8 image, restricted to the non-zero pixels of the mask.
+
+  Parameters
+  ----------
+    img : np.ndarray
+      Input image in uint8 fmt with shape (H, W, C)
+
+    mask : np.ndarray (default := None)
+      Input mask in GRAYSCALE format; if None all the
+      pixels are used
+
+  Returns
+  -------
+    hist : np.ndarray
+      Pixel counts with shape (C, 256)
+  '''
+  if img.dtype != np.uint8:
+    raise ValueError(f'Invalid image dtype. The histograms require uint8 images. Given: {img.dtype}')
+
+  img = np.ascontiguousarray(img)
+  if mask is not None:
+    mask = np.ascontiguousarray(mask, dtype=np.uint8)
+
+  hist = np.stack([
+    cv2.calcHist([img], [c], mask, [256], [0, 256]).ravel()
+    for c in range(img.shape[-1])
+  ], axis=0)
+
+  return hist.astype(np.int64)
+
+def histogram_stats (hist : np.ndarray, scale : float = 1. / 255) -> tuple :
+  '''
+  Compute the (exact) average and standard deviation of
+  the values from their 256-bin histograms.
+
+  Parameters
+  ----------
+    hist : np.ndarray
+      Pixel counts with shape (C, 256) (ref. `channel_histograms`)
+
+    scale : float (default := 1/255)
+      Scale factor of the values, i.e. the values are
+      normalized into [0, 1] by default
+
+  Returns
+  -------
+    (avg, std) : tuple
+      Average & Std values of each channel with shape (C, 1),
+      as returned by cv2.meanStdDev
+  '''
+  values = np.arange(hist.shape[-1], dtype=np.float64) * scale
+  N = hist.sum(axis=-1, keepdims=True)
+  # avoid the division by zero of the empty histograms
+  N = np.maximum(N, 1)
+  avg = (hist @ values)[:, np.newaxis] / N
+  # NOTE: the centered formulation avoids the cancellation errors
+  var = np.sum(hist * (values - avg)**2, axis=-1, keepdims=True) / N
+  std = np.sqrt(var)
+  return avg, std
+
+def histogram_features (hist : np.ndarray,
+                        channels : tuple,
+                        prefix : str = '',
+                        median : bool = False,
+                        percentiles : tuple = (),
+                        entropy : bool = False,
+                        scale : float = 1. / 255,
+                       ) -> dict :
+  '''
+  Compute the optional distribution features (median,
+  percentiles and entropy) of each channel from its
+  256-bin histogram.
+
+  The percentiles are the smallest values whose cumulative
+  frequency reaches the given fraction of the pixels (i.e.
+  the 'inverted_cdf' method of np.percentile), so the
+  median is the lower median.
+
+  Parameters
+  ----------
+    hist : np.ndarray
+      Pixel counts with shape (C, 256) (ref. `channel_histograms`)
+
+    channels : tuple
+      Name of the C channels
+
+    prefix : str (default := '')
+      Prefix name to prepend on the feature names
+
+    median : bool (default := False)
+      Enable/Disable the median features ('med<channel>')
+
+    percentiles : tuple (default := ())
+      Percentiles in [0, 100] to evaluate ('p<q><channel>')
+
+    entropy : bool (default := False)
+      Enable/Disable the entropy (in bits) of the histograms
+      ('ent<channel>')
+
+    scale : float (default := 1/255)
+      Scale factor of the values, i.e. the values are
+      normalized into [0, 1] by default
+
+  Returns
+  -------
+    features : dict
+      Output dictionary of the distribution features
+  '''
+  features = {}
+
+  if not (median or percentiles or entropy):
+    return features
+
+  N = hist.sum(axis=-1)
+  cdf = np.cumsum(hist, axis=-1)
+
+  def quantile (q):
+    # NOTE: the empty histograms return zero values
+    target = np.ceil(q / 100 * N)
+    idx = np.array([np.searchsorted(c, max(t, 1)) for c, t in zip(cdf, target)])
+    return np.where(N > 0, idx * scale, 0.)
+
+  if median:
+    features.update({f'{prefix}med{ch}' : v for ch, v in zip(channels, quantile(50))})
+
+  for q in percentiles:
+    if not 0 <= q <= 100:
+      raise ValueError(f'Percentiles must be in [0, 100]. Given: {q}')
+    features.update({f'{prefix}p{q:g}{ch}' : v for ch, v in zip(channels, quantile(q))})
+
+  if entropy:
+    p = hist / np.maximum(N, 1)[:, np.newaxis]
+    # NOTE: the sum avoids the negative zeros of the empty histograms
+    features.update({f'{prefix}ent{ch}' : v + 0. for ch, v in zip(channels, _entropy(p))})
+
+  return features
+
 def get_rgb_channel_stats (img : np.ndarray,
                            mask : np.ndarray
                           ) -> tuple :
@@ -65,15 +528,13 @@ def get_rgb_channel_stats (img : np.ndarray,
   (avg, std) : tuple
     Average & Std values related to RGB channels
   '''
-  # convert the image into floating-point values
-  rgb = np.float32(img)
-  # normalize the values in [0, 1]
-  rgb *= 1. / 255
-  # compute avg and std of each channel
-  avg, std = cv2.meanStdDev(
-    src=rgb,
+  # compute the histograms of the channels
+  hist = channel_histograms(
+    img=img,
     mask=mask,
   )
+  # compute avg and std of each channel (normalized in [0, 1])
+  avg, std = histogram_stats(hist)
   return avg, std
 
 def get_hsv_channel_stats (img : np.ndarray,
@@ -97,15 +558,13 @@ def get_hsv_channel_stats (img : np.ndarray,
   '''
   # conver the image from RGB to HSV
   hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
-  # convert the image into floating-point values
-  hsv = np.float32(hsv)
-  # normalize the values in [0, 1]
-  hsv *= 1./255
-  # compute avg and std of each channel
-  avg, std = cv2.meanStdDev(
-    src=hsv,
-    mask=mask
+  # compute the histograms of the channels
+  hist = channel_histograms(
+    img=hsv,
+    mask=mask,
   )
+  # compute avg and std of each channel (normalized in [0, 1])
+  avg, std = histogram_stats(hist)
   return avg, std
 
 def get_lab_channel_stats (img : np.ndarray,
@@ -129,60 +588,193 @@ def get_lab_channel_stats (img : np.ndarray,
   '''
   # conver the image from RGB to LAB
   lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
-  # convert the image into floating-point values
-  lab = np.float32(lab)
-  # normalize the values in [0, 1]
-  lab *= 1./255
-  # compute avg and std of each channel
-  avg, std = cv2.meanStdDev(
-    src=lab,
-    mask=mask
+  # compute the histograms of the channels
+  hist = channel_histograms(
+    img=lab,
+    mask=mask,
   )
+  # compute avg and std of each channel (normalized in [0, 1])
+  avg, std = histogram_stats(hist)
   return avg, std
 
-def get_park_redness (img : np.ndarray,
-                      mask : np.ndarray
-                     ) -> float :
+def masked_pixels (img : np.ndarray, mask : np.ndarray) -> np.ndarray :
   '''
-  Get the Park et al. Redness score feature (Does it work??)
+  Gather the pixels of the image inside the mask by
+  their flat indexes, so that the pixel-wise features
+  could share them (ref. `get_redness_scores`).
 
   Parameters
   ----------
   img : np.ndarray
-    Input image in RGB format
+    Input image with shape (H, W, C)
 
   mask : np.ndarray
     Input mask in GRAYSCALE format
 
+  Returns
+  -------
+  pixels : np.ndarray
+    Masked pixels with shape (N, C)
+  '''
+  index = np.flatnonzero(mask)
+  return img.reshape(-1, img.shape[-1])[index]
+
+# numba kernels of the redness scores (compiled at their first usage)
+_numba_kernels = None
+
+def _get_numba_kernels () -> tuple :
+  '''
+  Compile the numba kernels of the redness scores, which
+  sum the pixel-wise scores without temporary arrays
+  (it requires numba)
+
+  Returns
+  -------
+    (park_sum, amparo_sum) : tuple
+      Kernels which return the sum of the scores of the
+      RGB and HSV pixels with shape (N, 3)
+  '''
+  global _numba_kernels
+
+  if _numba_kernels is None:
+    import numba
+
+    @numba.njit(cache=True, nogil=True)
+    def park_sum (rgb):
+      # NOTE: the pixel-wise scores are evaluated in float32 as
+      # the numpy implementation, while they are summed in float64
+      total = 0.
+      for i in range(rgb.shape[0]):
+        r = np.float32(rgb[i, 0])
+        g = np.float32(rgb[i, 1])
+        b = np.float32(rgb[i, 2])
+        total += (np.float32(2) * r - g - b) / (np.float32(2) * (r + g + b + np.float32(1e-5)))
+      return total
+
+    @numba.njit(cache=True, nogil=True)
+    def amparo_sum (hsv):
+      total = 0.
+      for i in range(hsv.shape[0]):
+        total += (np.float32(hsv[i, 0]) * np.float32(hsv[i, 1])) / np.float32(255 * 255)
+      return total
+
+    _numba_kernels = (park_sum, amparo_sum)
+
+  return _numba_kernels
+
+def park_redness (rgb : np.ndarray, use_numba : bool = False) -> float :
+  '''
+  Compute the average Park et al. redness score of a set
+  of pixels.
+
+  Parameters
+  ----------
+  rgb : np.ndarray
+    Pixels in RGB format with shape (N, 3) (ref. `masked_pixels`)
+
+  use_numba : bool (default := False)
+    Enable/Disable the numba kernel (it requires numba)
+
   Returns
   -------
   score : float
-    Park et al. redness score
+    Park et al. redness score (-0.5 if there are no pixels)
   '''
-  # apply the mask on the image
-  image = cv2.bitwise_and(
-    src1=img,
-    src2=img,
-    mask=mask,
-  )
-  # count the non zero values in the mask
-  N = np.sum(mask != 0)
+  N = len(rgb)
   # if the mask is empty return a fixed value
   if N == 0:
     return -0.5
 
-  # convert the image into floating-point values
-  image = np.float32(image)
-  # split the image into channels
-  r, g, b = cv2.split(image)
+  if use_numba:
+    park_sum, _ = _get_numba_kernels()
+    return park_sum(np.ascontiguousarray(rgb)) / N
+
+  # convert the pixels into floating-point values
+  r, g, b = np.float32(rgb).T
   # compute the Park redness score
   f2 = (2*r - g - b) / (2 * (r + g + b + 1e-5)) # range[-.5, 1]
-  f2 = f2 * np.where(mask != 0, 1, np.nan)
-  f2 = np.nansum(f2) / N
-  return f2
+  return np.sum(f2, dtype=np.float64) / N
+
+def amparo_redness (hsv : np.ndarray, use_numba : bool = False) -> float :
+  '''
+  Compute the average Amparo et al. redness score of a set
+  of pixels.
+
+  Parameters
+  ----------
+  hsv : np.ndarray
+    Pixels in HSV format with shape (N, 3)
+
+  use_numba : bool (default := False)
+    Enable/Disable the numba kernel (it requires numba)
+
+  Returns
+  -------
+  score : float
+    Amparo et al. redness score (0 if there are no pixels)
+  '''
+  N = len(hsv)
+  # if the mask is empty return a fixed value
+  if N == 0:
+    return 0.0
+
+  if use_numba:
+    _, amparo_sum = _get_numba_kernels()
+    return amparo_sum(np.ascontiguousarray(hsv)) / N
+
+  # convert the h and s channels to float
+  h, s, _ = np.float32(hsv).T
+  # compute the Amparo et al. redness score
+  f1 = (h * s) / (255 * 255) # range[0, 1]
+  return np.sum(f1, dtype=np.float64) / N
+
+def _rgb2hsv_pixels (rgb : np.ndarray) -> np.ndarray :
+  '''
+  Convert a set of RGB pixels with shape (N, 3) to HSV
+  '''
+  if not len(rgb):
+    return rgb
+  hsv = cv2.cvtColor(np.ascontiguousarray(rgb)[:, np.newaxis], cv2.COLOR_RGB2HSV)
+  return hsv[:, 0]
+
+def get_park_redness (img : np.ndarray,
+                      mask : np.ndarray,
+                      pixels : np.ndarray = None,
+                      use_numba : bool = False,
+                     ) -> float :
+  '''
+  Get the Park et al. Redness score feature (Does it work??)
+
+  Parameters
+  ----------
+  img : np.ndarray
+    Input image in RGB format
+
+  mask : np.ndarray
+    Input mask in GRAYSCALE format
+
+  pixels : np.ndarray (default := None)
+    Masked pixels of the image, if already gathered
+    (ref. `masked_pixels`)
+
+  use_numba : bool (default := False)
+    Enable/Disable the numba kernel (ref. `park_redness`)
+
+  Returns
+  -------
+  score : float
+    Park et al. redness score
+  '''
+  # get only the pixels inside the mask
+  if pixels is None:
+    pixels = masked_pixels(img, mask)
+
+  return park_redness(pixels, use_numba=use_numba)
 
 def get_amparo_redness (img : np.ndarray,
-                        mask : np.ndarray
+                        mask : np.ndarray,
+                        pixels : np.ndarray = None,
+                        use_numba : bool = False,
                        ) -> float :
   '''
   Get the Amparo et al. Redness score feature (Does it work??)
@@ -195,41 +787,466 @@ def get_amparo_redness (img : np.ndarray,
   mask : np.ndarray
     Input mask in GRAYSCALE format
 
+  pixels : np.ndarray (default := None)
+    Masked pixels of the image in RGB format, if already
+    gathered (ref. `masked_pixels`)
+
+  use_numba : bool (default := False)
+    Enable/Disable the numba kernel (ref. `amparo_redness`)
+
   Returns
   -------
   score : float
     Amparo et al. redness score
   '''
-  # apply the mask on the image
-  image = cv2.bitwise_and(
-    src1=img,
-    src2=img,
-    mask=mask,
-  )
-  # count the non zero values in the mask
-  N = np.sum(mask != 0)
-  # if the mask is empty return a fixed value
+  # get only the pixels inside the mask
+  if pixels is None:
+    pixels = masked_pixels(img, mask)
 
-  if N == 0:
-    return 0.0
+  # NOTE: only the masked pixels are converted to HSV
+  return amparo_redness(_rgb2hsv_pixels(pixels), use_numba=use_numba)
+
+def get_redness_scores (img : np.ndarray,
+                        mask : np.ndarray,
+                        use_numba : bool = False,
+                       ) -> tuple :
+  '''
+  Get both the Park et al. and the Amparo et al. redness
+  scores, gathering the masked pixels only once.
+
+  Parameters
+  ----------
+  img : np.ndarray
+    Input image in RGB format
+
+  mask : np.ndarray
+    Input mask in GRAYSCALE format
+
+  use_numba : bool (default := False)
+    Enable/Disable the numba kernels
+
+  Returns
+  -------
+  (park, amparo) : tuple
+    Park et al. and Amparo et al. redness scores
+  '''
+  pixels = masked_pixels(img, mask)
+  park = get_park_redness(img, mask, pixels=pixels, use_numba=use_numba)
+  amparo = get_amparo_redness(img, mask, pixels=pixels, use_numba=use_numba)
+  return park, amparo
+
+def _bounding_box (masks : list) -> tuple :
+  '''
+  Get the bounding box (x, y, w, h) which contains the
+  non-zero pixels of all the given masks
+  '''
+  boxes = [
+    cv2.boundingRect(np.ascontiguousarray(m) if m.dtype == np.uint8 else np.uint8(m != 0))
+    for m in masks
+  ]
+  boxes = [b for b in boxes if b[2] and b[3]]
+
+  if not boxes:
+    return (0, 0, 0, 0)
+
+  x0 = min(b[0] for b in boxes)
+  y0 = min(b[1] for b in boxes)
+  x1 = max(b[0] + b[2] for b in boxes)
+  y1 = max(b[1] + b[3] for b in boxes)
+
+  return (x0, y0, x1 - x0, y1 - y0)
+
+
+class FeatureEngine (object):
+  '''
+  Fused extractor of the Deepskin features of one image.
+
+  The image is cropped on the bounding box of the regions
+  of interest and the color space conversions of the crop
+  are computed only once (at their first usage), so they
+  are shared by all the features and by all the masks
+  evaluated on the same image (e.g. wound and peri-wound).
+  The features are the same of the single feature
+  functions (ref. `evaluate_features`).
+
+  Parameters
+  ----------
+    img : np.ndarray
+      Input original image in RGB format
+
+    masks : list (default := None)
+      List of the binary masks which will be evaluated;
+      if None the whole image is used
+
+    use_numba : bool (default := False)
+      Enable/Disable the numba kernels of the redness
+      scores (ref. `park_redness`)
+
+  Examples
+  --------
+  >>> engine = FeatureEngine(img, masks=[wound_mask, periwound_mask])
+  >>> wound_features = engine.evaluate(wound_mask, prefix='w_')
+  >>> periwound_features = engine.evaluate(periwound_mask, prefix='p_')
+
+  >>> engine = FeatureEngine(img, masks=[labels])
+  >>> features = engine.evaluate_regions(labels, regions={'w_' : 1, 'p_' : 2})
+  '''
+
+  def __init__ (self, img : np.ndarray, masks : list = None, use_numba : bool = False):
+
+    if masks is None:
+      roi = (0, 0, img.shape[1], img.shape[0])
+    else:
+      roi = _bounding_box(masks)
+
+    self.img = img
+    self.roi = roi
+    self.use_numba = use_numba
+    x, y, w, h = roi
+    self._crop = img[y : y + h, x : x + w]
+    # cache of the color space conversions of the crop
+    self._cache = {}
+
+  def _color (self, space : str) -> np.ndarray :
+    '''
+    Get the crop in the given color space in uint8 fmt
+    '''
+    if space not in self._cache:
+
+      if space == 'rgb':
+        # NOTE: the contiguous crop allows the flat indexing
+        data = np.ascontiguousarray(self._crop)
+      else:
+        data = cv2.cvtColor(self._crop, _COLOR_CODES[space])
+
+      self._cache[space] = data
+
+    return self._cache[space]
+
+  def _crop_mask (self, mask : np.ndarray) -> np.ndarray :
+    '''
+    Crop the mask on the engine ROI, checking that all the
+    non-zero pixels are inside it
+    '''
+    x, y, w, h = self.roi
+    crop = mask[y : y + h, x : x + w]
+
+    if (x, y, w, h) != (0, 0, mask.shape[1], mask.shape[0]):
+      if cv2.countNonZero(crop) != cv2.countNonZero(mask):
+        raise ValueError('The mask is not contained in the ROI of the feature engine')
+
+    return np.ascontiguousarray(crop)
+
+  def evaluate (self,
+                mask : np.ndarray,
+                prefix : str,
+                median : bool = False,
+                percentiles : tuple = (),
+                entropy : bool = False,
+                names : tuple = None,
+               ) -> dict :
+    '''
+    Evaluate the deepskin feature according to the
+    ROI identified by the provided mask.
+
+    The color statistics are computed from the masked 256-bin
+    histograms of the uint8 channels, which provide also the
+    optional distribution features without further passes
+    on the image.
+
+    Parameters
+    ----------
+      mask : np.ndarray
+        Input mask for the ROI identification in binary format;
+        it must be contained in the masks given to the engine
+
+      prefix : str
+        Prefix name to prepend on the feature names
+
+      median : bool (default := False)
+        Add the median of each channel (ref. `histogram_features`)
+
+      percentiles : tuple (default := ())
+        Percentiles of each channel to add (ref. `histogram_features`)
+
+      entropy : bool (default := False)
+        Add the entropy of each channel (ref. `histogram_features`)
+
+      names : tuple (default := None)
+        Subset of features to evaluate (without the prefix);
+        only the intermediate results required by them are
+        computed (ref. `feature_dependencies`). If None all
+        the features are evaluated
+
+    Returns
+    -------
+      features : dict
+        Output dictionary of features (ref. `evaluate_features`)
+    '''
+    extra = bool(median or percentiles or entropy)
+    names, dependencies = feature_dependencies(names)
+    # the distribution features require all the histograms
+    spaces = [
+      space for space in _COLOR_CHANNELS
+      if extra or f'hist_{space}' in dependencies
+    ]
+
+    mask = self._crop_mask(mask)
+    # number of pixels in the mask
+    N = cv2.countNonZero(mask) if mask.size else 0
+
+    if N == 0:
+      # empty mask (also the crop could be empty)
+      haralick = np.zeros(shape=(13, ), dtype=np.float32)
+      hists = {
+        space : np.zeros(shape=(3, 256), dtype=np.int64)
+        for space in spaces
+      }
+      park = -0.5
+      amparo = 0.0
+
+    else:
+
+      if 'glcm' in dependencies:
+        rgb = self._color('rgb')
+        # apply the mask on the image to turn-off
+        # all the background pixels
+        # NOTE: this is mandatory only for the Haralick features
+        masked = cv2.bitwise_and(rgb, rgb, mask=mask)
+        # get the Haralick features
+        haralick = get_haralick(
+          masked,
+          features=[int(n[8:]) for n in names if n.startswith('haralick')]
+        )
+
+      # compute the histograms of each channel in each color space
+      hists = {
+        space : channel_histograms(img=self._color(space), mask=mask)
+        for space in spaces
+      }
+
+      if 'pixels' in dependencies:
+        # get the flat indexes of the masked pixels only once
+        index = np.flatnonzero(mask)
+
+      if 'park' in names:
+        # compute the Park redness score
+        park = park_redness(
+          self._color('rgb').reshape(-1, 3)[index],
+          use_numba=self.use_numba
+        )
+
+      if 'amparo' in names:
+        # compute the Amparo et al. redness score
+        amparo = amparo_redness(
+          self._color('hsv').reshape(-1, 3)[index],
+          use_numba=self.use_numba
+        )
+
+    # collect the computed features
+    values = {}
+    if 'glcm' in dependencies:
+      values.update({f'haralick{i:d}' : v for i, v in enumerate(haralick.ravel())})
+    for space in spaces:
+      avg, std = histogram_stats(hists[space])
+      channels = _COLOR_CHANNELS[space]
+      values.update({f'avg{c}' : v for c, v in zip(channels, avg.ravel())})
+      values.update({f'std{c}' : v for c, v in zip(channels, std.ravel())})
+    if 'park' in names:
+      values['park'] = park
+    if 'amparo' in names:
+      values['amparo'] = amparo
+
+    # build the feature set
+    features = {f'{prefix}{n}' : values[n] for n in names}
+
+    # add the optional distribution features
+    for space in spaces if extra else ():
+      features.update(histogram_features(
+        hists[space],
+        channels=_COLOR_CHANNELS[space],
+        prefix=prefix,
+        median=median,
+        percentiles=percentiles,
+        entropy=entropy,
+      ))
+
+    return features
+
+  def evaluate_regions (self,
+                        labels : np.ndarray,
+                        regions : dict = None,
+                        median : bool = False,
+                        percentiles : tuple = (),
+                        entropy : bool = False,
+                        names : tuple = None,
+                       ) -> dict :
+    '''
+    Evaluate the deepskin features of several regions of
+    the image at once, given by a label image.
+
+    The per-label histograms of all the color channels
+    (`np.bincount` of label * 256 + value) and the per-label
+    sums of the redness scores are computed by a single sweep
+    of the labeled pixels, and the statistics of each region
+    are obtained by combining the histograms/sums of its labels.
+    Overlapping regions could be defined as union of disjoint
+    labels, e.g. wound = (1, 3) and peri-wound = (2, 3), where
+    3 labels their overlap.
+
+    Parameters
+    ----------
+      labels : np.ndarray
+        Label image of non-negative integers, in which 0
+        is the background; it must be contained in the masks
+        given to the engine
+
+      regions : dict (default := None)
+        Regions to evaluate as {prefix : label or tuple of labels};
+        if None, each non-zero label is a region with the
+        '<label>_' prefix (e.g. the connected components of
+        more wounds in the same image)
+
+      median : bool (default := False)
+        Add the median of each channel (ref. `histogram_features`)
+
+      percentiles : tuple (default := ())
+        Percentiles of each channel to add (ref. `histogram_features`)
+
+      entropy : bool (default := False)
+        Add the entropy of each channel (ref. `histogram_features`)
+
+      names : tuple (default := None)
+        Subset of features to evaluate for all the regions
+        (ref. `evaluate`)
+
+    Returns
+    -------
+      features : dict
+        Output dictionary of the features of all the regions,
+        each one with the same entries of `evaluate`
+    '''
+    extra = bool(median or percentiles or entropy)
+    names, dependencies = feature_dependencies(names)
+    # the distribution features require all the histograms
+    spaces = [
+      space for space in _COLOR_CHANNELS
+      if extra or f'hist_{space}' in dependencies
+    ]
+
+    labels = self._crop_mask(labels)
+
+    if regions is None:
+      regions = {f'{label}_' : label for label in np.unique(labels) if label}
+    regions = {prefix : np.atleast_1d(ids).astype(np.intp) for prefix, ids in regions.items()}
+
+    num_labels = int(labels.max()) + 1 if labels.size else 1
+    num_labels = max([num_labels] + [int(ids.max()) + 1 for ids in regions.values() if ids.size])
+
+    # get the labeled pixels only
+    flat = labels.ravel()
+    inside = np.flatnonzero(flat)
+    flat = flat[inside].astype(np.intp)
+
+    # number of pixels of each label
+    counts = np.bincount(flat, minlength=num_labels)
+
+    # per-label histograms of the channels as {space : (label, channel, value)}
+    hists = {
+      space : np.zeros(shape=(num_labels, 3, 256), dtype=np.int64)
+      for space in spaces
+    }
+    sums = {}
+
+    if inside.size:
+      offset = flat * 256
+      for space in spaces:
+        values = self._color(space).reshape(-1, 3)[inside]
+        for c in range(3):
+          hists[space][:, c] = np.bincount(
+            offset + values[:, c],
+            minlength=num_labels * 256
+          ).reshape(num_labels, 256)
+
+      if 'park' in names:
+        # per-label sums of the Park redness score
+        r, g, b = np.float32(self._color('rgb').reshape(-1, 3)[inside]).T
+        f2 = (2*r - g - b) / (2 * (r + g + b + 1e-5)) # range[-.5, 1]
+        sums['park'] = np.bincount(flat, weights=f2, minlength=num_labels)
+
+      if 'amparo' in names:
+        # per-label sums of the Amparo et al. redness score
+        h, s, _ = np.float32(self._color('hsv').reshape(-1, 3)[inside]).T
+        f1 = (h * s) / (255 * 255) # range[0, 1]
+        sums['amparo'] = np.bincount(flat, weights=f1, minlength=num_labels)
+
+    features = {}
+
+    for prefix, ids in regions.items():
+      N = int(counts[ids].sum())
+
+      # combine the histograms of the region labels
+      hist = {space : hists[space][ids].sum(axis=0) for space in spaces}
+
+      if N == 0:
+        # empty region
+        haralick = np.zeros(shape=(13, ), dtype=np.float32)
+        park = -0.5
+        amparo = 0.0
+
+      else:
+        # combine the sums of the region labels
+        park = sums['park'][ids].sum() / N if 'park' in names else None
+        amparo = sums['amparo'][ids].sum() / N if 'amparo' in names else None
+
+        if 'glcm' in dependencies:
+          # the Haralick features require the region crop
+          mask = np.uint8(np.isin(labels, ids))
+          x, y, w, h = cv2.boundingRect(mask)
+          rgb = self._color('rgb')[y : y + h, x : x + w]
+          mask = mask[y : y + h, x : x + w]
+          masked = cv2.bitwise_and(rgb, rgb, mask=mask)
+          haralick = get_haralick(
+            masked,
+            features=[int(n[8:]) for n in names if n.startswith('haralick')]
+          )
+
+      # collect the computed features
+      values = {}
+      if 'glcm' in dependencies:
+        values.update({f'haralick{i:d}' : v for i, v in enumerate(haralick.ravel())})
+      for space in spaces:
+        avg, std = histogram_stats(hist[space])
+        channels = _COLOR_CHANNELS[space]
+        values.update({f'avg{ch}' : v for ch, v in zip(channels, avg.ravel())})
+        values.update({f'std{ch}' : v for ch, v in zip(channels, std.ravel())})
+      values['park'] = park
+      values['amparo'] = amparo
+
+      # build the feature set
+      features.update({f'{prefix}{n}' : values[n] for n in names})
+
+      # add the optional distribution features
+      for space in spaces if extra else ():
+        features.update(histogram_features(
+          hist[space],
+          channels=_COLOR_CHANNELS[space],
+          prefix=prefix,
+          median=median,
+          percentiles=percentiles,
+          entropy=entropy,
+        ))
+
+    return features
 
-  # convert the image to HSV color space
-  hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
-  # split the image in channels
-  h, s, v = cv2.split(hsv)
-  # convert the h channel to float
-  h = np.float32(h)
-  # convert the s channel to float
-  s = np.float32(s)
-  # compute the Amparo et al. redness score
-  f1 = (h * s) / (255 * 255) # range[0, 1]
-  f1 = f1 * np.where(mask != 0, 1, np.nan)
-  f1 = np.nansum(f1) / N
-  return f1
 
 def evaluate_features (img : np.ndarray,
                        mask : np.ndarray,
-                       prefix : str
+                       prefix : str,
+                       median : bool = False,
+                       percentiles : tuple = (),
+                       entropy : bool = False,
+                       names : tuple = None,
                       ) -> dict :
   '''
   Evaluate the deepskin feature according to the
@@ -246,87 +1263,95 @@ def evaluate_features (img : np.ndarray,
     prefix : str
       Prefix name to prepend on the feature names
 
+    median : bool (default := False)
+      Add the median of each channel (ref. `histogram_features`)
+
+    percentiles : tuple (default := ())
+      Percentiles of each channel to add (ref. `histogram_features`)
+
+    entropy : bool (default := False)
+      Add the entropy of each channel (ref. `histogram_features`)
+
+    names : tuple (default := None)
+      Subset of features to evaluate, without the prefix
+      (ref. `FeatureEngine.evaluate`)
+
   Returns
   -------
     features : dict
       Output dictionary of features
+
+  Notes
+  -----
+  The features are computed by the fused `FeatureEngine`;
+  use it directly to evaluate more masks of the same image.
   '''
-  # apply the mask on the image to turn-off
-  # all the background pixels
-  # NOTE: this is mandatory only for the Haralick features
-  masked = cv2.bitwise_and(
-    img,
-    img,
-    mask=mask
-  )
-  # get the Haralick features
-  haralick = get_haralick(masked).ravel()
-  # convert them to dict
-  haralick = {f'{prefix}haralick{i:d}' : v
-    for i, v in enumerate(haralick)
-  }
-
-  # get the RGB color space features
-  avg_rgb, std_rgb = get_rgb_channel_stats(
-    img=img,
-    mask=mask
-  )
-  # convert them to dict
-  avg_rgb = {f'{prefix}avg{c}' : v
-    for c, v in zip(['R', 'G', 'B'], avg_rgb.ravel())
-  }
-  std_rgb = {f'{prefix}std{c}' : v
-    for c, v in zip(['R', 'G', 'B'], std_rgb.ravel())
-  }
-
-  # get the HSV color space features
-  avg_hsv, std_hsv = get_hsv_channel_stats(
-    img=img,
-    mask=mask
-  )
-  # convert them to dict
-  avg_hsv = {f'{prefix}avg{c}' : v
-    for c, v in zip(['H', 'S', 'V'], avg_hsv.ravel())
-  }
-  std_hsv = {f'{prefix}std{c}' : v
-    for c, v in zip(['H', 'S', 'V'], std_hsv.ravel())
-  }
-
-  # get the Lab color space features
-  avg_lab, std_lab = get_lab_channel_stats(
-    img=img,
-    mask=mask
-  )
-  # convert them to dict
-  avg_lab = {f'{prefix}avg{c}' : v
-    for c, v in zip(['L', 'a', 'b'], avg_lab.ravel())
-  }
-  std_lab = {f'{prefix}std{c}' : v
-    for c, v in zip(['L', 'a', 'b'], std_lab.ravel())
-  }
-
-  # get the Park redness feature
-  park = get_park_redness(
-    img=img,
-    mask=mask
+  engine = FeatureEngine(img, masks=[mask])
+  return engine.evaluate(
+    mask,
+    prefix=prefix,
+    median=median,
+    percentiles=percentiles,
+    entropy=entropy,
+    names=names,
   )
-  # convert it to dict
-  park = {f'{prefix}park': park}
 
-  # get the Amparo redness feature
-  amparo = get_amparo_redness(
-    img=img,
-    mask=mask
-  )
-  amparo = {f'{prefix}amparo': amparo}
+def evaluate_region_features (img : np.ndarray,
+                              labels : np.ndarray,
+                              regions : dict = None,
+                              median : bool = False,
+                              percentiles : tuple = (),
+                              entropy : bool = False,
+                              names : tuple = None,
+                             ) -> dict :
+  '''
+  Evaluate the deepskin features of several regions of the
+  image at once, given by a label image (e.g. wound = 1 and
+  peri-wound = 2, or the connected components of more wounds).
+
+  Parameters
+  ----------
+    img : np.ndarray
+      Input original image in RGB format
 
-  # build the feature set
-  features = {
-    **haralick,
-    **avg_rgb, **std_rgb,
-    **avg_hsv, **std_hsv,
-    **avg_lab, **std_lab,
-    **park, **amparo,
-  }
+    labels : np.ndarray
+      Label image of non-negative integers with the same
+      shape of the image, in which 0 is the background
 
-  return features
+    regions : dict (default := None)
+      Regions to evaluate as {prefix : label or tuple of labels};
+      if None, each non-zero label is a region with the
+      '<label>_' prefix (ref. `FeatureEngine.evaluate_regions`)
+
+    median : bool (default := False)
+      Add the median of each channel (ref. `histogram_features`)
+
+    percentiles : tuple (default := ())
+      Percentiles of each channel to add (ref. `histogram_features`)
+
+    entropy : bool (default := False)
+      Add the entropy of each channel (ref. `histogram_features`)
+
+    names : tuple (default := None)
+      Subset of features to evaluate, without the prefix
+      (ref. `FeatureEngine.evaluate`)
+
+  Returns
+  -------
+    features : dict
+      Output dictionary of the features of all the regions
+
+  Examples
+  --------
+  >>> labels = np.uint8(wound_mask != 0) + 2 * np.uint8(periwound_mask != 0)
+  >>> features = evaluate_region_features(img, labels, regions={'w_' : (1, 3), 'p_' : (2, 3)})
+  '''
+  engine = FeatureEngine(img, masks=[labels])
+  return engine.evaluate_regions(
+    labels,
+    regions=regions,
+    median=median,
+    percentiles=percentiles,
+    entropy=entropy,
+    names=names,
+  )
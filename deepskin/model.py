@@ -10,6 +10,7 @@ import tensorflow as tf
 # constant values
 from .constants import CRLF
 from .constants import IMG_SIZE
+from .constants import MODEL_CHECKPOINT
 from .constants import RESET_COLOR_CODE
 from .constants import GREEN_COLOR_CODE
 
@@ -21,7 +22,8 @@ __all__ = [
   'MODEL_CHECKPOINT',
 ]
 
-MODEL_CHECKPOINT = '1it-fXhSTFp49kS6I0_ceykZ8jqtYLPkL'
+# numerical precisions available for the model build
+MODEL_PRECISIONS = ('float32', 'bfloat16')
 
 def transpose_bn_block (inputs, filters, stage, activation='relu'):
 
@@ -113,7 +115,18 @@ def decoder_block (inputs, filters, stage, skip=None, activation='relu'):
 
   return x
 
-def deepskin_model (verbose : bool = False) -> tf.keras.Model :
+def _mixed_bfloat16_layer (layer):
+  '''
+  Copy a layer with the 'mixed_bfloat16' dtype policy, except
+  the output ones which are kept in float32 (clone function
+  of `tf.keras.models.clone_model`)
+  '''
+  config = layer.get_config()
+  if layer.name not in ('final_conv', 'softmax'):
+    config['dtype'] = tf.keras.mixed_precision.Policy('mixed_bfloat16')
+  return layer.__class__.from_config(config)
+
+def deepskin_model (verbose : bool = False, precision : str = 'float32') -> tf.keras.Model :
   '''
   Build the Deepskin segmentation model.
 
@@ -121,8 +134,33 @@ def deepskin_model (verbose : bool = False) -> tf.keras.Model :
   ----------
     verbose : bool (default := False)
       Enable/Disable the logging of the steps.
+
+    precision : str (default := 'float32')
+      Numerical precision of the model; with 'bfloat16' the
+      layers of the model use the 'mixed_bfloat16' policy, i.e.
+      they compute in bfloat16 while the weights are stored in
+      float32 (so the float32 checkpoints could be loaded as
+      they are). The final convolution and the softmax are
+      computed in float32 in any case. The global dtype policy
+      of keras is not modified.
   '''
 
+  if precision not in MODEL_PRECISIONS:
+    raise ValueError((
+      f'Invalid precision. Available options are {MODEL_PRECISIONS}. '
+      f'Given: {precision}'
+    ))
+
+  if precision == 'bfloat16':
+    # NOTE: the global dtype policy is not modified (it is shared
+    # by the models built concurrently in the other threads), but
+    # the policy is given to each layer of a clone of the model
+    model = deepskin_model(verbose=verbose, precision='float32')
+    return tf.keras.models.clone_model(
+      model,
+      clone_function=_mixed_bfloat16_layer,
+    )
+
   if verbose:
     print(f'Build the deepskin model for semantic image segmentation',
       end='',
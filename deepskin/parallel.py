@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import cv2
+import numpy as np
+import multiprocessing as mp
+from collections import deque
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+# segmentation engine
+from .segmentation import DeepskinSegmenter
+from .segmentation import OUTPUT_FORMATS
+# image loader of the streaming pipeline
+from .pipeline import _load_image
+# precisions run by the tensorflow model
+from .backends import KERAS_PRECISIONS
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+__all__ = [
+  'parallel_segmentation',
+  'thread_budget',
+]
+
+# environment variables which set the size of the thread
+# pools of the numerical libraries
+_THREAD_ENVS = (
+  'OMP_NUM_THREADS',
+  'OPENBLAS_NUM_THREADS',
+  'MKL_NUM_THREADS',
+  'TF_NUM_INTRAOP_THREADS',
+  'TF_NUM_INTEROP_THREADS',
+)
+
+# segmentation engine of the worker process
+_segmenter = None
+
+
+def thread_budget (num_workers : int = None, total_threads : int = None) -> tuple :
+  '''
+  Split a total number of cores among the worker processes,
+  so that the thread pools of the workers do not oversubscribe
+  the available cores.
+
+  Parameters
+  ----------
+    num_workers : int (default := None)
+      Number of worker processes; if None, it is set so that
+      each worker uses (about) 4 threads
+
+    total_threads : int (default := None)
+      Total number of cores to use; if None all the available
+      cores are used
+
+  Returns
+  -------
+    (num_workers, num_threads) : tuple
+      Number of worker processes and number of threads
+      of each worker
+  '''
+  if total_threads is None:
+    total_threads = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+  if total_threads < 1:
+    raise ValueError(f'total_threads must be positive. Given: {total_threads}')
+
+  if num_workers is None:
+    num_workers = max(total_threads // 4, 1)
+
+  if num_workers < 1:
+    raise ValueError(f'num_workers must be positive. Given: {num_workers}')
+
+  num_threads = max(total_threads // num_workers, 1)
+
+  return num_workers, num_threads
+
+def _init_worker (weights : str,
+                  backend : str,
+                  precision : str,
+                  num_threads : int,
+                 ) -> None :
+  '''
+  Initialize a worker process: pin the size of its thread
+  pools and load the segmentation model once.
+  '''
+  global _segmenter
+
+  # NOTE: the thread pools must be sized before the
+  # initialization of the numerical libraries
+  for env in _THREAD_ENVS:
+    os.environ[env] = str(num_threads)
+  os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+
+  cv2.setNumThreads(num_threads)
+
+  if backend == 'keras' and precision in KERAS_PRECISIONS:
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+  _segmenter = DeepskinSegmenter(
+    weights=weights,
+    backend=backend,
+    num_threads=num_threads,
+    precision=precision,
+  ).load()
+
+def _segment_task (task : tuple, kwargs : dict) -> np.ndarray :
+  '''
+  Segment the image of a task, given by a filename or by
+  the (name, shape, dtype) of a shared-memory buffer.
+  '''
+  kind, item = task
+
+  if kind == 'file':
+    return _segmenter.segment(img=_load_image(item), **kwargs)
+
+  name, shape, dtype = item
+  shm = shared_memory.SharedMemory(name=name)
+  try:
+    img = np.ndarray(shape=shape, dtype=dtype, buffer=shm.buf)
+    mask = _segmenter.segment(img=img, **kwargs)
+    # release the view before the buffer
+    del img
+  finally:
+    shm.close()
+
+  return mask
+
+def _share (img : np.ndarray) -> tuple :
+  '''
+  Copy an image into a new shared-memory buffer
+
+  Returns
+  -------
+    (shm, item) : tuple
+      Shared-memory buffer and its task description
+  '''
+  shm = shared_memory.SharedMemory(create=True, size=max(img.nbytes, 1))
+  buffer = np.ndarray(shape=img.shape, dtype=img.dtype, buffer=shm.buf)
+  buffer[...] = img
+  del buffer
+  return shm, (shm.name, img.shape, img.dtype.str)
+
+def _unlink (shm : shared_memory.SharedMemory) -> None :
+  '''
+  Release a shared-memory buffer
+  '''
+  if shm is not None:
+    shm.close()
+    shm.unlink()
+
+def parallel_segmentation (inputs,
+                           num_workers : int = None,
+                           total_threads : int = None,
+                           tol : float = 0.5,
+                           mode : str = 'resize',
+                           output : str = 'mask',
+                           tta : str = None,
+                           weights : str = None,
+                           backend : str = 'keras',
+                           precision : str = 'float32',
+                           max_pending : int = None,
+                          ):
+  '''
+  Perform the semantic segmentation of a stream of images
+  sharding them among a pool of processes, each one with
+  its own copy of the model.
+
+  The total number of cores is split among the workers
+  (ref. `thread_budget`), and the TensorFlow/TFLite/ONNX
+  and OpenCV thread pools of each worker are sized
+  accordingly, avoiding the oversubscription of the cores.
+  The processes are started with the 'spawn' method and the
+  model is loaded only once by each worker.
+
+  Parameters
+  ----------
+    inputs : iterable
+      Stream of filenames or RGB images to process; the
+      images are passed to the workers through shared-memory
+      buffers, while the filenames are decoded by the workers
+
+    num_workers : int (default := None)
+      Number of worker processes (ref. `thread_budget`)
+
+    total_threads : int (default := None)
+      Total number of cores to use; if None all the
+      available cores are used
+
+    tol : float (default := 0.5)
+      Threshold to apply on the resulting masks for the
+      output binarization
+
+    mode : str (default := 'resize')
+      Segmentation strategy (ref. `DeepskinSegmenter.segment`)
+
+    output : str (default := 'mask')
+      Output representation; available options are 'mask',
+      'labels', 'bitmask' and 'proba'. The masks are sent back
+      to the main process, so the compact representations
+      reduce the communication cost
+
+    tta : str (default := None)
+      Test-time augmentation strategy
+      (ref. `DeepskinSegmenter.predict`)
+
+    weights : str (default := None)
+      Path of the model file (ref. `DeepskinSegmenter`)
+
+    backend : str (default := 'keras')
+      Inference backend to use (ref. `DeepskinSegmenter`)
+
+    precision : str (default := 'float32')
+      Numerical precision of the model (ref. `DeepskinSegmenter`)
+
+    max_pending : int (default := None)
+      Maximum number of images submitted to the workers and
+      not yet consumed; if None it is set to twice the number
+      of workers
+
+  Yields
+  ------
+    mask : np.ndarray
+      Semantic mask of each input (ref. `wound_segmentation`),
+      in the same order of the inputs
+
+  Examples
+  --------
+  >>> for mask in parallel_segmentation(filenames, total_threads=64, output='bitmask'):
+  ...   ...
+  '''
+  if output not in OUTPUT_FORMATS:
+    raise ValueError((
+      f'Invalid output format. Available options are {OUTPUT_FORMATS}. '
+      f'Given: {output}'
+    ))
+
+  num_workers, num_threads = thread_budget(
+    num_workers=num_workers,
+    total_threads=total_threads
+  )
+
+  if max_pending is None:
+    max_pending = 2 * num_workers
+  if max_pending < 1:
+    raise ValueError(f'max_pending must be positive. Given: {max_pending}')
+
+  kwargs = {
+    'tol' : tol,
+    'mode' : mode,
+    'output' : output,
+    'tta' : tta,
+  }
+
+  executor = ProcessPoolExecutor(
+    max_workers=num_workers,
+    mp_context=mp.get_context('spawn'),
+    initializer=_init_worker,
+    initargs=(weights, backend, precision, num_threads),
+  )
+
+  # submitted tasks as (future, shared-memory buffer)
+  pending = deque()
+
+  try:
+    for item in inputs:
+
+      if isinstance(item, (str, os.PathLike)):
+        shm, task = None, ('file', os.fspath(item))
+      else:
+        shm, task = _share(np.asarray(item))
+        task = ('shm', task)
+
+      pending.append((executor.submit(_segment_task, task, kwargs), shm))
+
+      # wait for the oldest task (backpressure)
+      if len(pending) >= max_pending:
+        future, shm = pending.popleft()
+        try:
+          mask = future.result()
+        finally:
+          _unlink(shm)
+        yield mask
+
+    while pending:
+      future, shm = pending.popleft()
+      try:
+        mask = future.result()
+      finally:
+        _unlink(shm)
+      yield mask
+
+  finally:
+    # stop the workers (e.g. error or early close of the generator)
+    for future, shm in pending:
+      future.cancel()
+    executor.shutdown(wait=True, cancel_futures=True)
+    for future, shm in pending:
+      _unlink(shm)
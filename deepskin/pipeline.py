@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import cv2
+import queue
+import threading
+import numpy as np
+
+# segmentation engine and its pre/post processing
+from .segmentation import _preprocess
+from .segmentation import _postprocess
+from .segmentation import get_default_segmenter
+from .segmentation import OUTPUT_FORMATS
+# constant values
+from .constants import IMG_SIZE
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+__all__ = [
+  'segmentation_pipeline',
+]
+
+# sentinel value used to close the pipeline stages
+_STOP = object()
+# polling interval (sec) of the blocking queue operations
+_POLLING = 0.1
+
+
+def _put (q : queue.Queue, item, stop : threading.Event) -> bool :
+  '''
+  Put an item in a bounded queue, waiting for a free slot
+  until the pipeline is stopped.
+
+  Returns
+  -------
+    done : bool
+      True if the item was inserted, False if the pipeline
+      was stopped in the meantime
+  '''
+  while not stop.is_set():
+    try:
+      q.put(item, timeout=_POLLING)
+      return True
+    except queue.Full:
+      pass
+  return False
+
+def _get (q : queue.Queue, stop : threading.Event):
+  '''
+  Get an item from a queue, waiting for it until the
+  pipeline is stopped (in that case _STOP is returned).
+  '''
+  while not stop.is_set():
+    try:
+      return q.get(timeout=_POLLING)
+    except queue.Empty:
+      pass
+  return _STOP
+
+def _load_image (item) -> np.ndarray :
+  '''
+  Get the RGB image associated to a pipeline input,
+  i.e. decode it if a filename is given.
+  '''
+  if isinstance(item, (str, os.PathLike)):
+    # load the image using opencv
+    bgr = cv2.imread(os.fspath(item), cv2.IMREAD_COLOR)
+    if bgr is None:
+      raise FileNotFoundError(f'Impossible to load the image. Given: {item}')
+    # convert the image from BGR to RGB fmt
+    return bgr[..., ::-1]
+
+  return item
+
+def segmentation_pipeline (inputs,
+                           tol : float = 0.5,
+                           batch_size : int = 8,
+                           num_workers : int = 2,
+                           queue_size : int = 16,
+                           segmenter = None,
+                           output : str = 'mask',
+                          ):
+  '''
+  Perform the semantic segmentation of a stream of images,
+  overlapping the image decoding, the pre-processing, the
+  model inference and the post-processing.
+
+  The images are decoded and resized by a pool of threads,
+  a single inference worker groups them in batches, and
+  the masks are resized back by another pool of threads.
+  All the stages communicate through bounded queues, so the
+  number of images in memory is limited (backpressure).
+
+  Parameters
+  ----------
+    inputs : iterable
+      Stream of filenames or RGB images to process
+
+    tol : float (default := 0.5)
+      Threshold to apply on the resulting masks for the
+      output binarization
+
+    batch_size : int (default := 8)
+      Maximum number of images processed by each forward pass
+
+    num_workers : int (default := 2)
+      Number of threads used by the decode/pre-process and
+      by the post-process stages
+
+    queue_size : int (default := 16)
+      Depth of the queues between the stages, i.e. the maximum
+      number of images processed at the same time
+
+    segmenter : DeepskinSegmenter (default := None)
+      Segmentation engine to use; if None the module-level
+      cached one is used
+
+    output : str (default := 'mask')
+      Output representation; available options are 'mask',
+      'labels', 'bitmask' and 'proba'
+      (ref. `DeepskinSegmenter.segment`)
+
+  Yields
+  ------
+    (img, mask) : tuple
+      RGB image and its semantic mask (ref. `wound_segmentation`),
+      in the same order of the inputs
+
+  Examples
+  --------
+  >>> for img, mask in segmentation_pipeline(filenames, batch_size=16):
+  ...   pwat = evaluate_PWAT_score(img=img, mask=mask)
+  '''
+  if batch_size < 1:
+    raise ValueError(f'batch_size must be positive. Given: {batch_size}')
+  if num_workers < 1:
+    raise ValueError(f'num_workers must be positive. Given: {num_workers}')
+  if queue_size < 1:
+    raise ValueError(f'queue_size must be positive. Given: {queue_size}')
+  if output not in OUTPUT_FORMATS:
+    raise ValueError((
+      f'Invalid output format. Available options are {OUTPUT_FORMATS}. '
+      f'Given: {output}'
+    ))
+
+  if segmenter is None:
+    segmenter = get_default_segmenter()
+  # load the model before starting the workers
+  backend = segmenter.backend
+
+  # queues between the stages
+  load_queue = queue.Queue(maxsize=queue_size)
+  infer_queue = queue.Queue(maxsize=queue_size)
+  post_queue = queue.Queue(maxsize=queue_size)
+  # bound the number of images not yet consumed
+  slots = threading.Semaphore(queue_size)
+  # re-order buffer of the results
+  results = {}
+  state = {'total' : None}
+  ready = threading.Condition()
+  # termination flag (e.g. error or early close of the generator)
+  stop = threading.Event()
+
+  def publish (index, img, result):
+    with ready:
+      results[index] = (img, result)
+      ready.notify_all()
+
+  def feeder ():
+    index = 0
+    try:
+      for index, item in enumerate(inputs, start=1):
+        # wait for a free slot
+        while not slots.acquire(timeout=_POLLING):
+          if stop.is_set():
+            return
+        if not _put(load_queue, (index - 1, item), stop):
+          return
+    except Exception as e:
+      # forward the error of the input stream
+      publish(index, None, e)
+      index += 1
+    finally:
+      with ready:
+        state['total'] = index
+        ready.notify_all()
+      for _ in range(num_workers):
+        _put(load_queue, _STOP, stop)
+
+  def preprocess ():
+    while True:
+      task = _get(load_queue, stop)
+      if task is _STOP:
+        break
+      index, item = task
+      try:
+        img = _load_image(item)
+        tensor = _preprocess(
+          img,
+          out=np.empty((IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        )
+      except Exception as e:
+        publish(index, None, e)
+        continue
+      if not _put(infer_queue, (index, img, tensor), stop):
+        break
+    _put(infer_queue, _STOP, stop)
+
+  def inference ():
+    # pre-allocate the input tensor, re-used by all the batches
+    batch = np.empty(
+      shape=(batch_size, IMG_SIZE, IMG_SIZE, 3),
+      dtype=np.float32
+    )
+    running = num_workers
+    while running:
+      task = _get(infer_queue, stop)
+      if task is _STOP:
+        running -= 1
+        if stop.is_set():
+          break
+        continue
+      # form a batch with the images already available
+      tasks = [task]
+      while len(tasks) < batch_size:
+        try:
+          task = infer_queue.get_nowait()
+        except queue.Empty:
+          break
+        if task is _STOP:
+          running -= 1
+          continue
+        tasks.append(task)
+
+      for i, (_, _, tensor) in enumerate(tasks):
+        batch[i] = tensor
+
+      try:
+        preds = backend.predict(batch[:len(tasks)])
+      except Exception as e:
+        for index, img, _ in tasks:
+          publish(index, img, e)
+        continue
+
+      for (index, img, _), pred in zip(tasks, preds):
+        if not _put(post_queue, (index, img, pred), stop):
+          return
+    for _ in range(num_workers):
+      _put(post_queue, _STOP, stop)
+
+  def postprocess ():
+    while True:
+      task = _get(post_queue, stop)
+      if task is _STOP:
+        break
+      index, img, pred = task
+      try:
+        mask = _postprocess(
+          pred=pred,
+          shape=img.shape[:2],
+          tol=tol,
+          output=output,
+        )
+      except Exception as e:
+        mask = e
+      publish(index, img, mask)
+
+  workers = [threading.Thread(target=feeder, daemon=True)]
+  workers += [threading.Thread(target=preprocess, daemon=True) for _ in range(num_workers)]
+  workers += [threading.Thread(target=inference, daemon=True)]
+  workers += [threading.Thread(target=postprocess, daemon=True) for _ in range(num_workers)]
+
+  for worker in workers:
+    worker.start()
+
+  try:
+    index = 0
+    while True:
+      with ready:
+        while index not in results and (state['total'] is None or index < state['total']):
+          ready.wait()
+        if index not in results:
+          # all the inputs have been processed
+          break
+        img, mask = results.pop(index)
+
+      # free a slot for the next input
+      slots.release()
+
+      if isinstance(mask, Exception):
+        raise mask
+
+      yield img, mask
+      index += 1
+
+  finally:
+    # stop the workers (e.g. early close of the generator)
+    stop.set()
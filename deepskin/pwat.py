@@ -2,14 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import cv2
-import numpy as np # just for typehints
+import numpy as np
 from time import time as now
+from functools import lru_cache
 
 # image pre/post processing algorithms
 from .imgproc import imfill
 from .imgproc import get_perilesion_mask
 # image feature functions
-from .features import evaluate_features
+from .features import FeatureEngine
 # pwat evaluation coefficients
 from .constants import Deepskin_CENTER
 from .constants import Deepskin_SCALE
@@ -24,8 +25,153 @@ __email__ = ['nico.curti2@unibo.it']
 
 __all__ = [
   'evaluate_PWAT_score',
+  'score_features',
+  'get_wound_regions',
+  'PWAT_FEATURES',
 ]
 
+# features used by the PWAT regression, in the column order
+# of the feature matrices (ref. `score_features`)
+PWAT_FEATURES = tuple(Deepskin_PWAT_PARAMS)
+# features of the wound and of the peri-wound areas used by
+# the PWAT regression, without their prefix
+_WOUND_FEATURES = tuple(k[2:] for k in PWAT_FEATURES if k.startswith('w_'))
+_PERIWOUND_FEATURES = tuple(k[2:] for k in PWAT_FEATURES if k.startswith('p_'))
+# order in which the terms of the regression are summed, i.e.
+# the wound features followed by the peri-wound ones
+_SUM_ORDER = tuple(f'w_{k}' for k in _WOUND_FEATURES) + tuple(f'p_{k}' for k in _PERIWOUND_FEATURES)
+
+
+@lru_cache(maxsize=32)
+def _compile_coefficients (names : tuple) -> tuple :
+  '''
+  Compile the standardization and regression coefficients
+  into vectors aligned with the PWAT features (in the order
+  of their sum), and get the columns of the PWAT features in
+  the given feature names.
+
+  Returns
+  -------
+    (columns, center, scale, weights) : tuple
+      Column indexes and coefficient vectors in float64 fmt
+  '''
+  missing = [k for k in PWAT_FEATURES if k not in names]
+  if missing:
+    raise ValueError(f'Invalid feature names. The PWAT features {missing} are missing')
+
+  columns = np.array([names.index(k) for k in _SUM_ORDER], dtype=np.intp)
+  center = np.array([Deepskin_CENTER.get(k, 0.0) for k in _SUM_ORDER], dtype=np.float64)
+  scale = np.array([Deepskin_SCALE.get(k, 1.0) for k in _SUM_ORDER], dtype=np.float64)
+  weights = np.array([Deepskin_PWAT_PARAMS[k] for k in _SUM_ORDER], dtype=np.float64)
+
+  for vector in (columns, center, scale, weights):
+    vector.setflags(write=False)
+
+  return columns, center, scale, weights
+
+def score_features (features : np.ndarray, names : tuple = PWAT_FEATURES) -> np.ndarray :
+  '''
+  Evaluate the PWAT scores of a matrix of features, with
+  one row for each image, vectorized over the rows.
+
+  The coefficients are compiled once for each column order.
+  The terms of the regression are summed in float64 one
+  column at a time, in the order of the wound features
+  followed by the peri-wound ones (i.e. the order of the
+  per-image sums of the previous versions), so the score of
+  each row is identical to the single-image one and it does
+  not depend on the other rows.
+
+  NOTE: for regions with less than 10 pixels the Haralick
+  features are float32 zeros, which the previous versions
+  standardized in float32: in this case the scores differ from
+  the previous ones at the ~1e-7 relative level, otherwise they
+  are identical.
+
+  Parameters
+  ----------
+    features : np.ndarray
+      Feature matrix with shape (N, F) (or a single row
+      with shape (F, ))
+
+    names : tuple (default := PWAT_FEATURES)
+      Names of the F columns of the matrix, e.g. all the
+      stored wound ('w_') and peri-wound ('p_') features;
+      they must include the PWAT features, while the other
+      columns are ignored
+
+  Returns
+  -------
+    pwat : np.ndarray
+      PWAT scores with shape (N, )
+
+  Examples
+  --------
+  >>> rows = [{**wound_features, **periwound_features}, ...]
+  >>> matrix = np.array([[r[k] for k in PWAT_FEATURES] for r in rows])
+  >>> pwat = score_features(matrix)
+  '''
+  names = tuple(names)
+  columns, center, scale, weights = _compile_coefficients(names)
+
+  features = np.atleast_2d(np.asarray(features, dtype=np.float64))
+
+  if features.ndim != 2 or features.shape[1] != len(names):
+    raise ValueError((
+      f'Invalid feature matrix. Expected shape (N, {len(names)}). '
+      f'Given: {features.shape}'
+    ))
+
+  # select the PWAT features in the order of the coefficients
+  features = features[:, columns]
+
+  # standardize and weight the features
+  terms = (features - center) / scale
+  terms *= weights
+
+  # NOTE: the terms are summed sequentially (unlike einsum or
+  # the BLAS matmul) to preserve the order of the operations
+  nwound = len(_WOUND_FEATURES)
+  pwat_wound = sum(terms[:, j] for j in range(nwound))
+  pwat_periwound = sum(terms[:, j] for j in range(nwound, len(_SUM_ORDER)))
+  pwat = pwat_wound + pwat_periwound
+
+  return pwat + Deepskin_PWAT_BIAS
+
+def get_wound_regions (mask : np.ndarray, ksize : tuple = (20, 20)) -> tuple :
+  '''
+  Extract the wound and peri-wound masks from the semantic
+  mask of the image.
+
+  Parameters
+  ----------
+    mask : np.ndarray
+      Semantic mask of the image
+
+    ksize : tuple (default := (20, 20))
+      Kernel dimension for the mask processing
+
+  Returns
+  -------
+    (wound_mask, periwound_mask) : tuple
+      Binary masks of the wound and of the peri-wound areas
+  '''
+  # un-pack the semantic mask into its components
+  bg_mask, body_mask, marker_mask, wound_mask = cv2.split(mask)
+
+  # get the peri-wound mask
+  periwound_mask = get_perilesion_mask(
+    mask=wound_mask,
+    ksize=ksize,
+  )
+  # correct the peri-wound mask according to the body
+  periwound_mask = cv2.bitwise_and(
+    periwound_mask,
+    periwound_mask,
+    mask=imfill(body_mask | wound_mask)
+  )
+
+  return wound_mask, periwound_mask
 
 def evaluate_PWAT_score (img : np.ndarray,
                          mask : np.ndarray,
@@ -64,31 +210,30 @@ def evaluate_PWAT_score (img : np.ndarray,
       flush=True,
     )
 
-  # un-pack the semantic mask into its components
-  bg_mask, body_mask, marker_mask, wound_mask = cv2.split(mask)
-
-  # get the peri-wound mask
-  periwound_mask = get_perilesion_mask(
-    mask=wound_mask,
+  # get the wound and peri-wound masks
+  wound_mask, periwound_mask = get_wound_regions(
+    mask=mask,
     ksize=ksize,
   )
-  # correct the peri-wound mask according to the body
-  periwound_mask = cv2.bitwise_and(
-    periwound_mask,
-    periwound_mask,
-    mask=imfill(body_mask | wound_mask)
-  )
 
   if verbose:
     print(f'{CRLF}{step} {GREEN_COLOR_CODE}[2/4] evaluate the wound features{RESET_COLOR_CODE}',
       end='',
       flush=True,
     )
-  # evaluate the wound features
-  wound_features = evaluate_features(
+  # share the color conversions of the image between
+  # the wound and the peri-wound features
+  engine = FeatureEngine(
     img=img,
+    masks=[wound_mask, periwound_mask]
+  )
+
+  # evaluate the wound features
+  # NOTE: only the features used by the regression are computed
+  wound_features = engine.evaluate(
     mask=wound_mask,
-    prefix='w_'
+    prefix='w_',
+    names=_WOUND_FEATURES,
   )
   if verbose:
     print(f'{CRLF}{step} {GREEN_COLOR_CODE}[3/4] evaluate the peri-wound features{RESET_COLOR_CODE}',
@@ -96,10 +241,10 @@ def evaluate_PWAT_score (img : np.ndarray,
       flush=True,
     )
   # evaluate the peri-wound features
-  periwound_features = evaluate_features(
-    img=img,
+  periwound_features = engine.evaluate(
     mask=periwound_mask,
-    prefix='p_'
+    prefix='p_',
+    names=_PERIWOUND_FEATURES,
   )
 
   if verbose:
@@ -108,28 +253,12 @@ def evaluate_PWAT_score (img : np.ndarray,
       flush=True,
     )
 
-  # standardize the wound features
-  wound_features = {k : (v - Deepskin_CENTER.get(k, 0.0)) / Deepskin_SCALE.get(k, 1.0)
-    for k, v in wound_features.items()
-  }
-
-  # standardize the peri-wound features
-  periwound_features = {k : (v - Deepskin_CENTER.get(k, 0.0)) / Deepskin_SCALE.get(k, 1.0)
-    for k, v in periwound_features.items()
-  }
-
-  # evaluate the PWAT contribution of the wound
-  pwat_wound = sum([v * Deepskin_PWAT_PARAMS.get(k, 0.0)
-    for k, v in wound_features.items()
-  ])
-
-  # evaluate the PWAT contribution of the peri-wound
-  pwat_periwound = sum([v * Deepskin_PWAT_PARAMS.get(k, 0.0)
-    for k, v in periwound_features.items()
-  ])
+  # collect the features in the order of the regression coefficients
+  features = {**wound_features, **periwound_features}
+  features = [features[k] for k in PWAT_FEATURES]
 
   # get the final PWAT score
-  pwat = pwat_wound + pwat_periwound + Deepskin_PWAT_BIAS
+  pwat = score_features(features)[0]
 
   toc = now()
 
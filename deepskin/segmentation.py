@@ -1,16 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os
-# disable tensorflow warnings
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-# segmentation model
-from .model import deepskin_model
-from .model import MODEL_CHECKPOINT
-# download model weights
-from .checkpoints import download_model_weights
-
+import gc
 import cv2
+import threading
 import numpy as np
 from time import time as now
 
@@ -19,16 +12,1154 @@ from .constants import CRLF
 from .constants import IMG_SIZE
 from .constants import RESET_COLOR_CODE
 from .constants import GREEN_COLOR_CODE
+# inference backends
+from .backends import get_backend
+# weights getter
+from .checkpoints import get_model_weights
+# result cache
+from .cache import model_digest
 
 __author__  = ['Nico Curti']
 __email__ = ['nico.curti2@unibo.it']
 
 __all__ = [
-  'wound_segmentation'
+  'DeepskinSegmenter',
+  'get_default_segmenter',
+  'release_default_segmenter',
+  'wound_segmentation',
+  'wound_segmentation_batch',
 ]
 
+# available segmentation strategies
+SEGMENTATION_MODES = ('resize', 'tiled', 'roi')
+# available output representations of the segmentation
+OUTPUT_FORMATS = ('mask', 'labels', 'bitmask', 'proba')
+# index of the wound channel in the semantic mask
+WOUND_CHANNEL = 3
+# transforms of the test-time augmentation as (number of
+# 90 degree rotations, horizontal flip) pairs
+_TTA_TRANSFORMS = {
+  # identity, horizontal, vertical and both flips
+  'flip' : ((0, False), (0, True), (2, True), (2, False)),
+  # all the flips and 90 degree rotations (dihedral group)
+  'dihedral' : tuple((k, flip) for flip in (False, True) for k in range(4)),
+}
+# available test-time augmentation strategies
+TTA_MODES = tuple(_TTA_TRANSFORMS)
+
+def _preprocess (img : np.ndarray, out : np.ndarray) -> np.ndarray :
+  '''
+  Resize the input image into the shape required by
+  the model and normalize its values into [0, 1] range.
+
+  Parameters
+  ----------
+    img : np.ndarray
+      Input image in RGB format
+
+    out : np.ndarray
+      Pre-allocated float32 buffer of shape (IMG_SIZE, IMG_SIZE, 3)
+      in which the result is stored
+
+  Returns
+  -------
+    out : np.ndarray
+      The filled buffer
+  '''
+  # resize the image into the shape required by the model
+  resized = cv2.resize(
+    img,
+    dsize=(IMG_SIZE, IMG_SIZE),
+    interpolation=cv2.INTER_CUBIC
+  )
+  # convert the image into floating-point values
+  # normalized into [0, 1] range
+  np.multiply(resized, np.float32(1. / 255), out=out)
+
+  return out
+
+def _binarize (pred : np.ndarray, tol : float = 0.5) -> np.ndarray :
+  '''
+  Binarize the model prediction.
+
+  Parameters
+  ----------
+    pred : np.ndarray
+      Model output (softmax probabilities)
+
+    tol : float (default := 0.5)
+      Threshold to apply for the output binarization
+
+  Returns
+  -------
+    mask : np.ndarray
+      Binary mask in uint8 fmt with values in {0, 255}
+  '''
+  # filter the mask output to binary format
+  # directly in uint8 fmt
+  mask = np.multiply(pred > tol, np.uint8(255), dtype=np.uint8)
+
+  return mask
+
+def _resize_nearest (mask : np.ndarray, shape : tuple) -> np.ndarray :
+  '''
+  Resize a (label) mask to the given shape with the
+  nearest-neighbour interpolation (if necessary).
+  '''
+  if mask.shape[:2] == tuple(shape):
+    return mask
+  return cv2.resize(
+    mask,
+    dsize=(shape[1], shape[0]),
+    interpolation=cv2.INTER_NEAREST_EXACT
+  )
+
+def _postprocess (pred : np.ndarray,
+                  shape : tuple,
+                  tol : float = 0.5,
+                  output : str = 'mask'
+                 ) -> np.ndarray :
+  '''
+  Convert the model prediction into the required output
+  representation and resize it to the shape of the
+  original image.
+  The conversion is performed before the resize, i.e.
+  at the (lower) resolution of the prediction.
+
+  Parameters
+  ----------
+    pred : np.ndarray
+      Model output of shape (h, w, 4)
+
+    shape : tuple
+      Shape (height, width) of the original image
+
+    tol : float (default := 0.5)
+      Threshold to apply for the output binarization
+
+    output : str (default := 'mask')
+      Output representation; available options are:
+        - 'mask': binary mask in uint8 fmt with shape (H, W, 4)
+          and values in {0, 255}
+        - 'labels': label map in uint8 fmt with shape (H, W),
+          given by the channel with the highest probability
+        - 'bitmask': single-channel uint8 mask with shape (H, W),
+          in which the c-th bit is set if the probability of
+          the c-th channel is greater than tol
+        - 'proba': probability map in float16 fmt with shape (H, W, 4)
+
+  Returns
+  -------
+    mask : np.ndarray
+      Output representation with the original shape
+  '''
+  if output == 'mask':
+    # filter the mask output to binary format
+    mask = _binarize(pred, tol=tol)
+
+  elif output == 'labels':
+    # get the most probable channel
+    mask = np.argmax(pred, axis=-1).astype(np.uint8)
+
+  elif output == 'bitmask':
+    # pack the binary channels into the bits of a single byte
+    mask = np.packbits(pred > tol, axis=-1, bitorder='little')
+    mask = mask[..., 0]
+
+  elif output == 'proba':
+    # resize the probabilities one channel at a time
+    # to limit the float32 temporary memory
+    mask = np.empty(shape=(*shape, pred.shape[-1]), dtype=np.float16)
+    for c in range(pred.shape[-1]):
+      mask[..., c] = cv2.resize(
+        np.ascontiguousarray(pred[..., c], dtype=np.float32),
+        dsize=(shape[1], shape[0]),
+        interpolation=cv2.INTER_LINEAR
+      )
+    return mask
+
+  else:
+    raise ValueError((
+      f'Invalid output format. Available options are {OUTPUT_FORMATS}. '
+      f'Given: {output}'
+    ))
+
+  # resize the output mask to the same
+  # shape of the original image, with an
+  # appropriated interpolation algorithm
+  mask = _resize_nearest(mask, shape=shape)
+
+  return mask
+
+def _augment (batch : np.ndarray, tta : str) -> np.ndarray :
+  '''
+  Stack the test-time augmented copies of a batch of
+  (squared) images into a single batch.
+
+  Parameters
+  ----------
+    batch : np.ndarray
+      Input tensor with shape (n, h, w, c)
+
+    tta : str
+      Test-time augmentation strategy (ref. `TTA_MODES`)
+
+  Returns
+  -------
+    augmented : np.ndarray
+      Tensor with shape (n * t, h, w, c), where t is the
+      number of transforms, in which the i-th block of n
+      images stores the i-th transform of the batch
+  '''
+  transforms = _TTA_TRANSFORMS[tta]
+  n = batch.shape[0]
+
+  augmented = np.empty(
+    shape=(len(transforms) * n, *batch.shape[1:]),
+    dtype=batch.dtype
+  )
+  # each transform is applied on the whole batch at once
+  for i, (k, flip) in enumerate(transforms):
+    src = batch[:, :, ::-1] if flip else batch
+    augmented[i * n : (i + 1) * n] = np.rot90(src, k=k, axes=(1, 2))
+
+  return augmented
+
+def _deaugment (pred : np.ndarray, tta : str) -> np.ndarray :
+  '''
+  Invert the test-time augmentation transforms of the
+  model predictions and average them.
+
+  Parameters
+  ----------
+    pred : np.ndarray
+      Model output with shape (n * t, h, w, 4) obtained
+      by the batch given by `_augment`
+
+    tta : str
+      Test-time augmentation strategy (ref. `TTA_MODES`)
+
+  Returns
+  -------
+    mean : np.ndarray
+      Averaged softmax probabilities with shape (n, h, w, 4)
+  '''
+  transforms = _TTA_TRANSFORMS[tta]
+  n = pred.shape[0] // len(transforms)
+
+  mean = np.zeros(shape=(n, *pred.shape[1:]), dtype=np.float32)
+  # each inverse transform is applied on the whole block at once
+  for i, (k, flip) in enumerate(transforms):
+    p = np.rot90(pred[i * n : (i + 1) * n], k=-k, axes=(1, 2))
+    mean += p[:, :, ::-1] if flip else p
+  mean *= np.float32(1. / len(transforms))
+
+  return mean
+
+def _tile_origins (length : int, size : int, stride : int) -> list :
+  '''
+  Get the starting coordinates of the tiles along an axis,
+  ensuring that the last tile ends on the image border.
+
+  Parameters
+  ----------
+    length : int
+      Dimension of the image along the axis
+
+    size : int
+      Dimension of the tile
+
+    stride : int
+      Distance between two consecutive tiles
+
+  Returns
+  -------
+    origins : list
+      Sorted list of tile starting coordinates
+  '''
+  if length <= size:
+    return [0]
+  origins = list(range(0, length - size, stride))
+  origins.append(length - size)
+  return origins
+
+def _blending_window (size : int) -> np.ndarray :
+  '''
+  Get the 2D weights used to blend the overlapping tiles;
+  the weights are maximum at the tile center and decay
+  towards the tile borders, where the model predictions
+  are less reliable.
+
+  Parameters
+  ----------
+    size : int
+      Dimension of the (squared) tile
+
+  Returns
+  -------
+    window : np.ndarray
+      Strictly positive weights with shape (size, size)
+  '''
+  # remove the zero-valued extremes of the hanning window
+  w = np.hanning(size + 2)[1:-1]
+  return np.float32(np.outer(w, w))
+
+
+class DeepskinSegmenter (object):
+  '''
+  Persistent Deepskin semantic segmentation engine.
+
+  The model is built and its weights are loaded only
+  once (at the first usage or with an explicit call to
+  the `load` method), and they are kept in memory for
+  all the following predictions.
+
+  Parameters
+  ----------
+    weights : str (default := None)
+      Path of the model weights; if None the default
+      Deepskin checkpoint is used (and downloaded if
+      it is not available).
+      For the 'tflite' and 'onnx' backends (and for the
+      'float16' and 'int8' precisions) it is the path of
+      the file obtained by `export_model`
+
+    backend : str (default := 'keras')
+      Inference backend to use; available options are
+      'keras', 'tflite' and 'onnx' (ref. `deepskin.backends`)
+
+    num_threads : int (default := None)
+      Number of threads used by the 'tflite' and 'onnx'
+      runtimes; if None all the available cores are used
+
+    precision : str (default := 'float32')
+      Numerical precision of the model; available options
+      are 'float32', 'float16', 'int8' and 'bfloat16'. The
+      'float16' and 'int8' precisions are run by the 'tflite'
+      backend, while the 'bfloat16' mixed precision is run by
+      the 'keras' backend
+
+    jit_compile : bool (default := False)
+      Enable/Disable the XLA compilation of the 'keras' backend
+
+    warmup : bool (default := False)
+      If True, the model is loaded and run once on a dummy
+      input at construction time, so that the first real
+      prediction does not pay the graph tracing cost
+
+    cache : SegmentationCache (default := None)
+      On-disk cache of the segmentation results; if given,
+      the results of the images already processed with the
+      same model and parameters are loaded from the cache
+      instead of being re-computed (ref. `deepskin.cache`)
+
+  Examples
+  --------
+  >>> segmenter = DeepskinSegmenter().load()
+  >>> mask = segmenter.segment(img=rgb, tol=0.5)
+  >>> segmenter.release()
+  '''
+
+  def __init__ (self, weights : str = None,
+                backend : str = 'keras',
+                num_threads : int = None,
+                precision : str = 'float32',
+                jit_compile : bool = False,
+                warmup : bool = False,
+                cache = None
+               ):
+
+    self.weights = weights
+    self.precision = precision
+    self.cache = cache
+    # inference backend (not loaded yet)
+    self._backend = get_backend(
+      backend=backend,
+      model_path=weights,
+      num_threads=num_threads,
+      precision=precision,
+      jit_compile=jit_compile,
+    )
+    self._loaded = False
+    # identity of the model used by the result cache
+    self._identity = None
+    # guard the model build in multi-threading usage
+    self._lock = threading.Lock()
+
+    if warmup:
+      self.warmup()
+
+  @property
+  def is_loaded (self) -> bool :
+    '''
+    Check if the model is currently loaded in memory
+    '''
+    return self._loaded
+
+  @property
+  def model_identity (self) -> str :
+    '''
+    Get the identity of the model, given by the backend,
+    the precision and the digest of the model file
+    '''
+    if self._identity is None:
+      backend = self._backend
+      path = getattr(backend, 'weights', None) or getattr(backend, 'model_path', None)
+
+      if path is None:
+        if backend.name == 'keras':
+          path = get_model_weights()
+        else:
+          # the default exported model is set at loading
+          self.load()
+          path = backend.model_path
+
+      self._identity = f'{backend.name}/{self.precision}/{model_digest(path)}'
+
+    return self._identity
+
+  @property
+  def backend (self):
+    '''
+    Get the underlying inference backend, loading it if necessary
+    '''
+    self.load()
+    return self._backend
+
+  def load (self, verbose : bool = False) -> 'DeepskinSegmenter' :
+    '''
+    Build the Deepskin model and load its weights.
+    If the model is already loaded, nothing is done.
+
+    Parameters
+    ----------
+      verbose : bool (default := False)
+        Enable/Disable the logging of the steps
+
+    Returns
+    -------
+      self
+    '''
+    with self._lock:
+      # nothing to do if the model is already in memory
+      if self._loaded:
+        return self
+
+      if verbose:
+        print(f'Load the deepskin model ({self._backend.name} backend)... ',
+          end='',
+          flush=True,
+        )
+
+      # build the model and load the weights
+      self._backend.load()
+      self._loaded = True
+
+      if verbose:
+        print(f'{GREEN_COLOR_CODE}[DONE]{RESET_COLOR_CODE}',
+          end='\n',
+          flush=True,
+        )
+
+    return self
+
+  def release (self) -> 'DeepskinSegmenter' :
+    '''
+    Free the memory used by the model.
+    The model will be re-built at the next usage.
+
+    Returns
+    -------
+      self
+    '''
+    with self._lock:
+      self._backend.release()
+      self._loaded = False
+      self._identity = None
+    # force the release of the model memory
+    gc.collect()
+    return self
+
+  def reload (self, verbose : bool = False) -> 'DeepskinSegmenter' :
+    '''
+    Release the current model and load it again,
+    e.g. after an update of the weights file.
+
+    Parameters
+    ----------
+      verbose : bool (default := False)
+        Enable/Disable the logging of the steps
+
+    Returns
+    -------
+      self
+    '''
+    return self.release().load(verbose=verbose)
+
+  def warmup (self, batch_size : int = 1) -> 'DeepskinSegmenter' :
+    '''
+    Load the model and run it on a dummy input, so that
+    the graph tracing/compilation is performed in advance.
+
+    Parameters
+    ----------
+      batch_size : int (default := 1)
+        Batch size of the dummy input
+
+    Returns
+    -------
+      self
+    '''
+    dummy = np.zeros(
+      shape=(batch_size, IMG_SIZE, IMG_SIZE, 3),
+      dtype=np.float32
+    )
+    self.backend.predict(dummy)
+    return self
+
+  def predict (self, batch : np.ndarray, tta : str = None) -> np.ndarray :
+    '''
+    Apply the model on a batch of pre-processed images,
+    optionally with test-time augmentation.
+
+    Parameters
+    ----------
+      batch : np.ndarray
+        Input tensor in float32 fmt with shape (n, IMG_SIZE, IMG_SIZE, 3)
+
+      tta : str (default := None)
+        Test-time augmentation strategy; with 'flip' the image
+        flips are used (4 transforms), while with 'dihedral'
+        all the flips and 90 degree rotations are used (8
+        transforms). All the transforms are stacked into a
+        single batch and processed by one forward pass, then
+        they are inverted and the softmax outputs are averaged.
+        If None, the augmentation is disabled
+
+    Returns
+    -------
+      pred : np.ndarray
+        Softmax probabilities with shape (n, IMG_SIZE, IMG_SIZE, 4)
+    '''
+    if tta is None:
+      return self.backend.predict(batch)
+
+    if tta not in TTA_MODES:
+      raise ValueError((
+        f'Invalid test-time augmentation. Available options are {TTA_MODES}. '
+        f'Given: {tta}'
+      ))
+
+    pred = self.backend.predict(_augment(batch, tta=tta))
+    return _deaugment(pred, tta=tta)
+
+  def segment (self, img : np.ndarray,
+               tol : float = 0.5,
+               mode : str = 'resize',
+               stride : int = 192,
+               batch_size : int = 8,
+               margin : float = 0.2,
+               output : str = 'mask',
+               tta : str = None,
+               cache = None,
+               verbose : bool = False
+              ) -> np.ndarray :
+    '''
+    Perform the semantic image segmentation using the
+    Deepskin semantic model.
+
+    Parameters
+    ----------
+      img : np.ndarray
+        Input image to analyze in RGB format
+
+      tol : float (default := 0.5)
+        Threshold to apply on the resulting mask for the
+        output binarization
+
+      mode : str (default := 'resize')
+        Segmentation strategy; with 'resize' the whole image
+        is resized to the model input shape, with 'tiled'
+        the model is applied on overlapping windows of the
+        full-resolution image (ref. `predict_tiled`), while
+        with 'roi' the wound identified by the 'resize' step
+        is refined by a second full-resolution pass on its
+        bounding box (ref. `refine_wound`)
+
+      stride : int (default := 192)
+        Distance between consecutive windows in the 'tiled'
+        and 'roi' modes
+
+      batch_size : int (default := 8)
+        Number of windows processed by each forward pass in
+        the 'tiled' and 'roi' modes
+
+      margin : float (default := 0.2)
+        Margin added around the wound bounding box in the
+        'roi' mode, as fraction of the box dimensions
+
+      output : str (default := 'mask')
+        Output representation; available options are 'mask',
+        'labels', 'bitmask' and 'proba' (ref. `_postprocess`).
+        The 'roi' mode supports only the 'mask' and 'bitmask'
+        representations
+
+      tta : str (default := None)
+        Test-time augmentation strategy; available options are
+        'flip' and 'dihedral' (ref. `predict`). The averaged
+        probabilities are binarized with tol. If None, the
+        augmentation is disabled
+
+      cache : SegmentationCache (default := None)
+        Result cache used by this call; if None the cache
+        of the segmenter (if any) is used
+
+      verbose : bool (default := False)
+        Enable/Disable the logging of the steps
+
+    Returns
+    -------
+      pred : np.ndarray
+        Output image mask obtained by the model, in which
+        the semantic meaning is organized as: background
+        (channel 0), body (channel 1), marker (channel 2),
+        wound (channel 3)
+    '''
+    if mode not in SEGMENTATION_MODES:
+      raise ValueError((
+        f'Invalid segmentation mode. Available options are {SEGMENTATION_MODES}. '
+        f'Given: {mode}'
+      ))
+
+    if output not in OUTPUT_FORMATS:
+      raise ValueError((
+        f'Invalid output format. Available options are {OUTPUT_FORMATS}. '
+        f'Given: {output}'
+      ))
+
+    if mode == 'roi' and output not in ('mask', 'bitmask'):
+      raise ValueError((
+        'The roi mode supports only the mask and bitmask outputs. '
+        f'Given: {output}'
+      ))
+
+    tic = now()
+    step = 'Perform the semantic image segmentation... '
+
+    if cache is None:
+      cache = self.cache
+
+    if cache is not None:
+      # parameters which affect the result
+      params = {'mode' : mode, 'output' : output, 'tta' : tta}
+      if mode != 'resize':
+        params.update(stride=stride, margin=margin)
+
+      # look for an already computed result
+      key = cache.key(img, model=self.model_identity, tol=tol, **params)
+      pred = cache.get(key)
+
+      if pred is not None:
+        if verbose:
+          print(f'{step} {GREEN_COLOR_CODE}[DONE]{RESET_COLOR_CODE} (cached)',
+            end='\n',
+            flush=True,
+          )
+        return pred
+
+    if verbose:
+      print(f'{step}',
+        end='\r',
+        flush=True,
+      )
+
+    if mode == 'tiled':
+
+      if verbose:
+        print(f'{CRLF}{step} {GREEN_COLOR_CODE}[1/2] apply the segmentation model on the image tiles{RESET_COLOR_CODE}',
+          end='',
+          flush=True,
+        )
+      # get the full-resolution probability map
+      pred = self.predict_tiled(
+        img=img,
+        stride=stride,
+        batch_size=batch_size,
+        tta=tta,
+      )
+
+      if verbose:
+        print(f'{CRLF}{step} {GREEN_COLOR_CODE}[2/2] post-process the segmentation mask{RESET_COLOR_CODE}',
+          end='',
+          flush=True,
+        )
+      # convert the probabilities to the output fmt
+      pred = _postprocess(
+        pred=pred,
+        shape=img.shape[:2],
+        tol=tol,
+        output=output,
+      )
+
+    else:
+
+      # number of processing steps
+      nsteps = 4 if mode == 'roi' else 3
+
+      # pre-process the input
+
+      if verbose:
+        print(f'{CRLF}{step} {GREEN_COLOR_CODE}[1/{nsteps}] pre-process the input image{RESET_COLOR_CODE}',
+          end='',
+          flush=True,
+        )
+      # allocate the input tensor in the [batch, h, w, c] format
+      resized = np.empty(
+        shape=(1, IMG_SIZE, IMG_SIZE, 3),
+        dtype=np.float32
+      )
+      # resize and normalize the image
+      _preprocess(img, out=resized[0])
+
+      # apply the segmentation model
+
+      if verbose:
+        print(f'{CRLF}{step} {GREEN_COLOR_CODE}[2/{nsteps}] apply the segmentation model{RESET_COLOR_CODE}',
+          end='',
+          flush=True,
+        )
+      # apply the model to get the prediction
+      # (building it only at the first call)
+      pred = self.predict(resized, tta=tta)
+
+      # post-process the mask
+
+      if verbose:
+        print(f'{CRLF}{step} {GREEN_COLOR_CODE}[3/{nsteps}] post-process the segmentation mask{RESET_COLOR_CODE}',
+          end='',
+          flush=True,
+        )
+      # binarize the mask and restore the original shape
+      pred = _postprocess(
+        pred=pred[0],
+        shape=img.shape[:2],
+        tol=tol,
+        output=output,
+      )
+
+      if mode == 'roi':
+
+        if verbose:
+          print(f'{CRLF}{step} {GREEN_COLOR_CODE}[4/4] refine the wound segmentation{RESET_COLOR_CODE}',
+            end='',
+            flush=True,
+          )
+        # re-segment the wound area at full resolution
+        pred = self.refine_wound(
+          img=img,
+          mask=pred,
+          tol=tol,
+          margin=margin,
+          stride=stride,
+          batch_size=batch_size,
+          tta=tta,
+        )
+
+    if cache is not None:
+      cache.put(key, pred)
+
+    toc = now()
+    if verbose:
+      print(f'{CRLF}{step} {GREEN_COLOR_CODE}[DONE]{RESET_COLOR_CODE} ({toc - tic:.3f} sec)                  ',
+        end='\n',
+        flush=True,
+      )
+
+    return pred
+
+  def predict_tiled (self, img : np.ndarray,
+                     stride : int = 192,
+                     batch_size : int = 8,
+                     tta : str = None
+                    ) -> np.ndarray :
+    '''
+    Apply the model on overlapping windows of the
+    full-resolution image and blend the softmax outputs
+    into a probability map with the same shape of the image.
+
+    Parameters
+    ----------
+      img : np.ndarray
+        Input image to analyze in RGB format
+
+      stride : int (default := 192)
+        Distance between consecutive windows; it must be in
+        the range (0, IMG_SIZE], and lower values lead to a
+        larger overlap (and to a higher computational cost)
+
+      batch_size : int (default := 8)
+        Number of windows processed by each forward pass;
+        only these windows are kept in memory, so this value
+        bounds the memory required by the input tensors
+
+      tta : str (default := None)
+        Test-time augmentation strategy applied on each window
+        (ref. `predict`); the forward passes process batch_size
+        windows times the number of transforms
+
+    Returns
+    -------
+      prob : np.ndarray
+        Probability map in float32 fmt with shape (H, W, 4)
+
+    Notes
+    -----
+    The windows are extracted at native resolution without
+    any resize; images smaller than the model input shape
+    are zero-padded.
+    The blended map requires 20 bytes per pixel (about 240 MB
+    for a 12 MP image).
+    '''
+    if not 0 < stride <= IMG_SIZE:
+      raise ValueError(f'stride must be in (0, {IMG_SIZE}]. Given: {stride}')
+
+    if batch_size < 1:
+      raise ValueError(f'batch_size must be positive. Given: {batch_size}')
+
+    # build the model only at the first call
+    self.load()
+
+    h, w = img.shape[:2]
+    # pad the image if it is smaller than the model input
+    pad_h = max(IMG_SIZE - h, 0)
+    pad_w = max(IMG_SIZE - w, 0)
+    if pad_h or pad_w:
+      img = cv2.copyMakeBorder(
+        img,
+        top=0, bottom=pad_h,
+        left=0, right=pad_w,
+        borderType=cv2.BORDER_CONSTANT,
+        value=0,
+      )
+    H, W = img.shape[:2]
+
+    # get the coordinates of all the windows
+    origins = [
+      (y, x)
+      for y in _tile_origins(H, IMG_SIZE, stride)
+      for x in _tile_origins(W, IMG_SIZE, stride)
+    ]
+
+    # blending weights of each window
+    window = _blending_window(IMG_SIZE)
+
+    # accumulators of the weighted probabilities
+    prob = np.zeros(shape=(H, W, 4), dtype=np.float32)
+    weight = np.zeros(shape=(H, W), dtype=np.float32)
+
+    # pre-allocate the input tensor, re-used by all the batches
+    batch = np.empty(
+      shape=(min(batch_size, len(origins)), IMG_SIZE, IMG_SIZE, 3),
+      dtype=np.float32
+    )
+
+    for start in range(0, len(origins), batch_size):
+      chunk = origins[start : start + batch_size]
+
+      # normalize the windows into the batch buffer
+      for i, (y, x) in enumerate(chunk):
+        np.multiply(
+          img[y : y + IMG_SIZE, x : x + IMG_SIZE],
+          np.float32(1. / 255),
+          out=batch[i]
+        )
+
+      # apply the model to get the predictions
+      pred = self.predict(batch[:len(chunk)], tta=tta)
+
+      # accumulate the weighted predictions
+      for p, (y, x) in zip(pred, chunk):
+        p *= window[..., np.newaxis]
+        prob[y : y + IMG_SIZE, x : x + IMG_SIZE] += p
+        weight[y : y + IMG_SIZE, x : x + IMG_SIZE] += window
+
+    # normalize the blended probabilities
+    prob /= weight[..., np.newaxis]
+
+    # remove the padding
+    return prob[:h, :w]
+
+  def refine_wound (self, img : np.ndarray,
+                    mask : np.ndarray,
+                    tol : float = 0.5,
+                    margin : float = 0.2,
+                    stride : int = 192,
+                    batch_size : int = 8,
+                    tta : str = None
+                   ) -> np.ndarray :
+    '''
+    Refine the wound segmentation of a coarse mask,
+    applying the model at native resolution only on the
+    bounding box of the wound (plus a margin), and pasting
+    the refined wound channel back into the mask.
+
+    Parameters
+    ----------
+      img : np.ndarray
+        Input image to analyze in RGB format
+
+      mask : np.ndarray
+        Coarse semantic mask of the image in 'mask' or
+        'bitmask' fmt (ref. `segment`); it is updated in-place
+
+      tol : float (default := 0.5)
+        Threshold to apply on the refined probabilities for
+        the output binarization
+
+      margin : float (default := 0.2)
+        Margin added around the wound bounding box, as
+        fraction of the box dimensions
+
+      stride : int (default := 192)
+        Distance between consecutive windows (ref. `predict_tiled`)
+
+      batch_size : int (default := 8)
+        Number of windows processed by each forward pass
+
+      tta : str (default := None)
+        Test-time augmentation strategy (ref. `predict`)
+
+    Returns
+    -------
+      mask : np.ndarray
+        Semantic mask with the refined wound channel
+    '''
+    if margin < 0:
+      raise ValueError(f'margin must be non-negative. Given: {margin}')
+
+    # bit associated to the wound in the 'bitmask' fmt
+    bit = np.uint8(1 << WOUND_CHANNEL)
+
+    # get the bounding box of the coarse wound mask
+    if mask.ndim == 3:
+      wound = np.ascontiguousarray(mask[..., WOUND_CHANNEL])
+    else:
+      wound = np.bitwise_and(mask, bit)
+    x, y, w, h = cv2.boundingRect(wound)
+
+    # nothing to refine if the wound is not found
+    if w == 0 or h == 0:
+      return mask
+
+    # extend the bounding box with the margin
+    dx = int(round(w * margin))
+    dy = int(round(h * margin))
+    x0 = max(x - dx, 0)
+    y0 = max(y - dy, 0)
+    x1 = min(x + w + dx, img.shape[1])
+    y1 = min(y + h + dy, img.shape[0])
+
+    # apply the model on the wound area at native resolution
+    prob = self.predict_tiled(
+      img=img[y0:y1, x0:x1],
+      stride=stride,
+      batch_size=batch_size,
+      tta=tta,
+    )
+
+    # paste the refined wound mask into the coarse one
+    if mask.ndim == 3:
+      mask[y0:y1, x0:x1, WOUND_CHANNEL] = _binarize(
+        prob[..., WOUND_CHANNEL],
+        tol=tol
+      )
+    else:
+      roi = mask[y0:y1, x0:x1]
+      # reset the wound bit
+      roi &= ~bit
+      # set the refined one
+      roi |= np.multiply(prob[..., WOUND_CHANNEL] > tol, bit, dtype=np.uint8)
+
+    return mask
+
+  def segment_batch (self, images : list,
+                     tol : float = 0.5,
+                     batch_size : int = 8,
+                     output : str = 'mask',
+                     tta : str = None,
+                     cache = None,
+                     verbose : bool = False
+                    ) -> list :
+    '''
+    Perform the semantic image segmentation of a series
+    of images, grouping them in batches for the model
+    inference.
+
+    Parameters
+    ----------
+      images : list
+        List of input images in RGB format; the images
+        could have different shapes
+
+      tol : float (default := 0.5)
+        Threshold to apply on the resulting masks for the
+        output binarization
+
+      batch_size : int (default := 8)
+        Number of images processed by each forward pass
+
+      output : str (default := 'mask')
+        Output representation; available options are 'mask',
+        'labels', 'bitmask' and 'proba' (ref. `_postprocess`)
+
+      tta : str (default := None)
+        Test-time augmentation strategy (ref. `predict`); the
+        forward passes process batch_size images times the
+        number of transforms
+
+      cache : SegmentationCache (default := None)
+        Result cache used by this call; if None the cache
+        of the segmenter (if any) is used. Only the images
+        not found in the cache are processed by the model
+
+      verbose : bool (default := False)
+        Enable/Disable the logging of the steps
+
+    Returns
+    -------
+      preds : list
+        List of output masks, each one with the same
+        shape of the corresponding input image
+    '''
+    tic = now()
+    step = 'Perform the semantic image segmentation... '
+
+    if batch_size < 1:
+      raise ValueError(f'batch_size must be positive. Given: {batch_size}')
+
+    if output not in OUTPUT_FORMATS:
+      raise ValueError((
+        f'Invalid output format. Available options are {OUTPUT_FORMATS}. '
+        f'Given: {output}'
+      ))
+
+    images = list(images)
+
+    if cache is None:
+      cache = self.cache
+
+    results = [None] * len(images)
+
+    if cache is not None:
+      # look for the already computed results
+      keys = [
+        cache.key(img, model=self.model_identity, tol=tol, mode='resize', output=output, tta=tta)
+        for img in images
+      ]
+      results = [cache.get(key) for key in keys]
+
+    # indexes of the images to process
+    missing = [i for i, res in enumerate(results) if res is None]
+    num_images = len(missing)
+
+    if not num_images:
+      return results
+
+    # build the model only at the first call
+    self.load()
+
+    # pre-allocate the input tensor, re-used by all the batches
+    batch = np.empty(
+      shape=(min(batch_size, num_images), IMG_SIZE, IMG_SIZE, 3),
+      dtype=np.float32
+    )
+
+    for start in range(0, num_images, batch_size):
+      indexes = missing[start : start + batch_size]
+      chunk = [images[i] for i in indexes]
+
+      if verbose:
+        print(f'{CRLF}{step} {GREEN_COLOR_CODE}[{start + len(chunk)}/{num_images}] process the batch of images{RESET_COLOR_CODE}',
+          end='',
+          flush=True,
+        )
+
+      # resize and normalize the images into the batch buffer
+      for i, img in enumerate(chunk):
+        _preprocess(img, out=batch[i])
+
+      # apply the model to get the predictions
+      pred = self.predict(batch[:len(chunk)], tta=tta)
+
+      # binarize the masks and restore the original shapes
+      for i, p, img in zip(indexes, pred, chunk):
+        results[i] = _postprocess(pred=p, shape=img.shape[:2], tol=tol, output=output)
+
+        if cache is not None:
+          cache.put(keys[i], results[i])
+
+    toc = now()
+    if verbose:
+      print(f'{CRLF}{step} {GREEN_COLOR_CODE}[DONE]{RESET_COLOR_CODE} ({toc - tic:.3f} sec)                  ',
+        end='\n',
+        flush=True,
+      )
+
+    return results
+
+
+# module-level segmenters shared by the functional API
+# (one for each model precision)
+_default_segmenters = {}
+_default_segmenter_lock = threading.Lock()
+
+def get_default_segmenter (precision : str = 'float32') -> DeepskinSegmenter :
+  '''
+  Get the module-level cached segmenter used by
+  `wound_segmentation`.
+  The instance is created at the first call and the
+  model is loaded lazily at its first usage.
+
+  Parameters
+  ----------
+    precision : str (default := 'float32')
+      Numerical precision of the model
+      (ref. `DeepskinSegmenter`)
+
+  Returns
+  -------
+    segmenter : DeepskinSegmenter
+      Shared segmentation engine
+  '''
+  with _default_segmenter_lock:
+    if precision not in _default_segmenters:
+      _default_segmenters[precision] = DeepskinSegmenter(
+        precision=precision
+      )
+
+    return _default_segmenters[precision]
+
+def release_default_segmenter () -> None :
+  '''
+  Free the memory used by the module-level cached
+  segmenters (if any).
+  '''
+  with _default_segmenter_lock:
+    segmenters = list(_default_segmenters.values())
+    _default_segmenters.clear()
+
+  for segmenter in segmenters:
+    segmenter.release()
+
 def wound_segmentation (img : np.ndarray,
                         tol : float = 0.5,
+                        precision : str = 'float32',
+                        mode : str = 'resize',
+                        stride : int = 192,
+                        margin : float = 0.2,
+                        output : str = 'mask',
+                        tta : str = None,
+                        cache = None,
                         verbose : bool = False
                        ) -> np.ndarray :
   '''
@@ -44,6 +1175,37 @@ def wound_segmentation (img : np.ndarray,
       Threshold to apply on the resulting mask for the
       output binarization
 
+    precision : str (default := 'float32')
+      Numerical precision of the model; available options
+      are 'float32', 'float16', 'int8' and 'bfloat16'
+      (ref. `DeepskinSegmenter`)
+
+    mode : str (default := 'resize')
+      Segmentation strategy; available options are 'resize',
+      'tiled' and 'roi' (ref. `DeepskinSegmenter.segment`)
+
+    stride : int (default := 192)
+      Distance between consecutive windows in the 'tiled'
+      and 'roi' modes
+
+    margin : float (default := 0.2)
+      Margin added around the wound bounding box in the
+      'roi' mode, as fraction of the box dimensions
+
+    output : str (default := 'mask')
+      Output representation; available options are 'mask',
+      'labels', 'bitmask' and 'proba'
+      (ref. `DeepskinSegmenter.segment`)
+
+    tta : str (default := None)
+      Test-time augmentation strategy; available options are
+      'flip' and 'dihedral' (ref. `DeepskinSegmenter.predict`)
+
+    cache : SegmentationCache (default := None)
+      On-disk cache of the segmentation results; if given,
+      the model is applied only if the result of the image
+      is not available (ref. `deepskin.cache`)
+
     verbose : bool (default := False)
       Enable/Disable the logging of the steps
 
@@ -52,103 +1214,93 @@ def wound_segmentation (img : np.ndarray,
     pred : np.ndarray
       Output image mask obtained by the model, in which
       the semantic meaning is organized as: background
-      (channel 0), body (channel 1), wound (channel 2)
+      (channel 0), body (channel 1), marker (channel 2),
+      wound (channel 3)
+
+  Notes
+  -----
+  The model is built and loaded only at the first call
+  and then cached; use `release_default_segmenter` to
+  free its memory.
   '''
+  # get the shared segmentation engine
+  segmenter = get_default_segmenter(precision=precision)
 
-  tic = now()
-  step = 'Perform the semantic image segmentation... '
+  return segmenter.segment(
+    img=img,
+    tol=tol,
+    mode=mode,
+    stride=stride,
+    margin=margin,
+    output=output,
+    tta=tta,
+    cache=cache,
+    verbose=verbose,
+  )
 
-  if verbose:
-    print(f'{step}',
-      end='\r',
-      flush=True,
-    )
+def wound_segmentation_batch (images : list,
+                              tol : float = 0.5,
+                              batch_size : int = 8,
+                              precision : str = 'float32',
+                              output : str = 'mask',
+                              tta : str = None,
+                              cache = None,
+                              verbose : bool = False
+                             ) -> list :
+  '''
+  Perform the semantic image segmentation of a series
+  of images using the Deepskin semantic model, grouping
+  them in batches for a faster inference.
 
-  # build the model for the semantic segmentation
-  model = deepskin_model(
-    verbose=False
-  )
+  Parameters
+  ----------
+    images : list
+      List of input images in RGB format; the images
+      could have different shapes
 
-  # load the appropriated weights
-  local = os.path.dirname(os.path.abspath(__file__))
-  # build the weights filepath
-  weightspath = os.path.join(
-    local,
-    '..',
-    'checkpoints',
-    'efficientnetb3_deepskin_semantic_gray.h5'
-  )
-  # if the weights file does not exists
-  if not os.path.exists(weightspath):
-    download_model_weights(
-      Id=MODEL_CHECKPOINT,
-      model_name='efficientnetb3_deepskin_semantic_gray'
-    )
+    tol : float (default := 0.5)
+      Threshold to apply on the resulting masks for the
+      output binarization
 
-  # load the weights
-  model.load_weights(weightspath)
+    batch_size : int (default := 8)
+      Number of images processed by each forward pass
 
-  # get the model input shape
-  _, h, w, c = model.input.shape
+    precision : str (default := 'float32')
+      Numerical precision of the model; available options
+      are 'float32', 'float16', 'int8' and 'bfloat16'
+      (ref. `DeepskinSegmenter`)
 
-  # pre-process the input
+    output : str (default := 'mask')
+      Output representation; available options are 'mask',
+      'labels', 'bitmask' and 'proba'
+      (ref. `DeepskinSegmenter.segment`)
 
-  # resize the image into the shape required by the model
-  if verbose:
-    print(f'{CRLF}{step} {GREEN_COLOR_CODE}[1/3] pre-process the input image{RESET_COLOR_CODE}',
-      end='',
-      flush=True,
-    )
-  resized = cv2.resize(
-    img,
-    dsize=(h, w),
-    interpolation=cv2.INTER_CUBIC
-  )
-  # convert the image into floating-point values
-  resized = np.float32(resized)
-  # normalize the image into [0, 1] range
-  resized *= 1. / 255
-  # extend the dimensionality of the input array
-  # to the [batch, h, w, c] format
-  resized = resized.reshape(1, *resized.shape)
-
-  # apply the segmentation model
-
-  if verbose:
-    print(f'{CRLF}{step} {GREEN_COLOR_CODE}[2/3] apply the segmentation model{RESET_COLOR_CODE}',
-      end='',
-      flush=True,
-    )
-  # apply the model to get the prediction
-  pred = model.predict(resized, verbose=0)
-  # remove useless dimensions from the image
-  pred = np.squeeze(pred)
-  # filter the mask output to binary format
-  pred = np.where(pred > tol, 255, 0)
-  # convert the mask into uint8 fmt
-  pred = np.uint8(pred)
+    tta : str (default := None)
+      Test-time augmentation strategy; available options are
+      'flip' and 'dihedral' (ref. `DeepskinSegmenter.predict`)
 
-  # post-process the mask
+    cache : SegmentationCache (default := None)
+      On-disk cache of the segmentation results
+      (ref. `wound_segmentation`)
 
-  if verbose:
-    print(f'{CRLF}{step} {GREEN_COLOR_CODE}[3/3] post-process the segmentation mask{RESET_COLOR_CODE}',
-      end='',
-      flush=True,
-    )
-  # resize the output mask to the same
-  # shape of the original image, with an
-  # appropriated interpolation algorithm
-  pred = cv2.resize(
-    pred,
-    dsize=(img.shape[1], img.shape[0]),
-    interpolation=cv2.INTER_NEAREST_EXACT
-  )
+    verbose : bool (default := False)
+      Enable/Disable the logging of the steps
 
-  toc = now()
-  if verbose:
-    print(f'{CRLF}{step} {GREEN_COLOR_CODE}[DONE]{RESET_COLOR_CODE} ({toc - tic:.3f} sec)                  ',
-      end='\n',
-      flush=True,
-    )
+  Returns
+  -------
+    preds : list
+      List of output masks, each one with the same shape
+      of the corresponding input image (ref. `wound_segmentation`)
+  '''
+  # get the shared segmentation engine
+  segmenter = get_default_segmenter(precision=precision)
 
-  return pred
+  return segmenter.segment_batch(
+    images=images,
+    tol=tol,
+    batch_size=batch_size,
+    output=output,
+    tta=tta,
+    cache=cache,
+    verbose=verbose,
+  )
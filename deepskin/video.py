@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+
+# segmentation engine
+from .segmentation import get_default_segmenter
+# PWAT evaluator
+from .pwat import evaluate_PWAT_score
+
+__author__  = ['Nico Curti']
+__email__ = ['nico.curti2@unibo.it']
+
+__all__ = [
+  'video_segmentation',
+]
+
+# dimension of the thumbnails used to compare the frames
+_THUMBNAIL_SIZE = 64
+# maximum width of the frames used for the optical flow
+_FLOW_WIDTH = 320
+
+
+def _iter_frames (source):
+  '''
+  Iterate over the RGB frames of a video source, given by
+  a cv2.VideoCapture (BGR frames) or by an iterable of RGB
+  frames.
+  '''
+  if isinstance(source, cv2.VideoCapture):
+    while True:
+      ok, bgr = source.read()
+      if not ok:
+        break
+      # convert the frame from BGR to RGB fmt
+      yield bgr[..., ::-1]
+  else:
+    yield from source
+
+def _thumbnail (frame : np.ndarray) -> np.ndarray :
+  '''
+  Get the downscaled gray-scale version of a frame in
+  float32 fmt with values in [0, 1]
+  '''
+  gray = cv2.cvtColor(np.ascontiguousarray(frame), cv2.COLOR_RGB2GRAY)
+  thumb = cv2.resize(
+    gray,
+    dsize=(_THUMBNAIL_SIZE, _THUMBNAIL_SIZE),
+    interpolation=cv2.INTER_AREA
+  )
+  return np.multiply(thumb, np.float32(1. / 255), dtype=np.float32)
+
+def _flow_gray (frame : np.ndarray) -> np.ndarray :
+  '''
+  Get the gray-scale version of a frame used by the
+  optical flow, downscaled to at most _FLOW_WIDTH columns
+  '''
+  gray = cv2.cvtColor(np.ascontiguousarray(frame), cv2.COLOR_RGB2GRAY)
+  h, w = gray.shape
+  if w > _FLOW_WIDTH:
+    gray = cv2.resize(
+      gray,
+      dsize=(_FLOW_WIDTH, int(round(h * _FLOW_WIDTH / w))),
+      interpolation=cv2.INTER_AREA
+    )
+  return gray
+
+def _warp_mask (mask : np.ndarray, key_gray : np.ndarray, gray : np.ndarray) -> np.ndarray :
+  '''
+  Warp the mask of a key frame onto the current frame,
+  according to the dense (Farneback) optical flow
+  between the two frames.
+
+  Parameters
+  ----------
+    mask : np.ndarray
+      Semantic mask of the key frame
+
+    key_gray : np.ndarray
+      Downscaled gray-scale key frame (ref. `_flow_gray`)
+
+    gray : np.ndarray
+      Downscaled gray-scale current frame (ref. `_flow_gray`)
+
+  Returns
+  -------
+    warped : np.ndarray
+      Semantic mask of the current frame
+  '''
+  # backward flow: current(x) ~ key(x + flow(x))
+  flow = cv2.calcOpticalFlowFarneback(
+    gray, key_gray, None,
+    pyr_scale=0.5,
+    levels=3,
+    winsize=15,
+    iterations=3,
+    poly_n=5,
+    poly_sigma=1.2,
+    flags=0,
+  )
+
+  h, w = mask.shape[:2]
+  # upscale the flow to the mask resolution
+  sy = h / flow.shape[0]
+  sx = w / flow.shape[1]
+  flow = cv2.resize(flow, dsize=(w, h), interpolation=cv2.INTER_LINEAR)
+
+  grid_y, grid_x = np.indices((h, w), dtype=np.float32)
+  map_x = grid_x + flow[..., 0] * np.float32(sx)
+  map_y = grid_y + flow[..., 1] * np.float32(sy)
+
+  return cv2.remap(
+    mask,
+    map_x,
+    map_y,
+    interpolation=cv2.INTER_NEAREST,
+    borderMode=cv2.BORDER_REPLICATE,
+  )
+
+def video_segmentation (source,
+                        tol : float = 0.5,
+                        threshold : float = 0.02,
+                        max_skip : int = 30,
+                        warp : bool = False,
+                        batch_size : int = 8,
+                        max_buffered : int = 64,
+                        pwat : bool = True,
+                        segmenter = None,
+                       ):
+  '''
+  Perform the semantic segmentation (and the PWAT estimation)
+  of the frames of a video, re-using the results between
+  consecutive similar frames.
+
+  Each frame is compared with the last frame processed by
+  the model (key frame) on their downscaled gray-scale
+  versions: if the mean absolute difference is lower than
+  the given threshold, the mask (and the PWAT score) of the
+  key frame is re-used (optionally warped according to the
+  optical flow), otherwise the frame becomes a new key frame.
+  The key frames are processed by the model in batches.
+
+  Parameters
+  ----------
+    source : cv2.VideoCapture or iterable
+      Video capture (BGR frames) or stream of RGB frames
+
+    tol : float (default := 0.5)
+      Threshold to apply on the resulting masks for the
+      output binarization
+
+    threshold : float (default := 0.02)
+      Mean absolute difference (in [0, 1] range) between the
+      downscaled frames under which the key frame results
+      are re-used; with 0 all the frames are processed
+
+    max_skip : int (default := 30)
+      Maximum number of consecutive frames which re-use the
+      key frame results, before a new inference is forced
+
+    warp : bool (default := False)
+      If True, the re-used masks are warped according to the
+      dense optical flow between the key frame and the current one
+
+    batch_size : int (default := 8)
+      Number of key frames processed by each forward pass
+
+    max_buffered : int (default := 64)
+      Maximum number of frames kept in memory while waiting
+      for the results of their key frames
+
+    pwat : bool (default := True)
+      Enable/Disable the PWAT estimation of the frames
+
+    segmenter : DeepskinSegmenter (default := None)
+      Segmentation engine to use; if None the module-level
+      cached one is used
+
+  Yields
+  ------
+    (frame, mask, pwat) : tuple
+      RGB frame, its semantic mask (ref. `wound_segmentation`)
+      and its PWAT score (None if disabled), in the same order
+      of the input frames
+
+  Examples
+  --------
+  >>> cap = cv2.VideoCapture('wound.mp4')
+  >>> for frame, mask, pwat in video_segmentation(cap, warp=True):
+  ...   print(pwat)
+  '''
+  if threshold < 0:
+    raise ValueError(f'threshold must be non-negative. Given: {threshold}')
+  if max_skip < 0:
+    raise ValueError(f'max_skip must be non-negative. Given: {max_skip}')
+  if batch_size < 1:
+    raise ValueError(f'batch_size must be positive. Given: {batch_size}')
+  if max_buffered < batch_size:
+    raise ValueError(f'max_buffered must be greater than batch_size. Given: {max_buffered}')
+
+  if segmenter is None:
+    segmenter = get_default_segmenter()
+
+  # results of the last processed key frame as (mask, pwat, flow frame)
+  last = None
+  # thumbnail of the last key frame and number of re-uses
+  key_thumb = None
+  skipped = 0
+  # frames waiting for their results as (frame, key index, flow frame)
+  # where the key index is None for the frames which re-use the results
+  # of the previous key frame
+  buffer = []
+  # key frames waiting for the inference
+  keys = []
+
+  def flush ():
+    nonlocal last
+
+    # process the key frames in a single batch
+    masks = segmenter.segment_batch(
+      images=keys,
+      tol=tol,
+      batch_size=batch_size,
+      output='mask',
+    ) if keys else []
+
+    for frame, key, gray in buffer:
+
+      if key is not None:
+        mask = masks[key]
+        score = evaluate_PWAT_score(img=frame, mask=mask) if pwat else None
+        last = (mask, score, gray)
+
+      else:
+        mask, score, key_gray = last
+        if warp:
+          mask = _warp_mask(mask, key_gray=key_gray, gray=gray)
+
+      yield frame, mask, score
+
+    buffer.clear()
+    keys.clear()
+
+  for frame in _iter_frames(source):
+
+    thumb = _thumbnail(frame)
+
+    reuse = (
+      key_thumb is not None and
+      skipped < max_skip and
+      float(np.mean(np.abs(thumb - key_thumb))) < threshold
+    )
+
+    # the optical flow requires the frames at low resolution
+    gray = _flow_gray(frame) if warp else None
+
+    if reuse:
+      skipped += 1
+      buffer.append((frame, None, gray))
+    else:
+      # new key frame
+      key_thumb = thumb
+      skipped = 0
+      buffer.append((frame, len(keys), gray))
+      keys.append(frame)
+
+    if len(keys) == batch_size or len(buffer) >= max_buffered:
+      yield from flush()
+
+  yield from flush()